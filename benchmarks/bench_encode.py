@@ -0,0 +1,235 @@
+"""Benchmarks the cost of writing video summaries with the PyTorch writer.
+
+Each case encodes a synthetic video with one of the writer's entry points
+(`summary.video`, `summary.make_video` or
+`summary.tensor_to_multitrack_mp4`) and reports its throughput, peak
+memory and output size. Cases run one at a time in fresh processes, so
+that their peak memory is measured separately.
+
+By default every parameter is swept on its own from a baseline case;
+`--grid` runs every combination instead. For example:
+
+    python benchmarks/bench_encode.py --output encode.json
+    python benchmarks/bench_encode.py --grid --targets make_video \\
+        --batch-sizes 1,4 --resolutions 640x360,1280x720 --backends pyav,ffmpeg
+
+Runs fully offline; it needs PyTorch with this repository's writer, and
+PyAV or the `ffmpeg` executable.
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import common
+
+import numpy as np
+
+_TARGETS = ("video", "make_video", "tensor_to_multitrack_mp4")
+_DTYPES = ("uint8", "float16", "float32")
+
+# Parameters of the case every sweep starts from.
+_BASELINE = {
+    "target": "video",
+    "batch_size": 2,
+    "frames": 64,
+    "resolution": "256x256",
+    "channels": 3,
+    "dtype": "uint8",
+    "crf": 23,
+    "backend": None,  # The default backend.
+}
+# Values each parameter is swept over by default.
+_SWEEPS = {
+    "target": list(_TARGETS),
+    "batch_size": [1, 2, 4, 8],
+    "frames": [16, 64, 256],
+    "resolution": ["128x128", "256x256", "640x360", "1280x720"],
+    "channels": [1, 3],
+    "dtype": list(_DTYPES),
+    "crf": [18, 23, 30],
+    "backend": None,  # Every available backend.
+}
+
+
+def synthetic_video(batch_size, channels, frames, height, width, dtype, seed=0):
+    """Returns a `(B, C, T, H, W)` video of moving waves with some noise.
+
+    Float videos are in [0, 1] and `uint8` videos in [0, 255], as the
+    writer expects. The motion gives the encoder realistic work, unlike
+    either static frames or pure noise.
+    """
+    rng = np.random.default_rng(seed)
+    video = np.empty((batch_size, channels, frames, height, width), dtype=dtype)
+    y = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None]
+    x = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :]
+    scale = 255 if dtype == "uint8" else 1
+    for b in range(batch_size):
+        for c in range(channels):
+            for t in range(frames):
+                phase = t / 32 + b / 7 + c / 3
+                frame = 0.45 + 0.45 * np.sin(2 * np.pi * (x * (c + 1) + y + phase))
+                frame += rng.random((height, width), dtype=np.float32) * 0.1
+                video[b, c, t] = (frame * scale).astype(dtype)
+    return video
+
+
+def run_case(case, repeats):
+    """Runs one case; called in a fresh process.
+
+    Returns:
+      The case's metrics, as a dict.
+    """
+    if case["backend"] is not None:
+        from video_plugin import encoder
+
+        os.environ[encoder.ENV_VAR] = case["backend"]
+    from torch.utils.tensorboard import summary
+
+    baseline_rss = common.peak_rss_bytes()
+    (width, height) = (int(n) for n in case["resolution"].split("x"))
+    tensor = synthetic_video(
+        case["batch_size"],
+        case["channels"],
+        case["frames"],
+        height,
+        width,
+        case["dtype"],
+    )
+    fps = 30
+
+    def encode():
+        if case["target"] == "video":
+            result = summary.video("benchmark", tensor, fps=fps)
+            return len(result.value[0].video.encoded_video_string)
+        if case["target"] == "make_video":
+            result = summary.make_video(tensor, fps, crf=case["crf"])
+            return len(result.encoded_video_string)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "video.mp4")
+            summary.tensor_to_multitrack_mp4(tensor, path, fps=fps, crf=case["crf"])
+            return os.path.getsize(path)
+
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output_bytes = encode()
+        seconds.append(time.perf_counter() - start)
+    median = statistics.median(seconds)
+    frames = case["batch_size"] * case["frames"]
+    input_bytes = frames * case["channels"] * height * width
+    return {
+        "seconds_median": median,
+        "seconds_min": min(seconds),
+        "frames_per_second": frames / median,
+        "input_mb_per_second": input_bytes / median / 1e6,
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "baseline_rss_bytes": baseline_rss,
+        "peak_rss_bytes": common.peak_rss_bytes(),
+    }
+
+
+def cases(args):
+    """Yields the parameters of each case to run, without duplicates."""
+    sweeps = {
+        "target": args.targets,
+        "batch_size": args.batch_sizes,
+        "frames": args.frames,
+        "resolution": args.resolutions,
+        "channels": args.channels,
+        "dtype": args.dtypes,
+        "crf": args.crfs,
+        "backend": args.backends,
+    }
+    seen = set()
+    if args.grid:
+        combinations = (
+            dict(zip(sweeps, values)) for values in itertools.product(*sweeps.values())
+        )
+    else:
+        combinations = (
+            dict(
+                _BASELINE,
+                # `video` ignores the CRF, so sweep it with `make_video`.
+                **({"target": "make_video"} if name == "crf" else {}),
+                **{name: value}
+            )
+            for (name, values) in sweeps.items()
+            for value in values
+        )
+    for case in combinations:
+        if case["target"] == "video":
+            case["crf"] = None  # `video` picks its own quality.
+        key = tuple(sorted(case.items(), key=lambda item: item[0]))
+        if key not in seen:
+            seen.add(key)
+            yield case
+
+
+def main():
+    from video_plugin import encoder
+
+    available = [
+        name for (name, backend) in encoder._BACKENDS.items() if backend.available()
+    ]
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--output", help="Path of the JSON results; default stdout.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--grid", action="store_true", help="Run every combination of values."
+    )
+    parser.add_argument("--targets", type=common.str_list, default=_SWEEPS["target"])
+    parser.add_argument(
+        "--batch-sizes", type=common.int_list, default=_SWEEPS["batch_size"]
+    )
+    parser.add_argument("--frames", type=common.int_list, default=_SWEEPS["frames"])
+    parser.add_argument(
+        "--resolutions",
+        type=common.str_list,
+        default=_SWEEPS["resolution"],
+        help="Comma-separated WIDTHxHEIGHT values.",
+    )
+    parser.add_argument("--channels", type=common.int_list, default=_SWEEPS["channels"])
+    parser.add_argument("--dtypes", type=common.str_list, default=_SWEEPS["dtype"])
+    parser.add_argument("--crfs", type=common.int_list, default=_SWEEPS["crf"])
+    parser.add_argument("--backends", type=common.str_list, default=available)
+    args = parser.parse_args()
+    for target in args.targets:
+        if target not in _TARGETS:
+            parser.error("Unknown target %r" % target)
+    for dtype in args.dtypes:
+        if dtype not in _DTYPES:
+            parser.error("Unknown dtype %r" % dtype)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases(args):
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=context
+        ) as executor:
+            metrics = executor.submit(run_case, case, args.repeats).result()
+        results.append(dict(case, **metrics))
+        print(
+            "%-26s %-36s %8.1f frames/s %7.1f MB/s %10d bytes"
+            % (
+                case["target"],
+                "b=%(batch_size)d t=%(frames)d %(resolution)s c=%(channels)d "
+                "%(dtype)s crf=%(crf)s %(backend)s" % case,
+                metrics["frames_per_second"],
+                metrics["input_mb_per_second"],
+                metrics["output_bytes"],
+            ),
+            file=sys.stderr,
+        )
+    common.write_results("encode", results, args.output, repeats=args.repeats)
+
+
+if __name__ == "__main__":
+    main()
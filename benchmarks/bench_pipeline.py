@@ -0,0 +1,319 @@
+"""Benchmarks the whole path of a video from the writer to the browser.
+
+The scenario writes video summaries for several runs into a temporary
+logdir with the PyTorch `SummaryWriter`, starts TensorBoard on it with
+the videos plugin, and then plays the part of a browser. It measures:
+
+  * how long writing took and how large the event files are;
+  * how long TensorBoard takes to start, and to ingest every video;
+  * `/tags` and `/videos` latency;
+  * time to first video: the first `/individualVideo` response of the
+    session, demuxed from scratch;
+  * `/individualVideo` latency for every track on first view (cold) and
+    on a second view (warm), and the bytes served.
+
+Cold views are made one at a time, as a user would, so the plugin may
+prefetch neighboring steps between them, as it would for that user.
+
+Results are written as JSON. Saved results can serve as a baseline: with
+`--baseline`, each metric is compared with the baseline's, and the
+script exits with status 1 if any is worse by more than `--tolerance`.
+For example:
+
+    python benchmarks/bench_pipeline.py --output baseline.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json
+
+Needs PyTorch with this repository's writer, TensorBoard, ffmpeg-python
+and the `ffmpeg` executable.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import common
+
+import numpy as np
+
+_PLUGIN_ROUTE = "/data/plugin/videos"
+
+
+def write_logdir(logdir, args):
+    """Writes the scenario's video summaries.
+
+    Returns:
+      A `(seconds, event_file_bytes)` pair.
+    """
+    from torch.utils.tensorboard import SummaryWriter
+
+    (width, height) = (int(n) for n in args.resolution.split("x"))
+    rng = np.random.default_rng(0)
+    y = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None]
+    x = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :]
+    t = np.arange(args.frames, dtype=np.float32)[:, None, None] / 32
+    start = time.perf_counter()
+    for run in range(args.runs):
+        writer = SummaryWriter(os.path.join(logdir, "run_%d" % run))
+        for step in range(args.steps):
+            for tag in range(args.tags):
+                # (B, C, T, H, W) moving waves with some noise.
+                phases = np.arange(args.batch_size * 3, dtype=np.float32) / 7
+                phases = phases[:, None, None, None] + step / 5 + run / 3
+                waves = np.sin(2 * np.pi * (x + y + t + phases))
+                frames = 0.45 + 0.45 * waves.reshape(
+                    args.batch_size, 3, args.frames, height, width
+                )
+                frames += rng.random(frames.shape, dtype=np.float32) * 0.1
+                writer.add_video(
+                    "video_%d" % tag,
+                    (frames * 255).astype(np.uint8),
+                    global_step=step,
+                    fps=args.fps,
+                )
+        writer.close()
+    seconds = time.perf_counter() - start
+    event_bytes = sum(
+        os.path.getsize(os.path.join(directory, name))
+        for (directory, _, names) in os.walk(logdir)
+        for name in names
+    )
+    return seconds, event_bytes
+
+
+def serve(logdir, port, samples):
+    """Runs TensorBoard with the videos plugin; called in a subprocess."""
+    from tensorboard import default
+    from tensorboard import program
+
+    from video_plugin import videos_plugin
+
+    server = program.TensorBoard(
+        plugins=default.get_plugins() + [videos_plugin.VideosPlugin]
+    )
+    server.configure(
+        argv=[
+            None,
+            "--logdir", logdir,
+            "--port", str(port),
+            "--reload_interval", "1",
+            "--samples_per_plugin", "videos=%d" % samples,
+            "--load_fast", "false",
+        ]
+    )
+    server.main()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+class _Browser:
+    """Fetches URLs from the TensorBoard server, timing each request."""
+
+    def __init__(self, port):
+        self._base = "http://localhost:%d" % port
+        self.bytes_served = 0
+
+    def get(self, path):
+        """Returns `(seconds, body)`, raising `urllib.error.URLError`."""
+        start = time.perf_counter()
+        with urllib.request.urlopen(self._base + path) as response:
+            body = response.read()
+        self.bytes_served += len(body)
+        return time.perf_counter() - start, body
+
+    def get_json(self, path):
+        (seconds, body) = self.get(path)
+        return seconds, json.loads(body)
+
+
+def _wait_for(predicate, deadline, interval=0.05):
+    """Polls `predicate` until it is true; returns when that happened."""
+    while True:
+        try:
+            if predicate():
+                return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        if time.perf_counter() > deadline:
+            raise TimeoutError("TensorBoard did not get ready in time")
+        time.sleep(interval)
+
+
+def measure(args, logdir):
+    """Starts TensorBoard on `logdir` and measures it.
+
+    Returns:
+      A list of metric records.
+    """
+    port = _free_port()
+    browser = _Browser(port)
+    runs = ["run_%d" % i for i in range(args.runs)]
+    tags = ["video_%d" % i for i in range(args.tags)]
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--serve",
+            logdir,
+            str(port),
+            str(args.steps),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + args.timeout
+        started = _wait_for(
+            lambda: browser.get("/data/plugins_listing") is not None, deadline
+        )
+
+        def ingested():
+            (_, index) = browser.get_json(_PLUGIN_ROUTE + "/tags")
+            if any(tag not in index.get(run, {}) for run in runs for tag in tags):
+                return False
+            for run in runs:
+                for tag in tags:
+                    (_, videos) = browser.get_json(
+                        _PLUGIN_ROUTE
+                        + "/videos?"
+                        + urllib.parse.urlencode({"run": run, "tag": tag})
+                    )
+                    if len(videos) < args.steps:
+                        return False
+            return True
+
+        ingested_at = _wait_for(ingested, deadline, interval=0.25)
+        browser.bytes_served = 0
+
+        tags_seconds = [
+            browser.get(_PLUGIN_ROUTE + "/tags")[0] for _ in range(args.repeats)
+        ]
+        videos_seconds = []
+        video_queries = []
+        for run in runs:
+            for tag in tags:
+                (seconds, videos) = browser.get_json(
+                    _PLUGIN_ROUTE
+                    + "/videos?"
+                    + urllib.parse.urlencode({"run": run, "tag": tag})
+                )
+                videos_seconds.append(seconds)
+                for video in videos:
+                    for track in range(video["batch_size"]):
+                        video_queries.append(
+                            "%s/individualVideo?%s&track_number=%d"
+                            % (_PLUGIN_ROUTE, video["query"], track)
+                        )
+        cold_seconds = [browser.get(query)[0] for query in video_queries]
+        cold_bytes = browser.bytes_served
+        warm_seconds = [browser.get(query)[0] for query in video_queries]
+    finally:
+        server.terminate()
+        server.wait()
+
+    def metric(name, value, unit):
+        return {"metric": name, "value": value, "unit": unit}
+
+    def latencies(name, seconds):
+        return [
+            metric("%s_p50" % name, common.percentile(seconds, 0.5), "s"),
+            metric("%s_p95" % name, common.percentile(seconds, 0.95), "s"),
+        ]
+
+    return (
+        [
+            metric("server_start", started - start, "s"),
+            metric("ingestion", ingested_at - start, "s"),
+            metric("time_to_first_video", cold_seconds[0], "s"),
+        ]
+        + latencies("tags_latency", tags_seconds)
+        + latencies("videos_latency", videos_seconds)
+        + latencies("individual_video_cold_latency", cold_seconds)
+        + latencies("individual_video_warm_latency", warm_seconds)
+        + [metric("individual_video_bytes_served", cold_bytes, "bytes")]
+    )
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        # Internal: the TensorBoard server process started by `measure`.
+        (logdir, port, samples) = sys.argv[2:]
+        serve(logdir, int(port), int(samples))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--output", help="Path of the JSON results; default stdout.")
+    parser.add_argument("--baseline", help="Results to compare against.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Fraction by which a metric may exceed the baseline.",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--tags", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=2, help="Tracks per video.")
+    parser.add_argument("--frames", type=int, default=48)
+    parser.add_argument("--resolution", default="320x240", help="WIDTHxHEIGHT.")
+    parser.add_argument("--fps", type=float, default=24.0)
+    parser.add_argument(
+        "--repeats", type=int, default=20, help="Number of /tags requests."
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300.0, help="Seconds to wait for ingestion."
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as logdir:
+        (write_seconds, event_bytes) = write_logdir(logdir, args)
+        results = [
+            {"metric": "write", "value": write_seconds, "unit": "s"},
+            {"metric": "event_file_bytes", "value": event_bytes, "unit": "bytes"},
+        ] + measure(args, logdir)
+    for result in results:
+        print(
+            "%-36s %14.4f %s" % (result["metric"], result["value"], result["unit"]),
+            file=sys.stderr,
+        )
+    config = dict(vars(args))
+    for option in ("output", "baseline", "tolerance"):
+        del config[option]
+    extra = {"config": config}
+    regressed = False
+    if args.baseline is not None:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+        if baseline.get("config") != config:
+            print("Warning: the baseline ran a different scenario", file=sys.stderr)
+        comparisons = common.compare(results, baseline, args.tolerance)
+        for comparison in comparisons:
+            print(
+                "%-36s %6.2fx baseline%s"
+                % (
+                    comparison["metric"],
+                    comparison["ratio"] or 0,
+                    "  REGRESSED" if comparison["regressed"] else "",
+                ),
+                file=sys.stderr,
+            )
+        regressed = any(comparison["regressed"] for comparison in comparisons)
+        extra["comparison"] = {"tolerance": args.tolerance, "metrics": comparisons}
+    common.write_results("pipeline", results, args.output, **extra)
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""Benchmarks the videos plugin's HTTP endpoints against in-memory data.
+
+`VideosPlugin` is given a fake data provider serving synthetic multitrack
+videos for a configurable number of runs, tags and steps, and its
+endpoints are driven through a WSGI test client from several threads at
+once. For each phase it reports latency percentiles, throughput, and the
+number of subprocesses started and temporary files left behind:
+
+  * `tags`: `/tags` requests.
+  * `videos`: `/videos` listings of each time series.
+  * `individualVideo-cold`: the first request for each track, which
+    demuxes its video.
+  * `individualVideo-warm`: the same requests again, served from the
+    track cache.
+
+Cold requests also queue demuxing of neighboring steps, as they would in
+TensorBoard, so cold latency includes that background work. For example:
+
+    python benchmarks/bench_serve.py --runs 2 --tags 2 --steps 10 \\
+        --tracks 4 --concurrency 8 --output serve.json
+
+Needs TensorBoard, ffmpeg-python and the `ffmpeg` executable.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import common
+
+import numpy as np
+from tensorboard.data import provider
+from tensorboard.plugins import base_plugin
+from werkzeug import test as werkzeug_test
+
+from video_plugin import encoder
+from video_plugin import metadata
+from video_plugin import videos_plugin
+
+
+class FakeDataProvider(provider.DataProvider):
+    """Serves the same video blob at every step of every time series.
+
+    Each step has its own blob keys, so that the plugin treats every
+    step as a separate video.
+    """
+
+    def __init__(self, runs, tags, steps, batch_size, video):
+        self._runs = ["run_%d" % i for i in range(runs)]
+        self._tags = ["tag_%d" % i for i in range(tags)]
+        self._steps = steps
+        plugin_content = metadata.create_summary_metadata(
+            display_name=None, description=None
+        ).plugin_data.content
+        self._time_series = provider.BlobSequenceTimeSeries(
+            max_step=steps - 1,
+            max_wall_time=float(steps - 1),
+            max_length=3,
+            plugin_content=plugin_content,
+            description="",
+            display_name="",
+        )
+        self._blobs = {"batch_size": str(batch_size).encode(), "video": video}
+
+    def data_location(self, ctx, *, experiment_id):
+        return "memory"
+
+    def list_plugins(self, ctx, *, experiment_id):
+        return [metadata.PLUGIN_NAME]
+
+    def list_runs(self, ctx, *, experiment_id):
+        return [provider.Run(run_id=run, run_name=run, start_time=0.0) for run in self._runs]
+
+    def list_scalars(self, ctx, *, experiment_id, plugin_name, run_tag_filter=None):
+        return {}
+
+    def read_scalars(
+        self, ctx, *, experiment_id, plugin_name, downsample=None, run_tag_filter=None
+    ):
+        return {}
+
+    def read_last_scalars(self, ctx, *, experiment_id, plugin_name, run_tag_filter=None):
+        return {}
+
+    def list_tensors(self, ctx, *, experiment_id, plugin_name, run_tag_filter=None):
+        return {}
+
+    def read_tensors(
+        self, ctx, *, experiment_id, plugin_name, downsample=None, run_tag_filter=None
+    ):
+        return {}
+
+    def _filtered(self, run_tag_filter):
+        runs = self._runs
+        tags = self._tags
+        if run_tag_filter is not None:
+            if run_tag_filter.runs is not None:
+                runs = [run for run in runs if run in run_tag_filter.runs]
+            if run_tag_filter.tags is not None:
+                tags = [tag for tag in tags if tag in run_tag_filter.tags]
+        return runs, tags
+
+    def list_blob_sequences(
+        self, ctx, *, experiment_id, plugin_name, run_tag_filter=None
+    ):
+        (runs, tags) = self._filtered(run_tag_filter)
+        return {run: {tag: self._time_series for tag in tags} for run in runs}
+
+    def read_blob_sequences(
+        self, ctx, *, experiment_id, plugin_name, downsample=None, run_tag_filter=None
+    ):
+        (runs, tags) = self._filtered(run_tag_filter)
+        return {
+            run: {
+                tag: [
+                    provider.BlobSequenceDatum(
+                        step=step,
+                        wall_time=float(step),
+                        values=tuple(
+                            provider.BlobReference(
+                                blob_key="%s/%s/%d/%s" % (run, tag, step, kind)
+                            )
+                            for kind in ("dimensions", "batch_size", "video")
+                        ),
+                    )
+                    for step in range(self._steps)
+                ][-(downsample or self._steps) :]
+                for tag in tags
+            }
+            for run in runs
+        }
+
+    def read_blob(self, ctx, *, blob_key):
+        kind = blob_key.rsplit("/", 1)[-1]
+        return self._blobs.get(kind, b"")
+
+
+def synthetic_video(tracks, frames, width, height, fps):
+    """Returns a multitrack MP4 file of moving gradients with some noise."""
+    rng = np.random.default_rng(0)
+    y = np.linspace(0.0, 1.0, height, dtype=np.float32)[None, :, None, None]
+    x = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, None, :, None]
+    t = np.arange(frames, dtype=np.float32)[:, None, None, None] / 32
+    videos = []
+    for track in range(tracks):
+        phase = np.array([0.0, 1 / 3, 2 / 3], dtype=np.float32) + track / 7
+        frame = 0.45 + 0.45 * np.sin(2 * np.pi * (x + y + t + phase))
+        frame += rng.random(frame.shape, dtype=np.float32) * 0.1
+        videos.append((frame * 255).astype(np.uint8))
+    return encoder.encode(videos, fps)
+
+
+class _SubprocessCounter:
+    """Counts the processes started with `subprocess.Popen`."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._popen_init = subprocess.Popen.__init__
+
+    def __enter__(self):
+        counter = self
+        popen_init = self._popen_init
+
+        def counting_init(popen, *args, **kwargs):
+            with counter._lock:
+                counter.count += 1
+            popen_init(popen, *args, **kwargs)
+
+        subprocess.Popen.__init__ = counting_init
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        subprocess.Popen.__init__ = self._popen_init
+
+
+def _count_files(directory):
+    return sum(len(files) for (_, _, files) in os.walk(directory))
+
+
+def run_phase(name, app, paths, concurrency, temp_dir, idle):
+    """Requests every path, `concurrency` at a time, and measures them.
+
+    Args:
+      idle: Called after the last response; waits for background work,
+        so that subprocesses it starts are counted in this phase.
+
+    Returns:
+      The phase's result record.
+    """
+    statuses = {}
+    lock = threading.Lock()
+
+    def request(path):
+        client = werkzeug_test.Client(app)
+        start = time.perf_counter()
+        response = client.get(path)
+        size = len(response.get_data())
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return elapsed, size
+
+    with _SubprocessCounter() as subprocesses:
+        files_before = _count_files(temp_dir)
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            measurements = list(executor.map(request, paths))
+        wall_seconds = time.perf_counter() - start
+        idle()
+    latencies = [elapsed for (elapsed, _) in measurements]
+    return {
+        "phase": name,
+        "requests": len(paths),
+        "concurrency": concurrency,
+        "statuses": {str(code): count for (code, count) in sorted(statuses.items())},
+        "latency_p50": common.percentile(latencies, 0.50),
+        "latency_p95": common.percentile(latencies, 0.95),
+        "latency_p99": common.percentile(latencies, 0.99),
+        "latency_max": max(latencies) if latencies else None,
+        "requests_per_second": len(paths) / wall_seconds if wall_seconds else None,
+        "bytes_served": sum(size for (_, size) in measurements),
+        "subprocesses": subprocesses.count,
+        "temp_files_added": _count_files(temp_dir) - files_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--output", help="Path of the JSON results; default stdout.")
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--tags", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--tracks", type=int, default=4, help="Tracks per video.")
+    parser.add_argument("--frames", type=int, default=60, help="Frames per track.")
+    parser.add_argument(
+        "--resolution", default="320x240", help="WIDTHxHEIGHT of each track."
+    )
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--tags-requests", type=int, default=100, help="Number of /tags requests."
+    )
+    args = parser.parse_args()
+    (width, height) = (int(n) for n in args.resolution.split("x"))
+
+    video = synthetic_video(args.tracks, args.frames, width, height, args.fps)
+    data_provider = FakeDataProvider(
+        args.runs, args.tags, args.steps, args.tracks, video
+    )
+    with tempfile.TemporaryDirectory(prefix="bench-serve-") as temp_dir:
+        # The plugin's track cache goes in a temporary directory of its
+        # own, which is where temporary files are counted.
+        tempfile.tempdir = temp_dir
+        try:
+            plugin = videos_plugin.VideosPlugin(
+                base_plugin.TBContext(data_provider=data_provider)
+            )
+        finally:
+            tempfile.tempdir = None
+        apps = plugin.get_plugin_apps()
+
+        def app(environ, start_response):
+            return apps[environ["PATH_INFO"]](environ, start_response)
+
+        def idle():
+            plugin._prefetcher.wait_idle(timeout=600)
+
+        series = [
+            (run, tag)
+            for run in data_provider._runs
+            for tag in data_provider._tags
+        ]
+        tracks = [
+            "/individualVideo?"
+            + urllib.parse.urlencode(
+                {
+                    "blob_key": "%s/%s/%d/video" % (run, tag, step),
+                    "track_number": track,
+                }
+            )
+            for (run, tag) in series
+            for step in range(args.steps)
+            for track in range(args.tracks)
+        ]
+        phases = [
+            ("tags", ["/tags"] * args.tags_requests),
+            (
+                "videos",
+                [
+                    "/videos?" + urllib.parse.urlencode({"run": run, "tag": tag})
+                    for (run, tag) in series
+                ],
+            ),
+            ("individualVideo-cold", tracks),
+            ("individualVideo-warm", tracks),
+        ]
+        results = []
+        for (name, paths) in phases:
+            result = run_phase(name, app, paths, args.concurrency, temp_dir, idle)
+            results.append(result)
+            print(
+                "%-22s %5d requests  p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms"
+                "  %7.1f req/s  %3d subprocesses"
+                % (
+                    name,
+                    result["requests"],
+                    1000 * (result["latency_p50"] or 0),
+                    1000 * (result["latency_p95"] or 0),
+                    1000 * (result["latency_p99"] or 0),
+                    result["requests_per_second"] or 0,
+                    result["subprocesses"],
+                ),
+                file=sys.stderr,
+            )
+    config = dict(vars(args), blob_bytes=len(video))
+    del config["output"]
+    common.write_results("serve", results, args.output, config=config)
+
+
+if __name__ == "__main__":
+    main()
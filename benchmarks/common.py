@@ -0,0 +1,156 @@
+"""Shared helpers of the benchmark scripts in this directory.
+
+Every benchmark writes one JSON document: the name of the benchmark, a
+description of the machine and software it ran on, and a list of result
+records, one per case, each holding the case's parameters and measured
+metrics.
+"""
+
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+# Lets the scripts import `video_plugin` from a source checkout without
+# installing it first.
+_PLUGIN_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tensorboard"
+)
+if _PLUGIN_DIR not in sys.path:
+    sys.path.insert(0, _PLUGIN_DIR)
+
+
+def environment():
+    """Describes the machine and the software versions benchmarked."""
+    import numpy as np
+
+    from video_plugin import encoder
+
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "encoders": [
+            name
+            for (name, backend) in encoder._BACKENDS.items()
+            if backend.available()
+        ],
+        "ffmpeg": _ffmpeg_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    for module in ("av", "torch", "tensorboard"):
+        try:
+            env[module] = __import__(module).__version__
+        except ImportError:
+            env[module] = None
+    return env
+
+
+def _ffmpeg_version():
+    if shutil.which("ffmpeg") is None:
+        return None
+    output = subprocess.run(
+        ["ffmpeg", "-version"], capture_output=True, text=True
+    ).stdout
+    return output.split("\n", 1)[0]
+
+
+def peak_rss_bytes():
+    """Returns the peak resident set size of this process and its children.
+
+    The peak of all waited-for children is counted as a whole, which
+    covers `ffmpeg` processes run by the encoder.
+    """
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return max(self_peak, children_peak) * scale
+
+
+def percentile(values, fraction):
+    """Returns the `fraction` percentile of `values`, interpolated."""
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def write_results(benchmark, results, output=None, **extra):
+    """Writes the results document to `output`, or to stdout.
+
+    Args:
+      benchmark: Name of the benchmark.
+      results: List of result records, as dicts.
+      output: Optional path to write to.
+      **extra: Further top-level fields to include.
+    """
+    document = {
+        "benchmark": benchmark,
+        "environment": environment(),
+        "results": results,
+    }
+    document.update(extra)
+    text = json.dumps(document, indent=2, sort_keys=True) + "\n"
+    if output is None:
+        sys.stdout.write(text)
+    else:
+        with open(output, "w") as outfile:
+            outfile.write(text)
+
+
+def int_list(text):
+    return [int(value) for value in text.split(",")]
+
+
+def str_list(text):
+    return text.split(",")
+
+
+def compare(results, baseline, tolerance):
+    """Compares metric records with those of a baseline results document.
+
+    Records are matched by their `metric` field, and compared by their
+    `value`, which is better lower unless `higher_is_better` is set.
+
+    Args:
+      results: List of result records with `metric` and `value` fields.
+      baseline: A results document, as written by `write_results`.
+      tolerance: Fraction by which a value may be worse than the baseline
+        before it counts as a regression.
+
+    Returns:
+      A list of comparison records, one per metric in both.
+    """
+    baseline_values = {
+        record["metric"]: record["value"] for record in baseline["results"]
+    }
+    comparisons = []
+    for record in results:
+        old = baseline_values.get(record["metric"])
+        new = record["value"]
+        if old is None or new is None:
+            continue
+        ratio = new / old if old else None
+        if record.get("higher_is_better"):
+            regressed = new < old * (1 - tolerance)
+        else:
+            regressed = new > old * (1 + tolerance)
+        comparisons.append(
+            {
+                "metric": record["metric"],
+                "value": new,
+                "baseline": old,
+                "ratio": ratio,
+                "regressed": regressed,
+            }
+        )
+    return comparisons
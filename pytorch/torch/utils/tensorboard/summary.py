@@ -1,8 +1,13 @@
 # mypy: allow-untyped-defs
+import collections
+import hashlib
 import json
 import logging
+import math
 import os
 import struct
+import threading
+import time
 
 from typing import Any, List, Optional
 
@@ -39,7 +44,14 @@ __all__ = [
     "draw_boxes",
     "make_image",
     "video",
+    "encoded_video",
     "make_video",
+    "set_video_budget",
+    "set_video_scheduler",
+    "set_video_dedup_cache",
+    "VideoEncodeScheduler",
+    "VideoDedupCache",
+    "VideoStream",
     "audio",
     "custom_scalars",
     "text",
@@ -639,21 +651,436 @@ def make_image(tensor, rescale=1, rois=None, labels=None):
     )
 
 
-def video(tag, tensor, fps=4):
+# x264 constant rate factors: the default quality, and the lowest quality
+# the byte budget may lower it to.
+_DEFAULT_CRF = 23
+_MAX_CRF = 51
+# Size limits applied by `video` unless overridden per call; see
+# `set_video_budget`.
+_video_budget = {
+    "max_bytes": None,
+    "max_resolution": None,
+    "max_frames": None,
+    "max_memory": None,
+}
+
+def set_video_budget(
+    max_bytes=None, max_resolution=None, max_frames=None, max_memory=None
+):
+    """Sets the default size limits of videos written by `video`.
+
+    The limits apply to every later `video` call, and so to every
+    `SummaryWriter.add_video`, that does not pass its own. See `video` for
+    the meaning of each limit; `None` disables it.
+    """
+    _video_budget.update(
+        max_bytes=max_bytes,
+        max_resolution=max_resolution,
+        max_frames=max_frames,
+        max_memory=max_memory,
+    )
+
+# Default scheduler of `video`; see `set_video_scheduler`.
+_video_scheduler = None
+# x264 preset used when a scheduler degrades an encode.
+_DEGRADED_PRESET = "ultrafast"
+
+class VideoEncodeScheduler:
+    """Keeps the time spent encoding videos within a budget.
+
+    The budget is either a fraction of wall-clock time or a number of
+    seconds per interval; unused budget accumulates for at most one
+    interval. Before each encode, `plan` decides from the remaining
+    budget and the measured cost of recent encodes whether to encode the
+    video in full, degraded (halved resolution and a faster x264 preset),
+    or to skip it. Counts of each decision are kept in `counters`.
+
+    Pass a scheduler to `video`, or set a default for all calls with
+    `set_video_scheduler`.
+    """
+
+    FULL = "full"
+    DEGRADED = "degraded"
+    SKIPPED = "skipped"
+
+    def __init__(self, max_fraction=None, max_seconds=None, interval=60.0):
+        """Creates a scheduler.
+
+        Args:
+          max_fraction: Fraction of wall-clock time that encoding may take.
+          max_seconds: Seconds of encoding allowed per `interval`.
+          interval: Length in seconds of the window over which the budget
+            is enforced.
+
+        Exactly one of `max_fraction` and `max_seconds` must be given.
+        """
+        if (max_fraction is None) == (max_seconds is None):
+            raise ValueError("Specify exactly one of max_fraction and max_seconds")
+        if max_fraction is not None:
+            self._rate = max_fraction
+        else:
+            self._rate = max_seconds / interval
+        self._capacity = self._rate * interval
+        self._balance = self._capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        # Mode -> moving average of encode seconds.
+        self._costs = {}
+        self.counters = {self.FULL: 0, self.DEGRADED: 0, self.SKIPPED: 0}
+        self.encode_seconds = 0.0
+
+    def plan(self):
+        """Decides how to encode the next video.
+
+        Returns:
+          One of `FULL`, `DEGRADED` and `SKIPPED`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._balance = min(
+                self._capacity, self._balance + self._rate * (now - self._last)
+            )
+            self._last = now
+            full_cost = self._costs.get(self.FULL, 0.0)
+            # Until measured, assume a quarter of the pixels cost a quarter
+            # of the time.
+            degraded_cost = self._costs.get(self.DEGRADED, full_cost / 4)
+            if self._balance <= 0:
+                mode = self.SKIPPED
+            elif self._balance >= full_cost:
+                mode = self.FULL
+            elif self._balance >= degraded_cost:
+                mode = self.DEGRADED
+            else:
+                mode = self.SKIPPED
+            self.counters[mode] += 1
+            return mode
+
+    def record(self, mode, seconds):
+        """Charges an encode planned as `mode` that took `seconds`."""
+        with self._lock:
+            self._balance -= seconds
+            self.encode_seconds += seconds
+            previous = self._costs.get(mode)
+            self._costs[mode] = (
+                seconds if previous is None else (previous + seconds) / 2
+            )
+
+def set_video_scheduler(scheduler):
+    """Sets the scheduler of `video` calls that do not pass their own.
+
+    Args:
+      scheduler: A `VideoEncodeScheduler`, or `None` to always encode.
+    """
+    global _video_scheduler
+    _video_scheduler = scheduler
+
+# Default deduplication cache of `video`; see `set_video_dedup_cache`.
+_video_dedup_cache = None
+
+class VideoDedupCache:
+    """Remembers recently written videos, to avoid writing them again.
+
+    With a cache, `video` hashes the converted frames together with the
+    encoding settings. If the digest matches a recent video, it writes a
+    small reference to that video instead of encoding it again, which
+    TensorBoard resolves to the original when the video is viewed. The
+    original must therefore be in the same logdir, under the tag recorded
+    in the reference, and still loaded by TensorBoard when the reference
+    is viewed. Deferred videos are not deduplicated.
+
+    TensorBoard only keeps a random sample of each tag's videos (10 per
+    run by default), so an original may be dropped while references to
+    it remain, and those references then cannot be shown. To bound how
+    many references depend on one original, a duplicate of a video
+    written more than `max_age` videos earlier under its tag is written
+    in full again and becomes the original of later duplicates. Only
+    with `--samples_per_plugin videos=0`, which keeps every video, are
+    all references guaranteed to resolve.
+
+    Pass a cache to `video`, or set a default for all calls with
+    `set_video_dedup_cache`. Counts of `hits` and `misses` are kept.
+    """
+
+    def __init__(self, max_entries=256, max_age=8):
+        """Creates a cache of the digests of up to `max_entries` videos.
+
+        Args:
+          max_entries: Most digests to remember.
+          max_age: Most videos that may be written under the tag of an
+            original after it for a duplicate to still refer to it, or
+            `None` for no limit.
+        """
+        self._max_entries = max_entries
+        self._max_age = max_age
+        # Digest -> (tag, crf, write count of the tag) of the original,
+        # most recently used last.
+        self._entries = collections.OrderedDict()
+        # Tag -> number of videos looked up under it.
+        self._writes = collections.Counter()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, digest, tag):
+        """Returns the `(tag, crf)` of a video with `digest`, or `None`.
+
+        Each call counts as a video written under `tag`. Originals older
+        than `max_age` are not returned.
+        """
+        with self._lock:
+            self._writes[tag] += 1
+            entry = self._entries.get(digest)
+            if entry is not None and self._max_age is not None:
+                (original_tag, _, written) = entry
+                if self._writes[original_tag] - written > self._max_age:
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(digest)
+            return entry[:2]
+
+    def add(self, digest, tag, crf):
+        """Records a video written under `tag` with the given CRF."""
+        with self._lock:
+            self._entries[digest] = (tag, crf, self._writes[tag])
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+def set_video_dedup_cache(cache):
+    """Sets the deduplication cache of `video` calls that do not pass their own.
+
+    Args:
+      cache: A `VideoDedupCache`, or `None` to always write videos in full.
+    """
+    global _video_dedup_cache
+    _video_dedup_cache = cache
+
+def video(
+    tag,
+    tensor,
+    fps=4,
+    fragment_duration=None,
+    keyframe_interval=None,
+    max_bytes=None,
+    max_resolution=None,
+    max_frames=None,
+    scheduler=None,
+    deferred=False,
+    workers=None,
+    max_memory=None,
+    dedup_cache=None,
+):
+    """Output a `Summary` protocol buffer with a multitrack MP4 video.
+
+    Videos over budget are reduced before encoding: frames are dropped at
+    a regular stride (lowering the frame rate to keep the duration) and
+    downscaled by an integer factor. If the encoded video is still too
+    large, it is re-encoded at lower quality. The reductions applied are
+    recorded in the summary metadata.
+
+    Args:
+      tag: A name for the generated node.
+      tensor: A 5-D video tensor; each batch element becomes one track.
+      fps: Frames per second of the video.
+      fragment_duration: Optional; if given, write fragmented MP4 with
+        fragments of about this many seconds, so TensorBoard can start
+        playing long videos before they are fully downloaded.
+      keyframe_interval: Optional; maximum number of frames between
+        keyframes. Shorter intervals make seeking cheaper at the cost of
+        larger files. Defaults to the encoder's choice, or to one
+        fragment when `fragment_duration` is given.
+      max_bytes: Optional; target maximum size of the encoded video.
+      max_resolution: Optional; maximum frame size, either as a
+        `(width, height)` pair or as a single limit for both.
+      max_frames: Optional; maximum number of frames per track.
+      scheduler: Optional; a `VideoEncodeScheduler` that may degrade or
+        skip the video to keep encode time within its budget. Defaults
+        to the one set with `set_video_scheduler`.
+      deferred: Optional; if true, store the frames losslessly compressed
+        instead of encoding them, and leave encoding to TensorBoard when
+        the video is first viewed. This is much cheaper for the writer
+        but yields larger event files; `fragment_duration`,
+        `keyframe_interval` and `max_bytes` do not apply.
+      workers: Optional; if greater than 1, encode the tracks in up to
+        this many worker processes, which receive the frames through
+        shared memory instead of copies sent over pipes. Workers are
+        spawned and re-import the main script, so its top-level code
+        must be under `if __name__ == "__main__":`; scripts without that
+        guard encode in this process instead, with a warning.
+      max_memory: Optional; approximate limit, in bytes, on the memory
+        used to convert and encode the video, beyond the input tensor
+        itself. Frames are then converted and fed to the encoder a chunk
+        at a time instead of all at once. The encoder's own buffers are
+        not counted, and `deferred` videos still need room for all their
+        converted frames.
+      dedup_cache: Optional; a `VideoDedupCache`. If it holds a recent
+        video with the same frames and settings, write a reference to it
+        instead of encoding the video again. Defaults to the one set with
+        `set_video_dedup_cache`.
+
+    The `max_*` limits default to those set with `set_video_budget`.
+
+    Returns:
+      The summary, which has no values if the scheduler skipped the video.
+    """
+    if scheduler is None:
+        scheduler = _video_scheduler
+    if dedup_cache is None:
+        dedup_cache = _video_dedup_cache
+    mode = VideoEncodeScheduler.FULL
+    if scheduler is not None:
+        mode = scheduler.plan()
+        if mode == VideoEncodeScheduler.SKIPPED:
+            return Summary()
+    start_time = time.monotonic()
+    if max_bytes is None:
+        max_bytes = _video_budget["max_bytes"]
+    if max_resolution is None:
+        max_resolution = _video_budget["max_resolution"]
+    if max_frames is None:
+        max_frames = _video_budget["max_frames"]
+    if max_memory is None:
+        max_memory = _video_budget["max_memory"]
     tensor = make_np(tensor)
     # If user passes in uint8, then we don't need to rescale by 255
     scale_factor = _calc_scale_factor(tensor)
-    tensor = tensor.astype(np.float32)
-    tensor = (tensor * scale_factor).clip(0, 255).astype(np.uint8)
-    video = make_video(tensor, fps)
-    plugin_data = SummaryMetadata.PluginData(plugin_name="videos")
-    data_class = DataClass.DATA_CLASS_BLOB_SEQUENCE
+    (batch_size, channels, frames, height, width) = tensor.shape
+    frame_stride = _frame_stride(frames, max_frames)
+    if frame_stride > 1:
+        frames = len(range(0, frames, frame_stride))
+        fps = fps / frame_stride
+    downscale = _downscale_factor(height, width, max_resolution)
+    downscales = [downscale]
+    (height, width) = _downscaled_size(height, width, downscale)
+    preset = None
+    if mode == VideoEncodeScheduler.DEGRADED:
+        preset = _DEGRADED_PRESET
+        if min(height, width) >= 4:
+            downscales.append(2)
+            downscale *= 2
+            (height, width) = _downscaled_size(height, width, 2)
+    if max_memory is None:
+        chunk_frames = frames
+    else:
+        # Per output frame: the float32 and uint8 conversions of a source
+        # frame of one track, and converted RGB frames waiting for the
+        # encoder, one per track plus the one being replaced.
+        frame_bytes = (
+            5 * channels * tensor.shape[3] * tensor.shape[4]
+            + 3 * (batch_size + 1) * height * width
+        )
+        chunk_frames = max(1, min(frames, max_memory // frame_bytes))
+
+    def convert(start, stop, tracks=slice(None)):
+        """Converts output frames `start:stop` of `tracks` to uint8."""
+        chunk = tensor[
+            tracks, :, start * frame_stride : stop * frame_stride : frame_stride
+        ]
+        chunk = _quantize_frames(chunk, scale_factor)
+        for factor in downscales:
+            if factor > 1 or chunk.shape[3] % 2 or chunk.shape[4] % 2:
+                chunk = _downscale_frames(chunk, factor)
+        return chunk
+
+    if deferred:
+        from video_plugin import raw_video
+
+        fragment_duration = keyframe_interval = crf = None
+        converted = np.empty((batch_size, channels, frames, height, width), np.uint8)
+        for start in range(0, frames, chunk_frames):
+            converted[:, :, start : start + chunk_frames] = convert(
+                start, start + chunk_frames
+            )
+        video = Summary.Video(
+            batch_size=batch_size,
+            encoded_video_string=raw_video.encode(converted, fps),
+        )
+    else:
+        if chunk_frames >= frames:
+            converted = convert(0, frames)
+            chunks = [converted]
+
+            def make_tracks():
+                return list(np.transpose(converted, (0, 2, 3, 4, 1)))
+
+        else:
+            chunks = (
+                convert(start, start + chunk_frames)
+                for start in range(0, frames, chunk_frames)
+            )
+
+            def make_tracks():
+                return [
+                    _converted_track(convert, index, frames, chunk_frames)
+                    for index in range(batch_size)
+                ]
+
+        original = digest = None
+        if dedup_cache is not None:
+            digest = _video_digest(
+                chunks,
+                (batch_size, channels, frames, height, width),
+                fps,
+                fragment_duration,
+                keyframe_interval,
+                max_bytes,
+                preset,
+            )
+            original = dedup_cache.lookup(digest, tag)
+        if original is not None:
+            from video_plugin import dedup
+
+            (original_tag, crf) = original
+            keyframe_interval = _keyframe_interval(
+                fps, keyframe_interval, fragment_duration
+            )
+            video = Summary.Video(
+                batch_size=batch_size,
+                encoded_video_string=dedup.encode_reference(digest, original_tag),
+            )
+        else:
+            (video, keyframe_interval, crf) = _encode_within_budget(
+                tag,
+                make_tracks,
+                batch_size,
+                fps,
+                fragment_duration,
+                keyframe_interval,
+                max_bytes,
+                preset,
+                workers,
+            )
+            if digest is not None:
+                from video_plugin import dedup
+
+                video = Summary.Video(
+                    batch_size=batch_size,
+                    encoded_video_string=dedup.append_digest(
+                        video.encoded_video_string, digest
+                    ),
+                )
+                dedup_cache.add(digest, tag, crf)
+    if scheduler is not None:
+        scheduler.record(mode, time.monotonic() - start_time)
     res = Summary(
         value=[
             Summary.Value(
                 tag=tag,
-                metadata=SummaryMetadata(
-                    plugin_data=plugin_data, data_class=data_class
+                metadata=_video_summary_metadata(
+                    fragmented=fragment_duration is not None,
+                    keyframe_interval=keyframe_interval,
+                    width=width,
+                    height=height,
+                    fps=fps,
+                    frames=frames,
+                    frame_stride=frame_stride,
+                    downscale=downscale,
+                    crf=crf,
+                    deferred=deferred,
                 ),
                 video=video, # WE STILL NEED TO MAKE SURE THAT THE video DATA TYPE IN TENSORBOARD IS CREATED
             )
@@ -661,53 +1088,541 @@ def video(tag, tensor, fps=4):
     )
     return res
 
-def make_video(tensor, fps):
+def _encode_within_budget(
+    tag,
+    make_tracks,
+    batch_size,
+    fps,
+    fragment_duration,
+    keyframe_interval,
+    max_bytes,
+    preset,
+    workers,
+):
+    """Encodes a video, lowering its quality until it fits `max_bytes`.
+
+    `make_tracks` returns the tracks to pass to the encoder, afresh for
+    each attempt.
+
+    Returns:
+      A `(video, keyframe_interval, crf)` tuple of the `Summary.Video` and
+      the settings it was encoded with.
+    """
+    keyframe_interval = _keyframe_interval(
+        fps, keyframe_interval, fragment_duration
+    )
+    from video_plugin import encoder
+
+    crf = _DEFAULT_CRF
+    while True:
+        video = Summary.Video(
+            batch_size=batch_size,
+            encoded_video_string=encoder.encode(
+                make_tracks(),
+                fps,
+                crf=crf,
+                keyframe_interval=keyframe_interval,
+                fragment_duration=fragment_duration,
+                preset=preset,
+                workers=workers,
+            ),
+        )
+        size = len(video.encoded_video_string)
+        if max_bytes is None or size <= max_bytes or crf >= _MAX_CRF:
+            break
+        # x264 output roughly halves in size for every 6 steps of CRF.
+        crf = min(_MAX_CRF, crf + max(1, math.ceil(6 * math.log2(size / max_bytes))))
+    if max_bytes is not None and size > max_bytes:
+        logger.warning(
+            "Video %r is %d bytes even at the lowest quality, over its budget of %d.",
+            tag,
+            size,
+            max_bytes,
+        )
+    return video, keyframe_interval, crf
+
+def _frame_stride(frames, max_frames):
+    """Returns the smallest stride that keeps at most `max_frames` frames."""
+    if max_frames is None or frames <= max_frames:
+        return 1
+    return math.ceil(frames / max(1, max_frames))
+
+def _video_digest(chunks, shape, fps, *settings):
+    """Hashes converted `(B, C, T, H, W)` frames and encoding settings.
+
+    The frames are hashed one time step at a time, so the digest does not
+    depend on how they were split into chunks.
+    """
+    digest = hashlib.sha256(repr((shape, float(fps)) + settings).encode("utf-8"))
+    for chunk in chunks:
+        for index in range(chunk.shape[2]):
+            digest.update(np.ascontiguousarray(chunk[:, :, index]).data)
+    return digest.digest()
+
+def _quantize_frames(frames, scale_factor):
+    """Converts frames to uint8, scaling them by `scale_factor` first."""
+    if frames.dtype == np.uint8 and scale_factor == 1:
+        return frames
+    frames = frames.astype(np.float32)
+    frames *= scale_factor
+    np.clip(frames, 0, 255, out=frames)
+    return frames.astype(np.uint8)
+
+def _converted_track(convert, index, frames, chunk_frames):
+    """Yields one track's converted frames in `(T, H, W, C)` chunks."""
+    for start in range(0, frames, chunk_frames):
+        chunk = convert(start, start + chunk_frames, slice(index, index + 1))
+        yield np.transpose(chunk[0], (1, 2, 3, 0))
+
+def _downscale_factor(height, width, max_resolution):
+    """Returns the smallest integer factor that fits `max_resolution`.
+
+    The factor is capped so that both sides keep at least 2 pixels.
+    """
+    if max_resolution is None:
+        return 1
+    if isinstance(max_resolution, int):
+        max_resolution = (max_resolution, max_resolution)
+    (max_width, max_height) = max_resolution
+    factor = max(math.ceil(width / max_width), math.ceil(height / max_height))
+    return max(1, min(factor, height // 2, width // 2))
+
+def _downscale_frames(tensor, factor):
+    """Downscales a `(B, C, T, H, W)` uint8 video by averaging pixel blocks.
+
+    Edge rows and columns that do not fill a block are cropped, as are
+    any needed to make the result's dimensions even, which H.264 in
+    4:2:0 chroma requires; a side of a single pixel is padded to two
+    instead. A `factor` of 1 only evens out the dimensions.
+    """
+    (batch_size, channels, frames, height, width) = tensor.shape
+    (out_height, out_width) = _downscaled_size(height, width, factor)
+    rows = min(out_height, height // factor)
+    columns = min(out_width, width // factor)
+    tensor = tensor[:, :, :, : rows * factor, : columns * factor]
+    if factor > 1:
+        blocks = tensor.reshape(
+            batch_size, channels, frames, rows, factor, columns, factor
+        )
+        tensor = blocks.mean(axis=(4, 6), dtype=np.float32).round().astype(np.uint8)
+    if (rows, columns) != (out_height, out_width):
+        padding = ((0, 0), (0, 0), (0, 0), (0, out_height - rows), (0, out_width - columns))
+        tensor = np.pad(tensor, padding, mode="edge")
+    return tensor
+
+def _downscaled_size(height, width, factor):
+    """Returns the frame size `_downscale_frames` produces, which is even
+    and at least 2 on each side."""
+    return (
+        max(2, height // factor // 2 * 2),
+        max(2, width // factor // 2 * 2),
+    )
+
+def encoded_video(tag, videos):
+    """Output a `Summary` protocol buffer with already encoded MP4 videos.
+
+    Unlike `video`, nothing is decoded or re-encoded: a single file is
+    stored as is, and several files are combined into one multitrack MP4
+    by copying their video streams.
+
+    Args:
+      tag: A name for the generated node.
+      videos: An MP4 file, given as its contents (`bytes`) or its path, or
+        a list of such files, one per batch element. A file may itself
+        hold several video tracks.
+
+    Raises:
+      ValueError: If a file is not an MP4 file with a video track.
+    """
+    if isinstance(videos, (bytes, bytearray, memoryview, str, os.PathLike)):
+        videos = [videos]
+    if not videos:
+        raise ValueError("Expected at least one video")
+    infos = [_probe_mp4(video, i) for i, video in enumerate(videos)]
+    fragmented = any(info and info["fragmented"] for info in infos)
+    if len(videos) == 1:
+        encoded = _read_mp4(videos[0])
+    else:
+        encoded = _mux_mp4s(videos, fragmented)
+    if all(infos):
+        batch_size = sum(info["tracks"] for info in infos)
+        dimensions = {
+            key: infos[0][key] for key in ("width", "height", "fps", "frames")
+        }
+    else:
+        # Without the videos plugin's MP4 parser, assume one track each.
+        batch_size = len(videos)
+        dimensions = {}
+    return Summary(
+        value=[
+            Summary.Value(
+                tag=tag,
+                metadata=_video_summary_metadata(
+                    fragmented=fragmented, **dimensions
+                ),
+                video=Summary.Video(
+                    batch_size=batch_size, encoded_video_string=encoded
+                ),
+            )
+        ]
+    )
+
+def _probe_mp4(video, index):
+    """Reads the properties of an encoded video from its MP4 headers.
+
+    Only box headers and sample tables are parsed, not the video data.
+
+    Returns:
+      A dict with the number of video `tracks`, whether the file is
+      `fragmented`, and the `width`, `height`, `fps` and `frames` of its
+      first track; or `None` if the videos plugin is not installed.
+    """
+    try:
+        from video_plugin import mp4
+    except ImportError:
+        return None
+    import contextlib
+
+    if isinstance(video, (str, os.PathLike)):
+        mapped = mp4.open_mapped(video)
+    else:
+        mapped = contextlib.nullcontext(video)
+    try:
+        with mapped as data:
+            tracks = len(mp4.video_traks(data, mp4.parse(data)))
+            info = mp4.TrackInfo(data)
+            (frames, _) = info.frame_index()
+    except (mp4.Mp4Error, struct.error) as e:
+        raise ValueError(f"Video {index} is not a valid MP4 file: {e}")
+    duration = info.duration
+    if not duration and len(frames) > 1:
+        # Fragmented files may not record a duration; extrapolate the span
+        # of presentation times by one frame.
+        duration = (frames[-1] - frames[0]) * len(frames) / (len(frames) - 1)
+    return {
+        "tracks": tracks,
+        "fragmented": info.fragmented,
+        "width": info.width,
+        "height": info.height,
+        "fps": len(frames) / duration if duration else 0.0,
+        "frames": len(frames),
+    }
+
+def _read_mp4(video):
+    if isinstance(video, (str, os.PathLike)):
+        with open(video, 'rb') as f:
+            return f.read()
+    return bytes(video)
+
+def _mux_mp4s(videos, fragmented):
+    """Combines MP4 files given as contents or paths into one, without re-encoding."""
     import tempfile
 
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_out:
-        output_path = temp_out.name
-        try:
-            if not isinstance(tensor, np.ndarray):
-                tensor = make_np(tensor)
-
-            if tensor.dtype != np.uint8:
-                if tensor.max() <= 1.0:
-                    tensor = (tensor * 255).astype(np.uint8)
-                else:
-                    tensor = tensor.astype(np.uint8)
-            tensor_to_multitrack_mp4(
-                tensor=tensor,
-                output_path=output_path,
-                fps=fps,
-                crf=23,
-                pixel_format='yuv420p'
+    from video_plugin import encoder
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_paths = []
+        for i, video in enumerate(videos):
+            if isinstance(video, (str, os.PathLike)):
+                input_paths.append(video)
+                continue
+            temp_path = os.path.join(temp_dir, f'input_{i}.mp4')
+            with open(temp_path, 'wb') as f:
+                f.write(video)
+            input_paths.append(temp_path)
+        output_path = os.path.join(temp_dir, 'output.mp4')
+        encoder.mux(input_paths, output_path, fragmented=fragmented)
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+class VideoStream:
+    """Encodes a video incrementally, frame by frame, across many steps.
+
+    One encoder from the videos plugin's `encoder` module stays open for
+    the life of the stream and writes fragmented MP4. Each `flush`
+    returns the fragments finalized since the previous one, together
+    with the initialization segment, as a video summary that plays on
+    its own. Only the encoded fragments awaiting a flush are held in
+    memory, never the frames of the whole video. With the ffmpeg
+    backend, encoding runs concurrently with the caller; with PyAV, it
+    runs in `append`, which releases the GIL while encoding.
+
+    Every flush is written at a step of the caller's choosing and holds
+    its own segment of the video. The videos plugin joins each segment
+    with those of the earlier steps of the same stream, so a step plays
+    the whole stream up to it. That needs every step of the stream to
+    be loaded (`--samples_per_plugin videos=0`); otherwise a step plays
+    only its own segment.
+
+    Example:
+
+        with VideoStream("rollout", 64, 64, fps=30,
+                         file_writer=writer.file_writer) as stream:
+            for step, frame in enumerate(env_frames()):
+                stream.append(frame, global_step=step)
+    """
+
+    def __init__(
+        self,
+        tag,
+        height,
+        width,
+        fps=4,
+        fragment_duration=2.0,
+        file_writer=None,
+    ):
+        """Starts an encoder.
+
+        Args:
+          tag: A name for the generated summaries.
+          height: Height of every frame in pixels.
+          width: Width of every frame in pixels.
+          fps: Frames per second of the video.
+          fragment_duration: Approximate duration in seconds of each MP4
+            fragment; fragments are the unit of flushing.
+          file_writer: Optional; an object with an `add_summary(summary,
+            global_step, walltime)` method, such as a `FileWriter`. If
+            given, finalized fragments are written to it automatically,
+            as soon as they are available, at the `global_step` passed
+            to `append` or `close`.
+        """
+        from video_plugin import encoder
+
+        self._tag = tag
+        self._shape = (height, width)
+        self._fps = fps
+        self._file_writer = file_writer
+        self._next_step = 0  # default step of the next flush written
+        self._closed = False
+        self._lock = threading.Lock()
+        self._init = None  # ftyp + moov, once received
+        self._fragments = []  # finalized moof + mdat pairs awaiting a flush
+        self._output = bytearray()  # encoder output not yet split into boxes
+        self._moof = None  # moof bytes awaiting their mdat
+        self._encoder = encoder.encode_stream(
+            self._receive,
+            height,
+            width,
+            fps,
+            fragment_duration=fragment_duration,
+            crf=_DEFAULT_CRF,
+            keyframe_interval=_keyframe_interval(fps, None, fragment_duration),
+        )
+
+    def _receive(self, data):
+        """Splits the encoder's output into the init segment and fragments."""
+        with self._lock:
+            buffer = self._output
+            buffer += data
+            while len(buffer) >= 8:
+                (size, box_type) = struct.unpack_from(">I4s", buffer)
+                if size == 1 and len(buffer) >= 16:
+                    (size,) = struct.unpack_from(">Q", buffer, 8)
+                if size < 8 or len(buffer) < size:
+                    break  # Incomplete box; wait for more output.
+                box = bytes(buffer[:size])
+                del buffer[:size]
+                if box_type in (b"ftyp", b"moov"):
+                    self._init = (self._init or b"") + box
+                elif box_type == b"moof":
+                    self._moof = box
+                elif box_type == b"mdat" and self._moof is not None:
+                    self._fragments.append(self._moof + box)
+                    self._moof = None
+
+    def append(self, frames, global_step=None):
+        """Encodes one frame or a chunk of frames.
+
+        Args:
+          frames: A `(channels, height, width)` frame, or a `(channels,
+            frames, height, width)` chunk, laid out like one batch element
+            of the `video` tensor. `channels` is 1 or 3; values are
+            scaled as in `video`.
+          global_step: Optional; the step at which to write fragments
+            finalized by this call to the `file_writer`. Defaults to one
+            after the step of the previous flush, or 0.
+        """
+        frames = make_np(frames)
+        if frames.ndim == 3:
+            frames = frames[:, None]
+        if frames.ndim != 4 or frames.shape[2:] != self._shape:
+            raise ValueError(
+                f"Expected frames of shape (C, [T,] {self._shape[0]}, "
+                f"{self._shape[1]}), got {frames.shape}"
             )
-            with open(output_path, 'rb') as f:
-                tensor_string = f.read()
-        finally:
-            try:
-                os.remove(output_path)
-            except OSError:
-                pass
-    b, t, h, w, c = tensor.shape
-    return Summary.Video(
-        batch_size=b,
-        encoded_video_string=tensor_string
+        scale_factor = _calc_scale_factor(frames)
+        frames = (frames.astype(np.float32) * scale_factor).clip(0, 255).astype(np.uint8)
+        self._encoder.write(np.transpose(frames, (1, 2, 3, 0)))
+        if self._file_writer is not None:
+            self._write_pending(global_step)
+
+    def flush(self):
+        """Returns the fragments finalized since the last flush.
+
+        The caller chooses the step to write the summary at; later
+        segments of the stream should be written at later steps.
+
+        Returns:
+          A `Summary` whose video holds the initialization segment and the
+          new fragments, or `None` if no fragment was finalized yet.
+        """
+        pending = self._take_pending()
+        return None if pending is None else self._summary(pending[0])
+
+    def _take_pending(self, global_step=None):
+        """Returns `(encoded, step)` for the fragments finalized since the
+        last flush, or `None` if there are none.
+
+        `step` is `global_step`, or defaults as described in `append`.
+        """
+        with self._lock:
+            if self._init is None or not self._fragments:
+                return None
+            encoded = b"".join([self._init, *self._fragments])
+            self._fragments = []
+            step = self._next_step if global_step is None else global_step
+            self._next_step = step + 1
+            return encoded, step
+
+    def _summary(self, encoded):
+        return Summary(
+            value=[
+                Summary.Value(
+                    tag=self._tag,
+                    metadata=_video_summary_metadata(
+                        fragmented=True,
+                        height=self._shape[0],
+                        width=self._shape[1],
+                        fps=self._fps,
+                        stream=True,
+                    ),
+                    video=Summary.Video(
+                        batch_size=1, encoded_video_string=encoded
+                    ),
+                )
+            ]
+        )
+
+    def close(self, global_step=None):
+        """Finishes encoding and returns the remaining fragments.
+
+        Args:
+          global_step: Optional; as for `append`.
+
+        Returns:
+          As for `flush`. If the stream has a `file_writer`, the summary
+          is written to it instead and `None` is returned.
+        """
+        if self._closed:
+            return None
+        self._closed = True
+        self._encoder.close()
+        if self._file_writer is not None:
+            self._write_pending(global_step)
+            return None
+        return self.flush()
+
+    def _write_pending(self, global_step):
+        pending = self._take_pending(global_step)
+        if pending is None:
+            return
+        (encoded, step) = pending
+        self._file_writer.add_summary(self._summary(encoded), step, time.time())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _video_summary_metadata(**plugin_data_fields):
+    """Returns the `SummaryMetadata` for a video summary.
+
+    The `VideoPluginData` fields are only recorded if the videos plugin
+    is installed; without it, the summary is written without them.
+    """
+    try:
+        from video_plugin import metadata as video_metadata
+    except ImportError:
+        summary_metadata = SummaryMetadata(
+            plugin_data=SummaryMetadata.PluginData(plugin_name="videos")
+        )
+    else:
+        summary_metadata = video_metadata.create_summary_metadata(
+            display_name=None, description=None, **plugin_data_fields
+        )
+    summary_metadata.data_class = DataClass.DATA_CLASS_BLOB_SEQUENCE
+    return summary_metadata
+
+def _keyframe_interval(fps, keyframe_interval, fragment_duration):
+    """Returns the GOP length to encode with, or `None` for the default."""
+    if keyframe_interval is None and fragment_duration is not None:
+        # Fragments can only start at keyframes, so keyframes must be at
+        # least as frequent as fragments.
+        keyframe_interval = int(round(fps * fragment_duration))
+    if keyframe_interval is not None:
+        keyframe_interval = max(1, keyframe_interval)
+    return keyframe_interval
+
+def make_video(
+    tensor,
+    fps,
+    fragment_duration=None,
+    keyframe_interval=None,
+    crf=_DEFAULT_CRF,
+    preset=None,
+    workers=None,
+):
+    tensor = make_np(tensor)
+    encoded = _encode_tensor(
+        tensor,
+        fps,
+        crf=crf,
+        pixel_format='yuv420p',
+        fragment_duration=fragment_duration,
+        keyframe_interval=keyframe_interval,
+        preset=preset,
+        workers=workers,
     )
+    return Summary.Video(batch_size=tensor.shape[0], encoded_video_string=encoded)
 
 def tensor_to_multitrack_mp4(
     tensor: np.ndarray,
     output_path: str,
     fps: float = 30.0,
     crf: int = 23,
-    pixel_format: str = 'yuv420p'
+    pixel_format: str = 'yuv420p',
+    fragment_duration: Optional[float] = None,
+    keyframe_interval: Optional[int] = None,
+    preset: Optional[str] = None,
+    workers: Optional[int] = None,
 ) -> None:
-    try:
-        import ffmpeg
-    except ImportError:
-        print("add_video needs package ffmpeg-python")
-        return
-    import tempfile
+    encoded = _encode_tensor(
+        tensor,
+        fps,
+        crf=crf,
+        pixel_format=pixel_format,
+        fragment_duration=fragment_duration,
+        keyframe_interval=keyframe_interval,
+        preset=preset,
+        workers=workers,
+    )
+    with open(output_path, 'wb') as f:
+        f.write(encoded)
+
+def _encode_tensor(
+    tensor,
+    fps,
+    crf,
+    pixel_format,
+    fragment_duration,
+    keyframe_interval,
+    preset,
+    workers,
+):
+    """Encodes a `(B, C, T, H, W)` array into multitrack MP4 bytes."""
+    from video_plugin import encoder
+
     if len(tensor.shape) != 5:
         raise ValueError(f"Expected 5D tensor, got shape {tensor.shape}")
     batch_size, channels, time_steps, height, width = tensor.shape
@@ -719,32 +1634,19 @@ def tensor_to_multitrack_mp4(
             tensor = (tensor * 255).astype(np.uint8)
         else:
             tensor = tensor.astype(np.uint8)
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_files = []
-        for batch_idx in range(batch_size):
-            temp_path = os.path.join(temp_dir, f'temp_{batch_idx}.mp4')
-            temp_files.append(temp_path)
-            frames = tensor[batch_idx]
-            if channels == 1:
-                frames = np.repeat(frames, 3, axis=-1)
-            input_data = b''.join(frame.tobytes() for frame in frames)
-            process = (
-                ffmpeg
-                .input('pipe:', format='rawvideo', pix_fmt='rgb24',
-                       s=f'{width}x{height}', r=fps)
-                .output(temp_path, pix_fmt=pixel_format, crf=crf,
-                       vcodec='libx264')
-                .overwrite_output()
-            )
-            ffmpeg.run(process, input=input_data)
-        maps = []
-        input_args = []
-        for i, temp_file in enumerate(temp_files):
-            input_args.extend(['-i', temp_file])
-            maps.extend(['-map', f'{i}:v:0'])
-        cmd = ['ffmpeg', *input_args, *maps, '-c:v', 'copy', '-y', output_path]
-        import subprocess
-        subprocess.run(cmd, check=True)
+    keyframe_interval = _keyframe_interval(
+        fps, keyframe_interval, fragment_duration
+    )
+    return encoder.encode(
+        list(tensor),
+        fps,
+        crf=crf,
+        pixel_format=pixel_format,
+        keyframe_interval=keyframe_interval,
+        fragment_duration=fragment_duration,
+        preset=preset,
+        workers=workers,
+    )
 
 def audio(tag, tensor, sample_rate=44100):
     array = make_np(tensor)
@@ -0,0 +1,87 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Content-addressed references between identical videos.
+
+A writer that has already written a video with the same frames and
+encoding settings may write a reference instead of encoding it again. A
+reference blob is a magic string followed by JSON naming the digest of
+the frames and the tag of the original. Originals carry their digest in
+a `free` box appended to the MP4 file, which players ignore, and the
+videos plugin resolves a reference to the original with that digest.
+"""
+
+import json
+import struct
+
+REFERENCE_MAGIC = b"TBVREF1\0"
+_DIGEST_MARKER = b"TBVDGST1"
+_DIGEST_SIZE = 32  # sha256
+# Box size and type, then the marker and the digest.
+_DIGEST_BOX = struct.Struct(">I4s8s%ds" % _DIGEST_SIZE)
+
+
+def is_reference(data):
+    """Returns whether a blob is a reference rather than a video."""
+    return bytes(data[: len(REFERENCE_MAGIC)]) == REFERENCE_MAGIC
+
+
+def encode_reference(digest, tag):
+    """Returns a reference blob to the video with `digest` under `tag`."""
+    if len(digest) != _DIGEST_SIZE:
+        raise ValueError("Expected a %d-byte digest" % _DIGEST_SIZE)
+    body = {"digest": digest.hex(), "tag": tag}
+    return REFERENCE_MAGIC + json.dumps(body, sort_keys=True).encode("utf-8")
+
+
+def decode_reference(data):
+    """Unpacks a reference blob.
+
+    Returns:
+      A `(digest, tag)` pair, where `digest` is `bytes`.
+
+    Raises:
+      ValueError: If `data` is not a valid reference blob.
+    """
+    if not is_reference(data):
+        raise ValueError("Not a video reference")
+    try:
+        body = json.loads(bytes(data[len(REFERENCE_MAGIC) :]).decode("utf-8"))
+        digest = bytes.fromhex(body["digest"])
+        tag = body["tag"]
+    except (UnicodeDecodeError, TypeError, KeyError) as e:
+        raise ValueError("Corrupt video reference: %s" % e)
+    if len(digest) != _DIGEST_SIZE or not isinstance(tag, str):
+        raise ValueError("Corrupt video reference")
+    return digest, tag
+
+
+def append_digest(video, digest):
+    """Returns an MP4 file with `digest` appended in a `free` box."""
+    if len(digest) != _DIGEST_SIZE:
+        raise ValueError("Expected a %d-byte digest" % _DIGEST_SIZE)
+    box = _DIGEST_BOX.pack(_DIGEST_BOX.size, b"free", _DIGEST_MARKER, digest)
+    return bytes(video) + box
+
+
+def read_digest(data):
+    """Returns the digest appended by `append_digest`, or `None`."""
+    if len(data) < _DIGEST_BOX.size:
+        return None
+    (size, box_type, marker, digest) = _DIGEST_BOX.unpack_from(
+        data, len(data) - _DIGEST_BOX.size
+    )
+    if (size, box_type, marker) != (_DIGEST_BOX.size, b"free", _DIGEST_MARKER):
+        return None
+    return digest
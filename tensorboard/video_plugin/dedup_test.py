@@ -0,0 +1,91 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for video references and digests."""
+
+import unittest
+
+from video_plugin import dedup
+
+_DIGEST = bytes(range(32))
+
+
+class ReferenceTest(unittest.TestCase):
+    def test_round_trip(self):
+        data = dedup.encode_reference(_DIGEST, "train/clip")
+        self.assertTrue(dedup.is_reference(data))
+        self.assertEqual(dedup.decode_reference(data), (_DIGEST, "train/clip"))
+
+    def test_round_trip_from_memoryview(self):
+        data = memoryview(dedup.encode_reference(_DIGEST, "clip"))
+        self.assertEqual(dedup.decode_reference(data), (_DIGEST, "clip"))
+
+    def test_rejects_wrong_digest_size(self):
+        with self.assertRaises(ValueError):
+            dedup.encode_reference(_DIGEST[:-1], "clip")
+
+    def test_videos_are_not_references(self):
+        self.assertFalse(dedup.is_reference(b"\0\0\0\x18ftypisom"))
+        with self.assertRaises(ValueError):
+            dedup.decode_reference(b"\0\0\0\x18ftypisom")
+
+    def test_corrupt_references(self):
+        magic = dedup.REFERENCE_MAGIC
+        for body in (
+            b"",
+            b"{",
+            b"\xff\xfe",
+            b"[]",
+            b'"clip"',
+            b'{"tag": "clip"}',
+            b'{"digest": "00", "tag": "clip"}',
+            b'{"digest": "zz", "tag": "clip"}',
+            b'{"digest": 7, "tag": "clip"}',
+            ('{"digest": "%s", "tag": 7}' % _DIGEST.hex()).encode(),
+        ):
+            with self.subTest(body=body):
+                with self.assertRaises(ValueError):
+                    dedup.decode_reference(magic + body)
+
+
+class DigestTest(unittest.TestCase):
+    def test_round_trip(self):
+        video = b"\0\0\0\x08free" * 3
+        tagged = dedup.append_digest(video, _DIGEST)
+        self.assertTrue(tagged.startswith(video))
+        self.assertEqual(dedup.read_digest(tagged), _DIGEST)
+        self.assertEqual(dedup.read_digest(memoryview(tagged)), _DIGEST)
+
+    def test_rejects_wrong_digest_size(self):
+        with self.assertRaises(ValueError):
+            dedup.append_digest(b"", _DIGEST + b"\0")
+
+    def test_missing_digest(self):
+        for data in (b"", b"short", b"x" * 1000, b"\0\0\0\x08free" * 10):
+            with self.subTest(size=len(data)):
+                self.assertIsNone(dedup.read_digest(data))
+
+    def test_truncated_digest(self):
+        tagged = dedup.append_digest(b"video", _DIGEST)
+        self.assertIsNone(dedup.read_digest(tagged[:-1]))
+
+    def test_other_free_box(self):
+        tagged = bytearray(dedup.append_digest(b"video", _DIGEST))
+        marker = tagged.rindex(b"TBVDGST1")
+        tagged[marker] ^= 0xFF
+        self.assertIsNone(dedup.read_digest(bytes(tagged)))
+
+
+if __name__ == "__main__":
+    unittest.main()
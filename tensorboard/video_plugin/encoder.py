@@ -0,0 +1,965 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Video encoding backends shared by the video summary writers.
+
+`encode` turns frames into a multitrack H.264 MP4 file with one of two
+interchangeable backends:
+
+  * `PyAVBackend` encodes in-process with PyAV, without spawning
+    processes or copying frames through pipes, and muxes in memory.
+  * `FfmpegBackend` runs the `ffmpeg` executable, one process per track.
+
+Both use the same codec, quality and container settings, so their
+outputs have the same tracks, dimensions, frame rate, keyframes and
+layout. By default the first available backend is used, in the order
+above; the `TENSORBOARD_VIDEO_ENCODER` environment variable or the
+`backend` argument can select one by name.
+
+Tracks are given as iterables of frame chunks, so that callers can
+produce frames while earlier ones are being encoded instead of holding
+every frame in memory. `encode_stream` goes further, for tracks whose
+frames arrive over a long time: it returns fragmented MP4 piece by piece
+while frames are still being written.
+
+With `workers`, tracks held in memory are instead encoded in a pool of
+worker processes. Their frames are handed over in shared memory rather
+than pickled through pipes, so the handoff costs one copy however large
+the video is. Workers are spawned, which re-imports the main script in
+each of them, so the script must guard its top-level code with `if
+__name__ == "__main__":`. Scripts without such a guard are encoded in
+the calling process instead, with a warning.
+"""
+
+import concurrent.futures
+import fractions
+import functools
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import warnings
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from video_plugin import mp4
+
+ENV_VAR = "TENSORBOARD_VIDEO_ENCODER"
+DEFAULT_CRF = 23
+_FRAGMENTED_MOVFLAGS = "frag_keyframe+empty_moov+default_base_moof"
+_FAST_START_MOVFLAGS = "+faststart"
+
+
+class EncoderUnavailableError(RuntimeError):
+    """Raised when no video encoding backend can be used."""
+
+
+def encode(
+    tracks,
+    fps,
+    *,
+    crf=DEFAULT_CRF,
+    pixel_format="yuv420p",
+    keyframe_interval=None,
+    fragment_duration=None,
+    preset=None,
+    backend=None,
+    workers=None,
+):
+    """Encodes frames into a multitrack MP4 file.
+
+    Args:
+      tracks: A list with one entry per video track. Each entry is either
+        a `uint8` array of shape `(frames, height, width, channels)`, or
+        an iterable of such arrays holding consecutive chunks of frames.
+        `channels` is 1 (grayscale) or 3 (RGB).
+      fps: Frames per second of every track.
+      crf: x264 constant rate factor; higher values give smaller files.
+      pixel_format: Pixel format to encode in.
+      keyframe_interval: Optional; maximum number of frames between
+        keyframes.
+      fragment_duration: Optional; if given, write fragmented MP4 with
+        fragments of about this many seconds.
+      preset: Optional; x264 speed preset, such as `"ultrafast"`.
+      backend: Optional; a backend name or instance. Defaults to the one
+        named by `TENSORBOARD_VIDEO_ENCODER`, or the first available.
+      workers: Optional; if greater than 1, encode tracks given as arrays
+        in up to this many worker processes, passing their frames in
+        shared memory. Worth it for large videos with several tracks.
+        Workers are spawned, so the main script must keep its top-level
+        code under `if __name__ == "__main__":`; without that guard,
+        tracks are encoded in this process instead, with a warning.
+
+    Returns:
+      The MP4 file, as `bytes`.
+
+    Raises:
+      EncoderUnavailableError: If no backend is available.
+    """
+    backend = get_backend(backend)
+    codec_options = _codec_options(crf, keyframe_interval, preset)
+    if fragment_duration is not None:
+        muxer_options = _fragmented_muxer_options(fragment_duration)
+    else:
+        # Put the moov atom first, so browsers can start playing (and
+        # seeking with Range requests) before the whole file arrives.
+        muxer_options = {"movflags": _FAST_START_MOVFLAGS}
+    if (
+        workers is not None
+        and workers > 1
+        and len(tracks) > 1
+        and all(isinstance(track, np.ndarray) for track in tracks)
+        and _main_is_guarded()
+    ):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, "output.mp4")
+            _encode_in_workers(
+                tracks,
+                output_path,
+                fps,
+                pixel_format,
+                codec_options,
+                muxer_options,
+                backend,
+                workers,
+            )
+            with open(output_path, "rb") as infile:
+                return infile.read()
+    return backend.encode_to_bytes(
+        [_chunks(track) for track in tracks],
+        fps,
+        pixel_format,
+        codec_options,
+        muxer_options,
+    )
+
+
+def encode_batch(videos, fps, *, max_concurrency=None, **options):
+    """Encodes several videos, each into its own single-track MP4 file.
+
+    The videos are encoded concurrently in threads: PyAV releases the GIL
+    while encoding, and the ffmpeg backend waits on its processes.
+
+    Args:
+      videos: A sequence of `uint8` arrays of shape `(frames, height,
+        width, channels)`, such as a `(k, frames, height, width,
+        channels)` array.
+      fps: Frames per second of every video.
+      max_concurrency: Optional; most videos to encode at once. Defaults
+        to the number of CPUs.
+      **options: Keyword arguments for `encode`.
+
+    Returns:
+      A list of the MP4 files, as `bytes`, in the order of `videos`.
+    """
+    backend = get_backend(options.pop("backend", None))
+    if len(videos) <= 1:
+        return [encode([video], fps, backend=backend, **options) for video in videos]
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(len(videos), max_concurrency or os.cpu_count() or 1)
+    ) as executor:
+        return list(
+            executor.map(
+                lambda video: encode([video], fps, backend=backend, **options),
+                videos,
+            )
+        )
+
+
+def mux(input_paths, output_path, *, fragmented=False, backend=None):
+    """Copies the video tracks of several MP4 files into one, in order.
+
+    Nothing is decoded or re-encoded.
+
+    Args:
+      input_paths: Paths of the MP4 files to combine.
+      output_path: Path to write the combined file to.
+      fragmented: Whether to write fragmented MP4.
+      backend: As for `encode`.
+    """
+    movflags = _FRAGMENTED_MOVFLAGS if fragmented else _FAST_START_MOVFLAGS
+    get_backend(backend).mux(
+        [os.fspath(path) for path in input_paths],
+        output_path,
+        {"movflags": movflags},
+    )
+
+
+def encode_stream(
+    output,
+    height,
+    width,
+    fps,
+    *,
+    fragment_duration,
+    crf=DEFAULT_CRF,
+    pixel_format="yuv420p",
+    keyframe_interval=None,
+    preset=None,
+    backend=None,
+):
+    """Starts encoding a single track whose frames arrive over time.
+
+    The track is written as fragmented MP4, which is handed to `output`
+    piece by piece as the encoder produces it, so that neither the frames
+    nor the encoded file have to be held in memory.
+
+    Args:
+      output: A callable, called with each new piece of the MP4 file as
+        `bytes`, in order. It may be called from another thread.
+      height: Height of every frame in pixels.
+      width: Width of every frame in pixels.
+      fps: Frames per second of the track.
+      fragment_duration: Approximate duration in seconds of each MP4
+        fragment.
+      crf: As for `encode`.
+      pixel_format: As for `encode`.
+      keyframe_interval: As for `encode`.
+      preset: As for `encode`.
+      backend: As for `encode`.
+
+    Returns:
+      An `EncoderStream` to write the frames to, then close.
+
+    Raises:
+      EncoderUnavailableError: If no backend is available.
+    """
+    return get_backend(backend).open_stream(
+        output,
+        height,
+        width,
+        fps,
+        pixel_format,
+        _codec_options(crf, keyframe_interval, preset),
+        _fragmented_muxer_options(fragment_duration),
+    )
+
+
+def get_backend(backend=None):
+    """Resolves a backend name or instance to an available backend.
+
+    Raises:
+      EncoderUnavailableError: If the requested backend, or with no
+        request every backend, is unavailable.
+    """
+    if isinstance(backend, Backend):
+        return backend
+    if backend is None:
+        backend = os.environ.get(ENV_VAR) or None
+    if backend is not None:
+        backend_class = _BACKENDS.get(backend)
+        if backend_class is None:
+            raise EncoderUnavailableError(
+                "Unknown video encoder %r; expected one of: %s"
+                % (backend, ", ".join(_BACKENDS))
+            )
+        if not backend_class.available():
+            raise EncoderUnavailableError(
+                "Video encoder %r is not available: %s"
+                % (backend, backend_class.requirement)
+            )
+        return backend_class()
+    for backend_class in _BACKENDS.values():
+        if backend_class.available():
+            return backend_class()
+    raise EncoderUnavailableError(
+        "Writing videos needs one of: %s"
+        % "; ".join(c.requirement for c in _BACKENDS.values())
+    )
+
+
+class SharedFrames:
+    """A copy of an array in shared memory, for other processes to map.
+
+    The segment is released by `close`, when the object is garbage
+    collected, or, if this process dies first, by the resource tracker
+    that `multiprocessing` runs alongside it.
+    """
+
+    def __init__(self, array):
+        array = np.asarray(array)
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(1, array.nbytes)
+        )
+        self._finalizer = weakref.finalize(
+            self, _release_shared_memory, self._shm
+        )
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self._shm.buf)
+        # Copying also makes the frames contiguous (for instance after a
+        # transpose), which the encoder would otherwise do itself.
+        np.copyto(view, array, casting="no")
+        self._descriptor = {
+            "name": self._shm.name,
+            "shape": view.shape,
+            "dtype": view.dtype.str,
+            "strides": view.strides,
+        }
+        del view
+
+    def descriptor(self):
+        """Returns what `attach_shared_frames` needs, as a picklable dict."""
+        return dict(self._descriptor)
+
+    def close(self):
+        """Releases the shared memory segment."""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_shared_frames(descriptor):
+    """Maps the array described by a `SharedFrames` descriptor.
+
+    Returns:
+      A `(segment, array)` pair. The array is only valid until the
+      segment is closed, which the caller must do once done with it.
+    """
+    # Attaching registers the segment with the resource tracker too, but
+    # worker processes share their parent's tracker, so the parent's
+    # unlink leaves nothing behind.
+    shm = shared_memory.SharedMemory(name=descriptor["name"])
+    array = np.ndarray(
+        descriptor["shape"],
+        dtype=np.dtype(descriptor["dtype"]),
+        buffer=shm.buf,
+        strides=descriptor["strides"],
+    )
+    return shm, array
+
+
+def _release_shared_memory(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass  # Still mapped by an array; unlinking frees it once unmapped.
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+_MAIN_GUARD = re.compile(
+    r"""__name__\s*==\s*["']__main__["']|["']__main__["']\s*==\s*__name__"""
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _main_is_guarded():
+    """Returns whether spawned workers can safely re-import `__main__`.
+
+    Spawned processes run the main script again, as `__mp_main__`, so a
+    script that encodes at top level would encode (and train) again in
+    every worker. Interactive sessions have no script to re-run. Warns,
+    once, if the script has no `__main__` guard.
+    """
+    path = getattr(sys.modules.get("__main__"), "__file__", None)
+    if path is None:
+        return True
+    try:
+        with open(path, encoding="utf-8", errors="replace") as infile:
+            source = infile.read()
+    except OSError:
+        return True
+    if _MAIN_GUARD.search(source):
+        return True
+    warnings.warn(
+        "Encoding video tracks in this process, as worker processes would "
+        "re-run %s; put its top-level code under "
+        "`if __name__ == \"__main__\":` to use workers" % path,
+        RuntimeWarning,
+    )
+    return False
+
+
+def _get_pool(workers):
+    """Returns the worker pool, (re)starting it with `workers` processes."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # Forking a process that runs other threads (as training
+            # loops and writers do) can deadlock the child, so workers
+            # are spawned instead. They are kept for later videos.
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _encode_in_workers(
+    tracks,
+    output_path,
+    fps,
+    pixel_format,
+    codec_options,
+    muxer_options,
+    backend,
+    workers,
+):
+    """Encodes each track in a worker process, then muxes the results."""
+    temp_dir = os.path.dirname(output_path)
+    track_paths = [
+        os.path.join(temp_dir, "worker_track_%d.mp4" % i)
+        for i in range(len(tracks))
+    ]
+    pool = _get_pool(workers)
+    shared = []
+    try:
+        futures = []
+        for (track, track_path) in zip(tracks, track_paths):
+            frames = SharedFrames(track)
+            shared.append(frames)
+            futures.append(
+                pool.submit(
+                    _encode_shared_track,
+                    frames.descriptor(),
+                    track_path,
+                    fps,
+                    pixel_format,
+                    codec_options,
+                    type(backend),
+                )
+            )
+        try:
+            for future in futures:
+                future.result()
+        except concurrent.futures.process.BrokenProcessPool:
+            _reset_pool(pool)
+            raise
+        finally:
+            # Segments must outlive every worker still reading them.
+            concurrent.futures.wait(futures)
+    finally:
+        for frames in shared:
+            frames.close()
+    backend.mux(track_paths, output_path, muxer_options)
+
+
+def _encode_shared_track(
+    descriptor, output_path, fps, pixel_format, codec_options, backend_class
+):
+    """Worker: encodes one track of frames in shared memory to a file."""
+    (shm, frames) = attach_shared_frames(descriptor)
+    try:
+        backend_class().encode(
+            [_chunks(frames)], output_path, fps, pixel_format, codec_options, {}
+        )
+    finally:
+        del frames
+        try:
+            shm.close()
+        except BufferError:
+            pass  # Unmapped when the last view goes away.
+
+
+def _codec_options(crf, keyframe_interval, preset):
+    codec_options = {"crf": str(crf)}
+    if keyframe_interval is not None:
+        codec_options["g"] = str(keyframe_interval)
+    if preset is not None:
+        codec_options["preset"] = preset
+    return codec_options
+
+
+def _fragmented_muxer_options(fragment_duration):
+    return {
+        "movflags": _FRAGMENTED_MOVFLAGS,
+        "frag_duration": str(int(fragment_duration * 1e6)),
+    }
+
+
+def _chunks(track):
+    """Yields a track's frames as RGB `uint8` chunks of shape (T, H, W, 3)."""
+    if isinstance(track, np.ndarray):
+        track = (track,)
+    for chunk in track:
+        chunk = np.asarray(chunk)
+        if chunk.ndim != 4 or chunk.shape[-1] not in (1, 3):
+            raise ValueError(
+                "Expected frames of shape (T, H, W, 1 or 3), got %s"
+                % (chunk.shape,)
+            )
+        if chunk.dtype != np.uint8:
+            raise ValueError("Expected uint8 frames, got %s" % chunk.dtype)
+        if chunk.shape[-1] == 1:
+            chunk = np.repeat(chunk, 3, axis=-1)
+        yield np.ascontiguousarray(chunk)
+
+
+class Backend:
+    """Interface of an encoding backend.
+
+    Attributes:
+      name: Name to select the backend by.
+      requirement: What must be installed for the backend to work.
+    """
+
+    name = None
+    requirement = None
+
+    @classmethod
+    def available(cls):
+        raise NotImplementedError()
+
+    def encode(
+        self, tracks, output_path, fps, pixel_format, codec_options, muxer_options
+    ):
+        """Encodes tracks of RGB chunks into an H.264 MP4 file.
+
+        Args:
+          tracks: A list of iterables of RGB `uint8` chunks of shape
+            `(frames, height, width, 3)`.
+          output_path: Path of the MP4 file to write.
+          fps: Frames per second of every track.
+          pixel_format: Pixel format to encode in, such as `"yuv420p"`.
+          codec_options: libx264 options, as strings.
+          muxer_options: MP4 muxer options, as strings.
+        """
+        raise NotImplementedError()
+
+    def encode_to_bytes(
+        self, tracks, fps, pixel_format, codec_options, muxer_options
+    ):
+        """Like `encode`, but returns the MP4 file as `bytes`.
+
+        This implementation writes the file to a temporary directory and
+        reads it back.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, "output.mp4")
+            self.encode(
+                tracks, output_path, fps, pixel_format, codec_options, muxer_options
+            )
+            with open(output_path, "rb") as infile:
+                return infile.read()
+
+    def mux(self, input_paths, output_path, muxer_options):
+        """Copies the video tracks of MP4 files into one; see `mux`."""
+        raise NotImplementedError()
+
+    def open_stream(
+        self, output, height, width, fps, pixel_format, codec_options, muxer_options
+    ):
+        """Starts encoding a track into a stream; see `encode_stream`.
+
+        Returns:
+          An `EncoderStream`.
+        """
+        raise NotImplementedError()
+
+
+class EncoderStream:
+    """A track being encoded as its frames arrive; see `encode_stream`."""
+
+    def __init__(self, height, width):
+        self._shape = (height, width)
+        self._closed = False
+
+    def write(self, frames):
+        """Encodes the next frames of the track.
+
+        Args:
+          frames: A `uint8` array of shape `(frames, height, width,
+            channels)`, where `channels` is 1 or 3.
+        """
+        if self._closed:
+            raise ValueError("Cannot write to a closed encoder stream")
+        for chunk in _chunks(frames):
+            if chunk.shape[1:3] != self._shape:
+                raise ValueError(
+                    "Expected frames of shape (T, %d, %d, C), got %s"
+                    % (self._shape + (chunk.shape,))
+                )
+            self._write(chunk)
+
+    def close(self):
+        """Flushes the encoder and writes the rest of the file.
+
+        Closing an already closed stream does nothing.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._close()
+
+    def _write(self, chunk):
+        raise NotImplementedError()
+
+    def _close(self):
+        raise NotImplementedError()
+
+
+class PyAVBackend(Backend):
+    """Encodes in-process with PyAV.
+
+    PyAV releases the GIL while libx264 encodes, so other Python threads
+    keep running.
+    """
+
+    name = "pyav"
+    requirement = "PyAV (pip install av)"
+
+    @classmethod
+    def available(cls):
+        try:
+            import av  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def encode(
+        self, tracks, output_path, fps, pixel_format, codec_options, muxer_options
+    ):
+        import av
+
+        with av.open(output_path, "w", options=muxer_options) as container:
+            self._encode_tracks(
+                container, tracks, fps, pixel_format, codec_options
+            )
+
+    def encode_to_bytes(
+        self, tracks, fps, pixel_format, codec_options, muxer_options
+    ):
+        """Muxes into memory, without a temporary file.
+
+        The muxer can only move the moov box to the front of a file it
+        can reopen, so that is done here instead.
+        """
+        import av
+
+        muxer_options = dict(muxer_options)
+        movflags = muxer_options.pop("movflags", "").split("+")
+        fast_start = "faststart" in movflags
+        movflags = "+".join(flag for flag in movflags if flag != "faststart")
+        if movflags:
+            muxer_options["movflags"] = movflags
+        buffer = io.BytesIO()
+        with av.open(
+            buffer, "w", format="mp4", options=muxer_options
+        ) as container:
+            self._encode_tracks(
+                container, tracks, fps, pixel_format, codec_options
+            )
+        data = buffer.getvalue()
+        del buffer
+        return mp4.fast_start(data) if fast_start else data
+
+    def _encode_tracks(
+        self, container, tracks, fps, pixel_format, codec_options
+    ):
+        import av
+
+        rate = fractions.Fraction(fps).limit_denominator(1001)
+        # Streams must all exist before the first packet is written,
+        # so each track's first chunk is read up front.
+        pending = []
+        for track in tracks:
+            track = iter(track)
+            first = next(track, None)
+            if first is None:
+                raise ValueError("Video track has no frames")
+            stream = container.add_stream("libx264", rate=rate)
+            (_, stream.height, stream.width, _) = first.shape
+            stream.pix_fmt = pixel_format
+            stream.options = dict(codec_options)
+            pending.append((stream, first, track))
+        # Encode the tracks in lockstep, a chunk at a time, so that
+        # their packets interleave in the file.
+        while pending:
+            still_pending = []
+            for (stream, chunk, track) in pending:
+                for frame in chunk:
+                    video_frame = av.VideoFrame.from_ndarray(
+                        frame, format="rgb24"
+                    )
+                    container.mux(stream.encode(video_frame))
+                chunk = next(track, None)
+                if chunk is None:
+                    container.mux(stream.encode())  # Flush the encoder.
+                else:
+                    still_pending.append((stream, chunk, track))
+            pending = still_pending
+
+    def mux(self, input_paths, output_path, muxer_options):
+        import av
+
+        inputs = [av.open(path) for path in input_paths]
+        try:
+            with av.open(output_path, "w", options=muxer_options) as output:
+                # Input stream -> output stream, for each input file.
+                stream_maps = [
+                    {
+                        in_stream: output.add_stream_from_template(in_stream)
+                        for in_stream in container.streams.video
+                    }
+                    for container in inputs
+                ]
+                for (container, stream_map) in zip(inputs, stream_maps):
+                    for packet in container.demux(*stream_map):
+                        if packet.dts is None:
+                            continue  # The demuxer's end-of-stream marker.
+                        packet.stream = stream_map[packet.stream]
+                        output.mux(packet)
+        finally:
+            for container in inputs:
+                container.close()
+
+    def open_stream(
+        self, output, height, width, fps, pixel_format, codec_options, muxer_options
+    ):
+        return _PyAVStream(
+            output, height, width, fps, pixel_format, codec_options, muxer_options
+        )
+
+
+class _PyAVStream(EncoderStream):
+    """Encodes in the writing thread, muxing to the output as it goes."""
+
+    def __init__(
+        self, output, height, width, fps, pixel_format, codec_options, muxer_options
+    ):
+        import av
+
+        super().__init__(height, width)
+        self._container = av.open(
+            _OutputWriter(output), "w", format="mp4", options=muxer_options
+        )
+        self._stream = self._container.add_stream(
+            "libx264", rate=fractions.Fraction(fps).limit_denominator(1001)
+        )
+        self._stream.height = height
+        self._stream.width = width
+        self._stream.pix_fmt = pixel_format
+        self._stream.options = dict(codec_options)
+
+    def _write(self, chunk):
+        import av
+
+        for frame in chunk:
+            video_frame = av.VideoFrame.from_ndarray(frame, format="rgb24")
+            self._container.mux(self._stream.encode(video_frame))
+
+    def _close(self):
+        try:
+            self._container.mux(self._stream.encode())  # Flush the encoder.
+        finally:
+            self._container.close()
+
+
+class _OutputWriter:
+    """A write-only file object that passes what is written to a callable."""
+
+    def __init__(self, output):
+        self._output = output
+
+    def write(self, data):
+        self._output(bytes(data))
+        return len(data)
+
+
+class FfmpegBackend(Backend):
+    """Encodes with the `ffmpeg` executable.
+
+    Each track is encoded by its own `ffmpeg` process, fed raw frames
+    through a pipe, and the tracks are then combined without re-encoding.
+    """
+
+    name = "ffmpeg"
+    requirement = "the ffmpeg executable on the PATH"
+
+    @classmethod
+    def available(cls):
+        return shutil.which("ffmpeg") is not None
+
+    def encode(
+        self, tracks, output_path, fps, pixel_format, codec_options, muxer_options
+    ):
+        temp_dir = os.path.dirname(output_path)
+        # A single track is written straight to the output, with no need
+        # for a separate step to combine tracks.
+        single = len(tracks) == 1
+        processes = []
+        track_paths = []
+        try:
+            # One process per track, fed a chunk at a time in turn, so
+            # that the tracks are encoded in parallel.
+            pending = []
+            for track in tracks:
+                track = iter(track)
+                first = next(track, None)
+                if first is None:
+                    raise ValueError("Video track has no frames")
+                if single:
+                    track_path = output_path
+                else:
+                    track_path = os.path.join(
+                        temp_dir, "track_%d.mp4" % len(track_paths)
+                    )
+                    track_paths.append(track_path)
+                process = self._start_track(
+                    first.shape,
+                    track_path,
+                    fps,
+                    pixel_format,
+                    codec_options,
+                    muxer_options if single else {},
+                )
+                processes.append(process)
+                pending.append((process, first, track))
+            while pending:
+                still_pending = []
+                for (process, chunk, track) in pending:
+                    process.stdin.write(chunk.data)
+                    chunk = next(track, None)
+                    if chunk is None:
+                        process.stdin.close()
+                    else:
+                        still_pending.append((process, chunk, track))
+                pending = still_pending
+        finally:
+            for process in processes:
+                if not process.stdin.closed:
+                    process.stdin.close()
+                process.wait()
+        for process in processes:
+            if process.returncode:
+                raise subprocess.CalledProcessError(
+                    process.returncode, process.args
+                )
+        if single:
+            return
+        self.mux(track_paths, output_path, muxer_options)
+        for track_path in track_paths:
+            os.unlink(track_path)
+
+    def open_stream(
+        self, output, height, width, fps, pixel_format, codec_options, muxer_options
+    ):
+        process = self._start_track(
+            (None, height, width, None),
+            "pipe:1",
+            fps,
+            pixel_format,
+            codec_options,
+            muxer_options,
+            stdout=subprocess.PIPE,
+        )
+        return _FfmpegStream(process, output, height, width)
+
+    def _start_track(
+        self,
+        shape,
+        output_path,
+        fps,
+        pixel_format,
+        codec_options,
+        muxer_options,
+        stdout=None,
+    ):
+        (_, height, width, _) = shape
+        cmd = [
+            "ffmpeg", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", "%dx%d" % (width, height), "-r", str(fps),
+            "-i", "pipe:0",
+            "-c:v", "libx264", "-pix_fmt", pixel_format,
+        ]
+        for (key, value) in codec_options.items():
+            cmd.extend(["-" + key, value])
+        for (key, value) in muxer_options.items():
+            cmd.extend(["-" + key, value])
+        cmd.extend(["-f", "mp4", "-y", output_path])
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=stdout)
+
+    def mux(self, input_paths, output_path, muxer_options):
+        cmd = ["ffmpeg", "-loglevel", "error"]
+        maps = []
+        for (i, input_path) in enumerate(input_paths):
+            cmd.extend(["-i", input_path])
+            maps.extend(["-map", "%d:v" % i])
+        cmd.extend(maps)
+        cmd.extend(["-c:v", "copy"])
+        for (key, value) in muxer_options.items():
+            cmd.extend(["-" + key, value])
+        cmd.extend(["-y", output_path])
+        subprocess.run(cmd, check=True)
+
+
+class _FfmpegStream(EncoderStream):
+    """Pipes frames to an `ffmpeg` process, which encodes concurrently.
+
+    A thread drains the process's output as it is produced; otherwise
+    the process would block once the pipe fills up.
+    """
+
+    def __init__(self, process, output, height, width):
+        super().__init__(height, width)
+        self._process = process
+        self._reader = threading.Thread(
+            target=self._read_output,
+            args=(output,),
+            name="video-encoder-stream",
+            daemon=True,
+        )
+        self._reader.start()
+
+    def _read_output(self, output):
+        while True:
+            data = self._process.stdout.read1(1 << 16)
+            if not data:
+                return
+            output(data)
+
+    def _write(self, chunk):
+        self._process.stdin.write(chunk.data)
+
+    def _close(self):
+        self._process.stdin.close()
+        self._process.wait()
+        self._reader.join()
+        if self._process.returncode:
+            raise subprocess.CalledProcessError(
+                self._process.returncode, self._process.args
+            )
+
+
+# Backends by name, in order of preference.
+_BACKENDS = {
+    backend.name: backend for backend in (PyAVBackend, FfmpegBackend)
+}
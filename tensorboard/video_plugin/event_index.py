@@ -0,0 +1,319 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Index of video blob locations within local event files.
+
+The generic data provider keeps every blob it has read in memory. For
+local logdirs, `BlobIndex` instead records where each video blob lives
+inside the event files and serves it as a slice of a memory-mapped file,
+so video bytes are held by the OS page cache rather than the Python heap.
+
+Indexes are persisted under `<logdir>/.videos_index/`, one JSON file per
+event file, so that later TensorBoard processes only scan new records.
+"""
+
+import base64
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+
+from google.protobuf import message
+from tensorboard.compat.proto import event_pb2
+from video_plugin import metadata
+
+INDEX_DIRNAME = ".videos_index"
+_INDEX_FORMAT_VERSION = 2
+# Blob sequence index of the encoded video of a `Summary.Value.video`,
+# after its dimensions and batch size.
+_VIDEO_BLOB_INDEX = 2
+# TFRecord framing: uint64 length, uint32 length CRC, data, uint32 data CRC.
+_RECORD_HEADER = struct.Struct("<QI")
+_RECORD_FOOTER_SIZE = 4
+# Runs are locked by hash into this many stripes, so that the number of
+# locks does not grow with the run names that requests make up.
+_RUN_LOCK_STRIPES = 64
+
+
+def decode_blob_key(blob_key):
+    """Decodes a blob key minted by TensorBoard's multiplexer data provider.
+
+    Returns:
+      An `(experiment_id, plugin_name, run, tag, step, index)` tuple, or
+      `None` if `blob_key` was not produced by that data provider.
+    """
+    try:
+        decoded = base64.urlsafe_b64decode(blob_key + "==")
+        fields = json.loads(decoded.decode("ascii"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(fields, list) or len(fields) != 6:
+        return None
+    return tuple(fields)
+
+
+class _EventFileIndex:
+    """Blob locations within a single event file."""
+
+    def __init__(self, path, index_path):
+        self.path = path
+        self._index_path = index_path
+        self.scanned = 0  # byte offset up to which records are indexed
+        self.video_tags = set()
+        # (tag, step, index) -> (offset, length)
+        self.entries = {}
+        # (tag, step) of every video value scanned, indexed or not.
+        self.steps = set()
+        self._mmap = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._index_path) as infile:
+                saved = json.load(infile)
+        except (OSError, ValueError):
+            return
+        if saved.get("version") != _INDEX_FORMAT_VERSION:
+            return
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if saved["scanned"] > size:
+            return  # The event file was replaced by a shorter one.
+        self.scanned = saved["scanned"]
+        self.video_tags = set(saved["tags"])
+        self.entries = {
+            (tag, step, index): (offset, length)
+            for (tag, step, index, offset, length) in saved["entries"]
+        }
+        self.steps = {(tag, step) for (tag, step) in saved["steps"]}
+
+    def _save(self):
+        saved = {
+            "version": _INDEX_FORMAT_VERSION,
+            "path": os.path.basename(self.path),
+            "scanned": self.scanned,
+            "tags": sorted(self.video_tags),
+            "entries": [
+                [tag, step, index, offset, length]
+                for ((tag, step, index), (offset, length)) in self.entries.items()
+            ],
+            "steps": sorted(self.steps),
+        }
+        temp_path = "%s.%d.tmp" % (self._index_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self._index_path), exist_ok=True)
+            with open(temp_path, "w") as outfile:
+                json.dump(saved, outfile)
+            os.replace(temp_path, self._index_path)
+        except OSError:
+            # Read-only logdirs are fine: the index just lives in memory.
+            pass
+
+    def _map(self, min_size):
+        """Returns an mmap of the event file covering at least `min_size`."""
+        if self._mmap is None or len(self._mmap) < min_size:
+            with open(self.path, "rb") as infile:
+                # Older maps stay alive as long as slices of them do.
+                self._mmap = mmap.mmap(
+                    infile.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        return self._mmap
+
+    def update(self, known_video_tags):
+        """Indexes records appended since the last update.
+
+        Args:
+          known_video_tags: Set of tags already known to belong to the
+            videos plugin, e.g. from earlier event files of the same run.
+            Updated in place with tags discovered here.
+        """
+        known_video_tags |= self.video_tags
+        size = os.path.getsize(self.path)
+        if size <= self.scanned:
+            return
+        data = self._map(size)
+        size = len(data)
+        pos = self.scanned
+        while pos + _RECORD_HEADER.size <= size:
+            (length, _) = _RECORD_HEADER.unpack_from(data, pos)
+            start = pos + _RECORD_HEADER.size
+            end = start + length
+            if end + _RECORD_FOOTER_SIZE > size:
+                break  # Partially written record; pick it up next time.
+            record = data[start:end]
+            try:
+                self._index_record(record, start, known_video_tags)
+            except message.DecodeError:
+                # Leave the rest of the file to the data provider, which
+                # reports corrupt records itself.
+                break
+            pos = end + _RECORD_FOOTER_SIZE
+        if pos == self.scanned:
+            return
+        self.scanned = pos
+        self._save()
+
+    def _index_record(self, record, record_offset, video_tags):
+        event = event_pb2.Event.FromString(record)
+        for value in event.summary.value:
+            if value.metadata.plugin_data.plugin_name == metadata.PLUGIN_NAME:
+                video_tags.add(value.tag)
+                self.video_tags.add(value.tag)
+            if value.tag not in video_tags:
+                continue
+            self.steps.add((value.tag, event.step))
+            if value.HasField("tensor"):
+                blobs = enumerate(value.tensor.string_val)
+            elif _has_video(value):
+                # Only the video is stored as bytes; the other blobs are
+                # left to the data provider.
+                blobs = [(_VIDEO_BLOB_INDEX, value.video.encoded_video_string)]
+            else:
+                continue
+            cursor = 0
+            for index, blob in blobs:
+                # Bytes fields are serialized verbatim, so the blob can be
+                # located in the record without a protobuf offset API. Any
+                # match holds identical bytes, so a spurious earlier match
+                # (e.g. for a tiny blob) is still correct.
+                found = record.find(blob, cursor)
+                if found < 0:
+                    found = record.find(blob)
+                    if found < 0:
+                        continue
+                else:
+                    cursor = found + len(blob)
+                key = (value.tag, event.step, index)
+                self.entries[key] = (record_offset + found, len(blob))
+
+    def has_step(self, tag, step):
+        return (tag, step) in self.steps
+
+    def read(self, key):
+        location = self.entries.get(key)
+        if location is None:
+            return None
+        (offset, length) = location
+        return memoryview(self._map(offset + length))[offset : offset + length]
+
+
+def _has_video(value):
+    # `Summary.Value.video` only exists in TensorBoard builds that have
+    # the videos plugin's proto changes.
+    return "video" in value.DESCRIPTOR.fields_by_name and value.HasField("video")
+
+
+class BlobIndex:
+    """Serves video blobs of a local logdir straight from its event files.
+
+    Runs are indexed independently, so indexing one run does not hold up
+    reads from the others. Blob keys come from requests, so only runs
+    inside the logdir are ever read; callers must also check that the
+    data provider lists the run, as `read_blob` does not.
+    """
+
+    def __init__(self, logdir):
+        """Creates an index for a local logdir.
+
+        Args:
+          logdir: Path to a local directory.
+        """
+        self._logdir = logdir
+        self._real_logdir = os.path.realpath(logdir)
+        # Held while reading or indexing the runs hashed to each stripe.
+        self._run_locks = [threading.Lock() for _ in range(_RUN_LOCK_STRIPES)]
+        # Run name -> list of `_EventFileIndex`, oldest event file first.
+        self._runs = {}
+
+    def read_blob(self, blob_key):
+        """Reads a video blob without going through the data provider.
+
+        Args:
+          blob_key: A blob key, as returned by the data provider.
+
+        Returns:
+          A read-only `memoryview` of the blob's bytes, or `None` if the
+          blob cannot be located in this logdir's event files (for
+          instance, because it was minted by another data provider, or
+          is not stored as bytes). Event files are only scanned again for
+          steps not seen before.
+        """
+        fields = decode_blob_key(blob_key)
+        if fields is None:
+            return None
+        (_, plugin_name, run, tag, step, index) = fields
+        if plugin_name != metadata.PLUGIN_NAME or not isinstance(run, str):
+            return None
+        run_dir = self._run_dir(run)
+        if run_dir is None:
+            return None
+        key = (tag, step, index)
+        with self._run_locks[hash(run) % _RUN_LOCK_STRIPES]:
+            result = self._read(run, key)
+            if result is None and not self._has_step(run, tag, step):
+                self._update_run(run, run_dir)
+                result = self._read(run, key)
+        return result
+
+    def _run_dir(self, run):
+        """Returns the real path of a run's directory, or `None` if that is
+        not inside the logdir."""
+        run_dir = os.path.realpath(os.path.join(self._real_logdir, run))
+        logdir = self._real_logdir
+        if os.path.commonpath([logdir, run_dir]) != logdir:
+            return None
+        return run_dir
+
+    def _has_step(self, run, tag, step):
+        return any(f.has_step(tag, step) for f in self._runs.get(run, ()))
+
+    def _read(self, run, key):
+        # Later files take precedence, as in the data provider.
+        for event_file in reversed(self._runs.get(run, ())):
+            result = event_file.read(key)
+            if result is not None:
+                return result
+        return None
+
+    def _update_run(self, run, run_dir):
+        try:
+            names = sorted(
+                name for name in os.listdir(run_dir) if "tfevents" in name
+            )
+        except OSError:
+            return
+        by_path = {f.path: f for f in self._runs.get(run, ())}
+        index_dir = os.path.join(self._logdir, INDEX_DIRNAME)
+        event_files = []
+        video_tags = set()
+        for name in names:
+            path = os.path.join(run_dir, name)
+            event_file = by_path.get(path)
+            if event_file is None:
+                relpath = os.path.relpath(path, self._real_logdir)
+                # Index file names must not contain "tfevents", or
+                # TensorBoard would try to load them as event files.
+                digest = hashlib.sha256(relpath.encode("utf-8")).hexdigest()
+                index_path = os.path.join(index_dir, digest[:32] + ".json")
+                event_file = _EventFileIndex(path, index_path)
+            try:
+                event_file.update(video_tags)
+            except OSError:
+                continue
+            event_files.append(event_file)
+        self._runs[run] = event_files
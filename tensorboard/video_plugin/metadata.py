@@ -6,7 +6,21 @@ PROTO_VERSION = 0
 
 
 def create_summary_metadata(
-    display_name, description, *, converted_to_tensor=None
+    display_name,
+    description,
+    *,
+    converted_to_tensor=None,
+    fragmented=None,
+    keyframe_interval=None,
+    width=None,
+    height=None,
+    fps=None,
+    frames=None,
+    frame_stride=None,
+    downscale=None,
+    crf=None,
+    deferred=None,
+    stream=None,
 ):
     """Create a `summary_pb2.SummaryMetadata` proto for video plugin data.
 
@@ -14,6 +28,23 @@ def create_summary_metadata(
       display_name: A name to display for this summary
       description: A description of this summary
       converted_to_tensor: Optional; whether the video has been converted to a tensor
+      fragmented: Optional; whether the videos are fragmented MP4 files
+      keyframe_interval: Optional; the maximum number of frames between
+        keyframes that the videos were encoded with
+      width: Optional; the width in pixels of the first track
+      height: Optional; the height in pixels of the first track
+      fps: Optional; the frame rate of the first track
+      frames: Optional; the number of frames of the first track
+      frame_stride: Optional; the stride at which frames were kept to
+        fit a frame budget
+      downscale: Optional; the factor by which frames were downscaled
+        to fit a resolution budget
+      crf: Optional; the x264 constant rate factor the videos were
+        encoded with
+      deferred: Optional; whether the videos are stored as raw frames
+        to be encoded when viewed
+      stream: Optional; whether each video is a segment of a stream
+        written by `VideoStream`, to be joined with earlier steps
 
     Returns:
       A `summary_pb2.SummaryMetadata` protobuf object.
@@ -21,6 +52,17 @@ def create_summary_metadata(
     content = plugin_data_pb2.VideoPluginData(
         version=PROTO_VERSION,
         converted_to_tensor=converted_to_tensor,
+        fragmented=fragmented,
+        keyframe_interval=keyframe_interval,
+        width=width,
+        height=height,
+        fps=fps,
+        frames=frames,
+        frame_stride=frame_stride,
+        downscale=downscale,
+        crf=crf,
+        deferred=deferred,
+        stream=stream,
     )
     metadata = summary_pb2.SummaryMetadata(
         display_name=display_name,
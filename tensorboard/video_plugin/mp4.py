@@ -0,0 +1,588 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Minimal ISO BMFF (MP4) parsing.
+
+Only box headers and the few tables the videos plugin needs are parsed;
+sample data is never read. All functions take a bytes-like object, such
+as an `mmap` of a file, so parsing a large video does not load it into
+memory.
+"""
+
+import contextlib
+import mmap
+import os
+import struct
+
+_CONTAINER_BOXES = frozenset(
+    [
+        "moov",
+        "trak",
+        "mdia",
+        "minf",
+        "stbl",
+        "edts",
+        "dinf",
+        "mvex",
+        "moof",
+        "traf",
+    ]
+)
+
+
+class Mp4Error(ValueError):
+    """Raised for files that are not MP4 or use unsupported features."""
+
+
+class Box:
+    """An MP4 box: its type, byte range, and child boxes if a container."""
+
+    __slots__ = ("type", "start", "end", "header_size", "children")
+
+    def __init__(self, box_type, start, end, header_size, children=None):
+        self.type = box_type
+        self.start = start
+        self.end = end
+        self.header_size = header_size
+        self.children = children
+
+    @property
+    def body(self):
+        """Offset of the first byte after the box header."""
+        return self.start + self.header_size
+
+    def find(self, *path):
+        """Returns the first descendant along `path` of box types, or `None`."""
+        box = self
+        for box_type in path:
+            box = next(
+                (c for c in box.children or () if c.type == box_type), None
+            )
+            if box is None:
+                return None
+        return box
+
+    def find_all(self, box_type):
+        return [c for c in self.children or () if c.type == box_type]
+
+
+def parse(data, start=0, end=None):
+    """Parses the boxes in `data[start:end]`.
+
+    Returns:
+      A `Box` of type `"file"` whose children are the top-level boxes.
+    """
+    if end is None:
+        end = len(data)
+    return Box("file", start, end, 0, _parse_boxes(data, start, end))
+
+
+def _parse_boxes(data, start, end):
+    boxes = []
+    pos = start
+    while pos + 8 <= end:
+        (size, raw_type) = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, pos + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - pos  # The box extends to the end of the file.
+        if size < header_size or pos + size > end:
+            break  # Truncated, e.g. still being written.
+        box = Box(raw_type.decode("latin-1"), pos, pos + size, header_size)
+        if box.type in _CONTAINER_BOXES:
+            box.children = _parse_boxes(data, box.body, box.end)
+        boxes.append(box)
+        pos += size
+    return boxes
+
+
+@contextlib.contextmanager
+def open_mapped(path):
+    """Memory-maps a file read-only, for use as the `data` argument."""
+    with open(path, "rb") as infile:
+        if os.fstat(infile.fileno()).st_size == 0:
+            data = None  # Empty files cannot be mapped.
+        else:
+            data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    if data is None:
+        yield b""
+    else:
+        with data:
+            yield data
+
+
+def video_traks(data, root):
+    """Returns the `trak` boxes of video tracks, in file order.
+
+    Args:
+      data: The bytes-like object `root` was parsed from.
+      root: The result of `parse(data)`.
+    """
+    moov = root.find("moov")
+    if moov is None:
+        raise Mp4Error("No moov box")
+    return [
+        trak
+        for trak in moov.find_all("trak")
+        if _handler_type(data, trak) == "vide"
+    ]
+
+
+def fast_start(data):
+    """Moves the moov box of a file in front of its media data.
+
+    This is what the `+faststart` muxer flag does, for files muxed where
+    that flag cannot be used, such as in memory. Browsers can then start
+    playback before the whole file arrives. The chunk offsets in every
+    `stco` and `co64` box are shifted past the moved moov box.
+
+    Args:
+      data: A bytes-like object holding an MP4 file.
+
+    Returns:
+      The rearranged file as `bytes`, or `data` itself if the moov box
+      already comes first.
+
+    Raises:
+      Mp4Error: If there is no moov box, or offsets no longer fit in an
+        `stco` box.
+    """
+    root = parse(data)
+    moov = root.find("moov")
+    if moov is None:
+        raise Mp4Error("No moov box")
+    mdat = root.find("mdat")
+    if mdat is None or mdat.start > moov.start:
+        return data
+    shift = moov.end - moov.start
+    moved = bytearray(data[moov.start : moov.end])
+    for trak in moov.find_all("trak"):
+        stbl = trak.find("mdia", "minf", "stbl")
+        for (box_type, code) in (("stco", "I"), ("co64", "Q")):
+            box = stbl.find(box_type) if stbl is not None else None
+            if box is None:
+                continue
+            (count,) = struct.unpack_from(">I", data, box.body + 4)
+            table_format = ">%d%s" % (count, code)
+            table = box.body + 8 - moov.start  # Offset within `moved`.
+            offsets = [
+                offset + shift if offset >= mdat.start else offset
+                for offset in struct.unpack_from(table_format, moved, table)
+            ]
+            if code == "I" and offsets and max(offsets) > 0xFFFFFFFF:
+                raise Mp4Error("Chunk offsets do not fit in stco")
+            struct.pack_into(table_format, moved, table, *offsets)
+    return b"".join(
+        [
+            data[: mdat.start],
+            moved,
+            data[mdat.start : moov.start],
+            data[moov.end :],
+        ]
+    )
+
+
+def fragment_sequence_numbers(data):
+    """Returns the sequence numbers of the first and last fragments.
+
+    Muxers number the fragments of a file from 1, so a file that
+    continues an earlier one starts at a higher number.
+
+    Returns:
+      A pair of the `mfhd` sequence numbers of the first and last `moof`
+      boxes, or `None` if the file has no fragments.
+
+    Raises:
+      Mp4Error: If a `moof` box has no `mfhd` box.
+    """
+    moofs = parse(data).find_all("moof")
+    if not moofs:
+        return None
+    numbers = []
+    for moof in (moofs[0], moofs[-1]):
+        mfhd = moof.find("mfhd")
+        if mfhd is None:
+            raise Mp4Error("No mfhd box in moof")
+        numbers.append(struct.unpack_from(">I", data, mfhd.body + 4)[0])
+    return tuple(numbers)
+
+
+def join_fragments(files):
+    """Joins fragmented MP4 files that continue one another.
+
+    Each file holds a copy of the same initialization segment followed
+    by the next fragments of one stream, as a `VideoStream` writes them.
+    Fragments locate their samples relative to their own `moof` box, so
+    they can be moved as they are.
+
+    Args:
+      files: A list of bytes-like objects, in stream order.
+
+    Returns:
+      The initialization segment of the first file followed by the
+      fragments of every file, as `bytes`.
+
+    Raises:
+      Mp4Error: If a file has no fragments, or its fragments use
+        absolute offsets.
+    """
+    parts = []
+    for (index, data) in enumerate(files):
+        moofs = parse(data).find_all("moof")
+        if not moofs:
+            raise Mp4Error("No fragments")
+        for moof in moofs:
+            for traf in moof.find_all("traf"):
+                tfhd = traf.find("tfhd")
+                if tfhd is None:
+                    raise Mp4Error("No tfhd box in moof")
+                (flags,) = struct.unpack_from(">I", data, tfhd.body)
+                if flags & 0x000001:  # base-data-offset-present
+                    raise Mp4Error("Fragments use absolute offsets")
+        parts.append(data[0 if index == 0 else moofs[0].start :])
+    return b"".join(parts)
+
+
+def _handler_type(data, trak):
+    hdlr = trak.find("mdia", "hdlr")
+    if hdlr is None:
+        return None
+    # Version and flags, then pre_defined, then the handler type.
+    return bytes(data[hdlr.body + 8 : hdlr.body + 12]).decode("latin-1")
+
+
+def _full_box_version(data, box):
+    return data[box.body]
+
+
+class TrackInfo:
+    """Properties of the first video track of an MP4 file.
+
+    Attributes:
+      timescale: Ticks per second of the track's media timeline.
+      duration: Duration of the track in seconds, or 0 if unknown.
+      width: Presentation width in pixels.
+      height: Presentation height in pixels.
+      codec: RFC 6381 codec string, e.g. `"avc1.64001f"`.
+      fragmented: Whether samples are stored in movie fragments.
+    """
+
+    def __init__(self, data):
+        root = parse(data)
+        traks = video_traks(data, root)
+        if not traks:
+            raise Mp4Error("No video track")
+        trak = traks[0]
+        self._data = data
+        self._root = root
+        self._trak = trak
+        mdhd = trak.find("mdia", "mdhd")
+        if mdhd is None:
+            raise Mp4Error("No mdhd box")
+        if _full_box_version(data, mdhd) == 1:
+            (self.timescale, duration) = struct.unpack_from(
+                ">IQ", data, mdhd.body + 20
+            )
+        else:
+            (self.timescale, duration) = struct.unpack_from(
+                ">II", data, mdhd.body + 12
+            )
+        self.duration = duration / self.timescale if self.timescale else 0.0
+        tkhd = trak.find("tkhd")
+        if tkhd is None:
+            raise Mp4Error("No tkhd box")
+        # Width and height are the last two fields, as 16.16 fixed point.
+        (width, height) = struct.unpack_from(">II", data, tkhd.end - 8)
+        self.width = width >> 16
+        self.height = height >> 16
+        self.codec = _codec_string(data, trak)
+        self.fragmented = (
+            root.find("moov", "mvex") is not None
+            or root.find("moof") is not None
+        )
+
+    @property
+    def mime_type(self):
+        return 'video/mp4; codecs="%s"' % self.codec
+
+    def fragments(self):
+        """Lists the movie fragments of a fragmented track.
+
+        Returns:
+          A pair `(init, fragments)`. `init` is the `(start, end)` byte
+          range of the initialization segment (everything before the
+          first fragment), and `fragments` is a list of dicts with the
+          byte range (`"range"`) and presentation interval in seconds
+          (`"start"`, `"end"`) of each `moof`+`mdat` pair.
+
+        Raises:
+          Mp4Error: If the track is not fragmented.
+        """
+        if not self.fragmented:
+            raise Mp4Error("Not a fragmented MP4 file")
+        data = self._data
+        default_duration = 0
+        mvex = self._root.find("moov", "mvex")
+        for trex in mvex.find_all("trex") if mvex is not None else ():
+            (default_duration,) = struct.unpack_from(">I", data, trex.body + 12)
+        top = self._root.children
+        first = next(
+            (i for i, box in enumerate(top) if box.type == "moof"), len(top)
+        )
+        init = (top[0].start, top[first - 1].end)
+        fragments = []
+        for i in range(first, len(top)):
+            moof = top[i]
+            if moof.type != "moof":
+                continue
+            end = moof.end
+            if i + 1 < len(top) and top[i + 1].type == "mdat":
+                end = top[i + 1].end
+            traf = moof.find("traf")
+            (decode_time, duration) = _fragment_timing(
+                data, traf, default_duration
+            )
+            fragments.append(
+                {
+                    "range": (moof.start, end),
+                    "start": decode_time / self.timescale,
+                    "end": (decode_time + duration) / self.timescale,
+                }
+            )
+        return init, fragments
+
+    def frame_index(self):
+        """Lists the presentation times of the track's frames.
+
+        Returns:
+          A pair `(frames, keyframes)` of sorted lists of presentation
+          times in seconds: one entry per frame, and one per frame that
+          decoding can start from.
+        """
+        if self.fragmented:
+            samples = list(self._fragment_samples())
+        else:
+            samples = list(self._table_samples())
+        shift = _edit_media_time(self._data, self._trak)
+        if shift is None:
+            # Fragmented files written with an empty moov have no edit
+            # list, yet their composition times are delayed all the same;
+            # start presentation at the first frame, as an edit list would.
+            shift = (
+                min(time for (time, _) in samples)
+                if self.fragmented and samples
+                else 0
+            )
+        frames = []
+        keyframes = []
+        for (time, is_sync) in samples:
+            time = (time - shift) / self.timescale
+            frames.append(time)
+            if is_sync:
+                keyframes.append(time)
+        frames.sort()
+        keyframes.sort()
+        return frames, keyframes
+
+    def _table_samples(self):
+        """Yields `(composition_time, is_sync)` from the sample table."""
+        data = self._data
+        stbl = self._trak.find("mdia", "minf", "stbl")
+        if stbl is None or stbl.find("stts") is None:
+            raise Mp4Error("No stts box")
+        offsets = _run_lengths(data, stbl.find("ctts"))
+        stss = stbl.find("stss")
+        sync = None  # Without a sync sample table, every sample is sync.
+        if stss is not None:
+            (count,) = struct.unpack_from(">I", data, stss.body + 4)
+            sync = set(struct.unpack_from(">%dI" % count, data, stss.body + 8))
+        decode_time = 0
+        number = 1
+        for delta in _run_lengths(data, stbl.find("stts")):
+            offset = next(offsets, 0)
+            yield decode_time + offset, sync is None or number in sync
+            decode_time += delta
+            number += 1
+
+    def _fragment_samples(self):
+        """Yields `(composition_time, is_sync)` from the movie fragments."""
+        data = self._data
+        default_duration = 0
+        mvex = self._root.find("moov", "mvex")
+        for trex in mvex.find_all("trex") if mvex is not None else ():
+            (default_duration,) = struct.unpack_from(">I", data, trex.body + 12)
+        for moof in self._root.find_all("moof"):
+            traf = moof.find("traf")
+            (decode_time, _) = _fragment_timing(data, traf, default_duration)
+            for (duration, offset, is_sync) in _trun_samples(
+                data, traf, default_duration
+            ):
+                yield decode_time + offset, is_sync
+                decode_time += duration
+
+
+def _run_lengths(data, box):
+    """Expands a table of `(count, value)` runs, as in stts and ctts."""
+    if box is None:
+        return
+    signed = _full_box_version(data, box) == 1
+    (count,) = struct.unpack_from(">I", data, box.body + 4)
+    for (run, value) in struct.iter_unpack(
+        ">Ii" if signed else ">II",
+        data[box.body + 8 : box.body + 8 + 8 * count],
+    ):
+        for _ in range(run):
+            yield value
+
+
+def _edit_media_time(data, trak):
+    """Returns the media time, in ticks, at which presentation starts.
+
+    Encoders that reorder frames delay composition times and add an edit
+    list to cancel the delay; players, ffmpeg included, apply it.
+
+    Returns:
+      The media time, or `None` if the track has no edit list.
+    """
+    elst = trak.find("edts", "elst")
+    if elst is None:
+        return None
+    (count,) = struct.unpack_from(">I", data, elst.body + 4)
+    wide = _full_box_version(data, elst) == 1
+    entry = struct.Struct(">Qq" if wide else ">Ii")
+    stride = entry.size + 4  # Each entry ends with a media rate.
+    for i in range(count):
+        (_, media_time) = entry.unpack_from(data, elst.body + 8 + stride * i)
+        if media_time >= 0:  # -1 marks an empty edit.
+            return media_time
+    return 0
+
+
+def _trun_samples(data, traf, default_duration):
+    """Yields `(duration, composition_offset, is_sync)` for each sample
+    of a track fragment."""
+    tfhd = traf.find("tfhd")
+    (tf_flags,) = struct.unpack_from(">I", data, tfhd.body)
+    pos = tfhd.body + 8  # Version and flags, then track ID.
+    if tf_flags & 0x01:
+        pos += 8  # base_data_offset
+    if tf_flags & 0x02:
+        pos += 4  # sample_description_index
+    if tf_flags & 0x08:
+        (default_duration,) = struct.unpack_from(">I", data, pos)
+        pos += 4
+    if tf_flags & 0x10:
+        pos += 4  # default_sample_size
+    default_flags = None
+    if tf_flags & 0x20:
+        (default_flags,) = struct.unpack_from(">I", data, pos)
+    for trun in traf.find_all("trun"):
+        signed = _full_box_version(data, trun) == 1
+        (flags, sample_count) = struct.unpack_from(">II", data, trun.body)
+        flags &= 0xFFFFFF
+        pos = trun.body + 8
+        if flags & 0x001:
+            pos += 4  # data_offset
+        first_flags = None
+        if flags & 0x004:
+            (first_flags,) = struct.unpack_from(">I", data, pos)
+            pos += 4
+        for i in range(sample_count):
+            duration = default_duration
+            sample_flags = default_flags
+            offset = 0
+            if flags & 0x100:
+                (duration,) = struct.unpack_from(">I", data, pos)
+                pos += 4
+            if flags & 0x200:
+                pos += 4  # sample_size
+            if flags & 0x400:
+                (sample_flags,) = struct.unpack_from(">I", data, pos)
+                pos += 4
+            if flags & 0x800:
+                (offset,) = struct.unpack_from(
+                    ">i" if signed else ">I", data, pos
+                )
+                pos += 4
+            if i == 0 and first_flags is not None:
+                sample_flags = first_flags
+            if sample_flags is None:
+                # Fragments written with frag_keyframe start with one.
+                is_sync = i == 0
+            else:
+                is_sync = not sample_flags & 0x10000  # non-sync bit
+            yield duration, offset, is_sync
+
+
+def _fragment_timing(data, traf, default_duration):
+    """Returns the decode time and duration of a track fragment, in ticks."""
+    if traf is None or traf.find("tfhd") is None:
+        raise Mp4Error("No tfhd box in moof")
+    decode_time = 0
+    tfdt = traf.find("tfdt")
+    if tfdt is not None:
+        if _full_box_version(data, tfdt) == 1:
+            (decode_time,) = struct.unpack_from(">Q", data, tfdt.body + 4)
+        else:
+            (decode_time,) = struct.unpack_from(">I", data, tfdt.body + 4)
+    tfhd = traf.find("tfhd")
+    (flags,) = struct.unpack_from(">I", data, tfhd.body)
+    pos = tfhd.body + 8  # Version and flags, then track ID.
+    if flags & 0x01:
+        pos += 8  # base_data_offset
+    if flags & 0x02:
+        pos += 4  # sample_description_index
+    if flags & 0x08:
+        (default_duration,) = struct.unpack_from(">I", data, pos)
+    duration = 0
+    for trun in traf.find_all("trun"):
+        (flags, sample_count) = struct.unpack_from(">II", data, trun.body)
+        flags &= 0xFFFFFF
+        pos = trun.body + 8
+        if flags & 0x001:
+            pos += 4  # data_offset
+        if flags & 0x004:
+            pos += 4  # first_sample_flags
+        if not flags & 0x100:
+            duration += default_duration * sample_count
+            continue
+        stride = 4 * bin(flags & 0xF00).count("1")
+        for _ in range(sample_count):
+            (sample_duration,) = struct.unpack_from(">I", data, pos)
+            duration += sample_duration
+            pos += stride
+    return decode_time, duration
+
+
+def _codec_string(data, trak):
+    stsd = trak.find("mdia", "minf", "stbl", "stsd")
+    if stsd is None:
+        raise Mp4Error("No stsd box")
+    # Version and flags, then entry count, then the first sample entry.
+    entry = stsd.body + 8
+    (entry_size, raw_type) = struct.unpack_from(">I4s", data, entry)
+    fourcc = raw_type.decode("latin-1")
+    if fourcc in ("avc1", "avc3"):
+        # A VisualSampleEntry has 78 bytes of fields before its child
+        # boxes, one of which is the AVC decoder configuration.
+        children = _parse_boxes(data, entry + 8 + 78, entry + entry_size)
+        avcc = next((box for box in children if box.type == "avcC"), None)
+        if avcc is not None:
+            (profile, compatibility, level) = struct.unpack_from(
+                ">xBBB", data, avcc.body
+            )
+            return "%s.%02x%02x%02x" % (fourcc, profile, compatibility, level)
+    return fourcc
@@ -24,13 +24,13 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11plugin_data.proto\x12\x0btensorboard\"?\n\x0fVideoPluginData\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x1b\n\x13\x63onverted_to_tensor\x18\x02 \x01(\x08\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11plugin_data.proto\x12\x0btensorboard\"\x82\x02\n\x0fVideoPluginData\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x1b\n\x13\x63onverted_to_tensor\x18\x02 \x01(\x08\x12\x12\n\nfragmented\x18\x03 \x01(\x08\x12\x19\n\x11keyframe_interval\x18\x04 \x01(\x05\x12\r\n\x05width\x18\x05 \x01(\x05\x12\x0e\n\x06height\x18\x06 \x01(\x05\x12\x0b\n\x03\x66ps\x18\x07 \x01(\x02\x12\x0e\n\x06\x66rames\x18\x08 \x01(\x05\x12\x14\n\x0c\x66rame_stride\x18\t \x01(\x05\x12\x11\n\tdownscale\x18\n \x01(\x05\x12\x0b\n\x03\x63rf\x18\x0b \x01(\x05\x12\x10\n\x08\x64\x65\x66\x65rred\x18\x0c \x01(\x08\x12\x0e\n\x06stream\x18\r \x01(\x08\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'plugin_data_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_VIDEOPLUGINDATA']._serialized_start=34
-  _globals['_VIDEOPLUGINDATA']._serialized_end=97
+  _globals['_VIDEOPLUGINDATA']._serialized_start=35
+  _globals['_VIDEOPLUGINDATA']._serialized_end=293
 # @@protoc_insertion_point(module_scope)
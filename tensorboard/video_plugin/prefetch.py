@@ -0,0 +1,122 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Low-priority background work for warming caches ahead of requests."""
+
+import contextlib
+import heapq
+import itertools
+import threading
+
+_DEFAULT_NUM_WORKERS = 1
+_DEFAULT_MAX_PENDING = 32
+
+# Priorities for `Prefetcher.submit`; lower values run first.
+PRIORITY_NEXT = 0
+PRIORITY_PREVIOUS = 1
+
+
+class Prefetcher:
+    """Runs best-effort tasks on background threads when the server is idle.
+
+    Workers only start a task while no foreground request (see
+    `foreground`) is in progress, so prefetching never queues ahead of
+    work a user is waiting for. Among equal priorities, the most recently
+    submitted task runs first, and once more than `max_pending` tasks are
+    queued the least urgent ones are dropped.
+    """
+
+    def __init__(
+        self,
+        num_workers=_DEFAULT_NUM_WORKERS,
+        max_pending=_DEFAULT_MAX_PENDING,
+    ):
+        self._num_workers = num_workers
+        self._max_pending = max_pending
+        self._cv = threading.Condition()
+        self._heap = []  # (priority, -sequence, key, fn)
+        self._queued = set()
+        self._sequence = itertools.count()
+        self._foreground = 0
+        self._running = 0
+        self._workers = []
+
+    @contextlib.contextmanager
+    def foreground(self):
+        """Marks a block of request handling that prefetching must not delay."""
+        with self._cv:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._cv:
+                self._foreground -= 1
+                self._cv.notify_all()
+
+    def submit(self, key, fn, priority=PRIORITY_NEXT):
+        """Queues `fn` to be called in the background.
+
+        Args:
+          key: Hashable identifier of the task; a task whose key is
+            already queued is not queued again.
+          fn: Zero-argument callable. Exceptions it raises are ignored;
+            the same work will be redone, and fail visibly, if it is
+            ever requested in the foreground.
+          priority: One of the `PRIORITY_*` constants.
+        """
+        with self._cv:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+            entry = (priority, -next(self._sequence), key, fn)
+            heapq.heappush(self._heap, entry)
+            if len(self._heap) > self._max_pending:
+                self._heap.sort()  # A sorted list is still a valid heap.
+                (_, _, dropped, _) = self._heap.pop()
+                self._queued.discard(dropped)
+            if len(self._workers) < self._num_workers:
+                worker = threading.Thread(
+                    target=self._work, name="videos-prefetch", daemon=True
+                )
+                self._workers.append(worker)
+                worker.start()
+            self._cv.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Blocks until no task is queued or running.
+
+        Returns:
+          Whether the prefetcher became idle before `timeout` seconds.
+        """
+        with self._cv:
+            return self._cv.wait_for(
+                lambda: not self._heap and not self._running, timeout
+            )
+
+    def _work(self):
+        while True:
+            with self._cv:
+                while not self._heap or self._foreground:
+                    self._cv.wait()
+                (_, _, key, fn) = heapq.heappop(self._heap)
+                self._queued.discard(key)
+                self._running += 1
+            try:
+                fn()
+            except Exception:
+                pass
+            finally:
+                with self._cv:
+                    self._running -= 1
+                    self._cv.notify_all()
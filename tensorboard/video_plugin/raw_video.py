@@ -0,0 +1,217 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Compact raw frame storage for videos that are encoded when viewed.
+
+Writers that cannot afford to encode video store frames in this format
+instead, and the videos plugin transcodes them to MP4 on first view. A
+blob is a fixed header followed by the zlib-compressed frames, each as
+its byte-wise difference (modulo 256) from the previous frame of the
+same track, which compresses much better than the frames themselves.
+
+Frames are stored one after another with channels last, so that `Reader`
+can decompress a few frames at a time and hand them to the encoder
+without holding the whole video in memory.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"TBVRAW2\0"
+# Magic, then batch size, channels, frames, height and width, then fps.
+_HEADER = struct.Struct(">8s5If")
+# zlib level: writing must stay cheap; the plugin only decompresses.
+_COMPRESSION_LEVEL = 1
+# Compressed bytes passed to zlib at a time while decoding.
+_INPUT_BLOCK_SIZE = 1 << 16
+
+
+def is_raw(data):
+    """Returns whether a blob holds raw frames rather than an MP4 file."""
+    return bytes(data[: len(MAGIC)]) == MAGIC
+
+
+def encode(frames, fps):
+    """Packs uint8 video frames into a raw frame blob.
+
+    Args:
+      frames: A `uint8` array of shape `(batch_size, channels, frames,
+        height, width)`, where `channels` is 1 or 3.
+      fps: Frames per second of the video.
+
+    Returns:
+      The blob, as `bytes`.
+    """
+    frames = np.asarray(frames, dtype=np.uint8)
+    if frames.ndim != 5:
+        raise ValueError("Expected 5D frames, got shape %s" % (frames.shape,))
+    # (batch_size, frames, height, width, channels)
+    frames_last = np.transpose(frames, (0, 2, 3, 4, 1))
+    deltas = np.empty(frames_last.shape, dtype=np.uint8)
+    deltas[:, :1] = frames_last[:, :1]
+    # uint8 arithmetic wraps around, so this is exactly invertible.
+    np.subtract(frames_last[:, 1:], frames_last[:, :-1], out=deltas[:, 1:])
+    header = _HEADER.pack(MAGIC, *frames.shape, fps)
+    return header + zlib.compress(deltas.data, _COMPRESSION_LEVEL)
+
+
+def decode(data):
+    """Unpacks a raw frame blob all at once.
+
+    Prefer `Reader` for large videos.
+
+    Returns:
+      A `(frames, fps)` pair, where `frames` is a `uint8` array of shape
+      `(batch_size, channels, frames, height, width)`.
+
+    Raises:
+      ValueError: If `data` is not a valid raw frame blob.
+    """
+    reader = Reader(data)
+    frames = np.empty(
+        (
+            reader.batch_size,
+            reader.channels,
+            reader.frames,
+            reader.height,
+            reader.width,
+        ),
+        dtype=np.uint8,
+    )
+    for (index, chunks) in enumerate(reader.tracks(reader.frames)):
+        for chunk in chunks:
+            frames[index] = np.transpose(chunk, (3, 0, 1, 2))
+    return frames, reader.fps
+
+
+class Reader:
+    """Decodes a raw frame blob incrementally.
+
+    Attributes:
+      batch_size: Number of tracks.
+      channels: 1 (grayscale) or 3 (RGB).
+      frames: Number of frames per track.
+      height: Height of each frame.
+      width: Width of each frame.
+      fps: Frames per second of the video.
+    """
+
+    def __init__(self, data):
+        """Reads the header of a raw frame blob.
+
+        Args:
+          data: The blob, as a bytes-like object such as an mmap slice.
+
+        Raises:
+          ValueError: If `data` is not a raw frame blob.
+        """
+        if len(data) < _HEADER.size or not is_raw(data):
+            raise ValueError("Not a raw frame blob")
+        (
+            _,
+            self.batch_size,
+            self.channels,
+            self.frames,
+            self.height,
+            self.width,
+            self.fps,
+        ) = _HEADER.unpack_from(data)
+        self._data = memoryview(data)[_HEADER.size :]
+
+    def tracks(self, chunk_frames):
+        """Yields each track as an iterator over chunks of its frames.
+
+        Chunks are `uint8` arrays of shape `(frames, height, width,
+        channels)` with at most `chunk_frames` frames, decompressed as
+        they are consumed. The payload is read once, in order: moving on
+        to the next track skips what is left of the previous one.
+
+        Raises:
+          ValueError: While iterating, if the blob is corrupt or does not
+            match its header.
+        """
+        inflater = _Inflater(self._data)
+        for _ in range(self.batch_size):
+            track = self._track(inflater, max(1, chunk_frames))
+            yield track
+            for _ in track:
+                pass
+        inflater.check_end()
+
+    def _track(self, inflater, chunk_frames):
+        frame_shape = (self.height, self.width, self.channels)
+        frame_size = self.height * self.width * self.channels
+        previous = None
+        for start in range(0, self.frames, chunk_frames):
+            count = min(chunk_frames, self.frames - start)
+            chunk = np.frombuffer(
+                inflater.read(frame_size * count), dtype=np.uint8
+            ).reshape((count,) + frame_shape)
+            if previous is not None:
+                chunk[0] += previous
+            np.cumsum(chunk, axis=0, dtype=np.uint8, out=chunk)
+            previous = chunk[-1].copy()
+            yield chunk
+
+
+class _Inflater:
+    """Decompresses a zlib stream in pieces of a requested size."""
+
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+        self._pending = b""  # Compressed input not yet consumed.
+        self._decompressor = zlib.decompressobj()
+
+    def read(self, size):
+        """Returns the next `size` decompressed bytes, as a `bytearray`."""
+        output = bytearray()
+        while len(output) < size:
+            if not self._pending and not self._next_block():
+                raise ValueError("Raw frame blob does not match its shape")
+            output += self._decompress(size - len(output))
+        return output
+
+    def check_end(self):
+        """Raises `ValueError` unless the zlib stream ends exactly here."""
+        while not self._decompressor.eof:
+            if not self._pending and not self._next_block():
+                raise ValueError("Raw frame blob is truncated")
+            if self._decompress(1):
+                raise ValueError("Raw frame blob does not match its shape")
+        if (
+            self._decompressor.unused_data
+            or self._pending
+            or self._position < len(self._data)
+        ):
+            raise ValueError("Raw frame blob has trailing data")
+
+    def _next_block(self):
+        """Queues the next block of input; returns False at its end."""
+        if self._position >= len(self._data):
+            return False
+        end = self._position + _INPUT_BLOCK_SIZE
+        self._pending = self._data[self._position : end]
+        self._position = end
+        return True
+
+    def _decompress(self, max_length):
+        try:
+            output = self._decompressor.decompress(self._pending, max_length)
+        except (zlib.error, OverflowError) as e:
+            raise ValueError("Corrupt raw frame blob: %s" % e)
+        self._pending = self._decompressor.unconsumed_tail
+        return output
@@ -0,0 +1,115 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the raw frame blob format."""
+
+import unittest
+
+import numpy as np
+
+from video_plugin import raw_video
+
+
+def _frames(shape, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+class RoundTripTest(unittest.TestCase):
+    def test_decode(self):
+        for channels in (1, 3):
+            with self.subTest(channels=channels):
+                frames = _frames((2, channels, 5, 6, 7))
+                data = raw_video.encode(frames, 12.5)
+                self.assertTrue(raw_video.is_raw(data))
+                (decoded, fps) = raw_video.decode(data)
+                np.testing.assert_array_equal(decoded, frames)
+                self.assertEqual(fps, 12.5)
+
+    def test_reader_chunks(self):
+        frames = _frames((3, 3, 7, 4, 4))
+        reader = raw_video.Reader(memoryview(raw_video.encode(frames, 4)))
+        self.assertEqual(
+            (
+                reader.batch_size,
+                reader.channels,
+                reader.frames,
+                reader.height,
+                reader.width,
+            ),
+            frames.shape,
+        )
+        for index, track in enumerate(reader.tracks(3)):
+            chunks = list(track)
+            self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 1])
+            np.testing.assert_array_equal(
+                np.concatenate(chunks), np.transpose(frames[index], (1, 2, 3, 0))
+            )
+
+    def test_reader_skips_unread_tracks(self):
+        frames = _frames((3, 1, 4, 2, 2))
+        reader = raw_video.Reader(raw_video.encode(frames, 4))
+        tracks = reader.tracks(1)
+        next(tracks)
+        last = list(next(tracks))
+        np.testing.assert_array_equal(
+            np.concatenate(last), np.transpose(frames[1], (1, 2, 3, 0))
+        )
+
+    def test_rejects_wrong_rank(self):
+        with self.assertRaises(ValueError):
+            raw_video.encode(np.zeros((1, 3, 2, 2), np.uint8), 4)
+
+
+class CorruptInputTest(unittest.TestCase):
+    def setUp(self):
+        self.data = raw_video.encode(_frames((2, 3, 4, 8, 8)), 4)
+
+    def test_not_raw(self):
+        for data in (b"", b"TBVRAW2", b"\0\0\0\x18ftypisom" + b"\0" * 64):
+            with self.subTest(data=data):
+                self.assertFalse(raw_video.is_raw(data))
+                with self.assertRaises(ValueError):
+                    raw_video.Reader(data)
+
+    def test_truncated_header(self):
+        with self.assertRaises(ValueError):
+            raw_video.decode(raw_video.MAGIC + b"\0" * 4)
+
+    def test_truncated_payload(self):
+        for size in (len(self.data) - 1, len(self.data) // 2, 40):
+            with self.subTest(size=size):
+                with self.assertRaises(ValueError):
+                    raw_video.decode(self.data[:size])
+
+    def test_trailing_data(self):
+        with self.assertRaises(ValueError):
+            raw_video.decode(self.data + b"\0")
+
+    def test_corrupt_payload(self):
+        data = bytearray(self.data)
+        data[-1] ^= 0xFF
+        with self.assertRaises(ValueError):
+            raw_video.decode(bytes(data))
+
+    def test_shape_mismatch(self):
+        # A header claiming fewer frames than the payload holds.
+        reader = raw_video.Reader(self.data)
+        reader.frames -= 1
+        with self.assertRaises(ValueError):
+            for track in reader.tracks(reader.frames):
+                list(track)
+
+
+if __name__ == "__main__":
+    unittest.main()
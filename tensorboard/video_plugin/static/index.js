@@ -1,3 +1,21 @@
+import {splitTracks} from './mp4.js';
+
+// When enabled, each multitrack blob is downloaded once and split into
+// tracks in the browser instead of fetching every track separately.
+const CLIENT_SPLIT_KEY = 'videos.clientSplit';
+let clientSplit = localStorage.getItem(CLIENT_SPLIT_KEY) === 'true';
+
+// When enabled, the tracks of a multitrack blob are shown as one video,
+// tiled by the server, instead of one video element per track.
+const COMPOSITE_KEY = 'videos.composite';
+let composite = localStorage.getItem(COMPOSITE_KEY) === 'true';
+
+// Seconds of a fragmented video to keep buffered ahead of the playhead.
+const MSE_LOOKAHEAD = 10;
+
+// Number of evenly spaced still frames shown per track in a frame strip.
+const FRAME_STRIP_LENGTH = 8;
+
 export async function render() {
     // Initial loading message
     const msg = createElement('p', 'Fetching video data…');
@@ -46,6 +64,22 @@ export async function render() {
           margin-top: 10px;
           font-size: 0.9em;
         }
+        .video-row.composite {
+          grid-template-columns: 1fr !important;
+        }
+        .video-row.composite .tensor-video:not(:first-child) {
+          display: none;
+        }
+        .frame-strip {
+          display: flex;
+          gap: 2px;
+          margin-top: 4px;
+        }
+        .frame-strip img {
+          flex: 1;
+          min-width: 0;
+          cursor: pointer;
+        }
       `
     );
     document.head.appendChild(style);
@@ -128,6 +162,37 @@ export async function render() {
                 value: '100',
               }),
             ]),
+            // Track splitting
+            createElement('div', { className: 'slider-container' }, [
+              createElement('label', [
+                createElement('input', {
+                  type: 'checkbox',
+                  id: 'clientSplit',
+                  ...(clientSplit ? { checked: '' } : {}),
+                  onchange: (e) => {
+                    clientSplit = e.target.checked;
+                    localStorage.setItem(CLIENT_SPLIT_KEY, String(clientSplit));
+                    document.querySelectorAll('.video-row').forEach(assignSources);
+                  },
+                }),
+                ' Split tracks in browser',
+              ]),
+            ]),
+            createElement('div', { className: 'slider-container' }, [
+              createElement('label', [
+                createElement('input', {
+                  type: 'checkbox',
+                  id: 'composite',
+                  ...(composite ? { checked: '' } : {}),
+                  onchange: (e) => {
+                    composite = e.target.checked;
+                    localStorage.setItem(COMPOSITE_KEY, String(composite));
+                    document.querySelectorAll('.video-row').forEach(assignSources);
+                  },
+                }),
+                ' Show tracks as one video',
+              ]),
+            ]),
             // Global Controls
             createElement('div', { className: 'global-controls' }, [
               createElement('button', { 
@@ -159,6 +224,7 @@ export async function render() {
       // Replace loading message and render dashboard
       msg.remove();
       document.body.appendChild(dashboard);
+      document.querySelectorAll('.video-row').forEach(assignSources);
   
       // Initialize controls
       initializeControls();
@@ -174,14 +240,16 @@ export async function render() {
       createElement('div', { className: 'video-card', 'data-tag': tag }, [
         createElement('div', {
           className: 'video-row',
+          'data-query': video.query,
+          'data-fragmented': String(Boolean(metadata.fragmented)),
+          'data-deferred': String(Boolean(metadata.deferred)),
           style: 'display: grid; grid-template-columns: repeat(' + video.batch_size + ', 1fr); gap: 10px;'
         },
-          Array.from({ length: video.batch_size }, (_, track_number) =>
+          Array.from({ length: video.batch_size }, () =>
             createElement('video', {
               className: 'tensor-video',
               controls: true,
               loop: true,
-              src: `./individualVideo?${video.query}&track_number=${track_number}`,
             })
           )
         ),
@@ -192,11 +260,154 @@ export async function render() {
           createElement('div', `Wall Time: ${new Date(video.wall_time * 1000).toLocaleString()}`),
           createElement('div', `Batch Size: ${video.batch_size}`),
           metadata.description && createElement('div', `Description: ${metadata.description}`),
+          createElement('button', { onclick: toggleFrameStrips }, 'Frames'),
         ]),
       ])
     );
   }
+
+  // Shows or hides a strip of still frames under each track of a card.
+  // Frames are fetched as small images instead of whole videos, and
+  // clicking one seeks the track to it.
+  function toggleFrameStrips(event) {
+    const card = event.target.closest('.video-card');
+    const existing = card.querySelector('.frame-strips');
+    if (existing) {
+      existing.remove();
+      return;
+    }
+    const row = card.querySelector('.video-row');
+    const query = row.getAttribute('data-query');
+    const strips = createElement('div', { className: 'frame-strips' });
+    row.after(strips);
+    row.querySelectorAll('video').forEach((video, track_number) => {
+      const strip = createElement('div', { className: 'frame-strip' });
+      strips.appendChild(strip);
+      const fill = () => {
+        for (let i = 0; i < FRAME_STRIP_LENGTH; i++) {
+          const t = (video.duration * i / FRAME_STRIP_LENGTH).toFixed(3);
+          strip.appendChild(createElement('img', {
+            src: `./frame?${query}&track_number=${track_number}&t=${t}&format=jpeg`,
+            title: `${t}s`,
+            onclick: () => { video.currentTime = Number(t); },
+          }));
+        }
+      };
+      if (Number.isFinite(video.duration)) {
+        fill();
+      } else {
+        video.addEventListener('loadedmetadata', fill, { once: true });
+      }
+    });
+  }
   
+  // Points the videos of a card at their tracks, either split in the
+  // browser from a single download or split by the server, or points the
+  // first video at a composite of all tracks.
+  async function assignSources(row) {
+    const videos = Array.from(row.querySelectorAll('video'));
+    const query = row.getAttribute('data-query');
+    videos.forEach((video) => {
+      if (video.src.startsWith('blob:')) {
+        URL.revokeObjectURL(video.src);
+      }
+    });
+    row.classList.toggle('composite', composite && videos.length > 1);
+    if (row.classList.contains('composite')) {
+      videos.forEach((video) => video.removeAttribute('src'));
+      videos[0].src = `./composite?${query}`;
+      return;
+    }
+    if (row.getAttribute('data-fragmented') === 'true' && window.MediaSource) {
+      await Promise.all(videos.map(async (video, track_number) => {
+        try {
+          await playFragmented(video, `${query}&track_number=${track_number}`);
+        } catch (error) {
+          console.warn('Progressive playback failed:', error);
+          video.src = `./individualVideo?${query}&track_number=${track_number}`;
+        }
+      }));
+      return;
+    }
+    // Deferred videos are stored as raw frames, which only the server
+    // can turn into MP4.
+    if (clientSplit && row.getAttribute('data-deferred') !== 'true') {
+      try {
+        const response = await fetchOk(`./rawVideo?${query}`);
+        const tracks = splitTracks(await response.arrayBuffer());
+        if (tracks.length === videos.length) {
+          videos.forEach((video, i) => {
+            video.src = URL.createObjectURL(new Blob([tracks[i]], { type: 'video/mp4' }));
+          });
+          return;
+        }
+      } catch (error) {
+        console.warn('Splitting tracks in the browser failed:', error);
+      }
+    }
+    videos.forEach((video, track_number) => {
+      video.src = `./individualVideo?${query}&track_number=${track_number}`;
+    });
+  }
+
+  // Plays a fragmented track through MediaSource, fetching only the
+  // fragments between the playhead and MSE_LOOKAHEAD seconds after it.
+  async function playFragmented(video, params) {
+    const listing = await fetchOk(`./segments?${params}`).then((response) => response.json());
+    if (!MediaSource.isTypeSupported(listing.mimeType)) {
+      throw new Error(`Unsupported media type: ${listing.mimeType}`);
+    }
+    const mediaSource = new MediaSource();
+    video.src = URL.createObjectURL(mediaSource);
+    await new Promise((resolve) => {
+      mediaSource.addEventListener('sourceopen', resolve, { once: true });
+    });
+    mediaSource.duration = listing.duration;
+    const sourceBuffer = mediaSource.addSourceBuffer(listing.mimeType);
+    const append = (data) => new Promise((resolve, reject) => {
+      sourceBuffer.addEventListener('updateend', resolve, { once: true });
+      sourceBuffer.addEventListener('error', reject, { once: true });
+      sourceBuffer.appendBuffer(data);
+    });
+    const fetchSegment = (segment) =>
+      fetchOk(`./segment?${params}&segment=${segment}`).then((response) => response.arrayBuffer());
+    await append(await fetchSegment('init'));
+
+    const appended = new Set();
+    let filling = false;
+    const fill = async () => {
+      if (filling || mediaSource.readyState !== 'open') {
+        return;
+      }
+      filling = true;
+      try {
+        for (const [i, segment] of listing.segments.entries()) {
+          const horizon = video.currentTime + MSE_LOOKAHEAD;
+          if (appended.has(i) || segment.end <= video.currentTime || segment.start > horizon) {
+            continue;
+          }
+          await append(await fetchSegment(i));
+          appended.add(i);
+        }
+        if (appended.size === listing.segments.length) {
+          mediaSource.endOfStream();
+        }
+      } finally {
+        filling = false;
+      }
+    };
+    ['timeupdate', 'seeking', 'waiting'].forEach((type) => video.addEventListener(type, fill));
+    await fill();
+  }
+
+  async function fetchOk(url) {
+    const response = await fetch(url);
+    if (!response.ok) {
+      throw new Error(`${url}: ${response.status} ${response.statusText}`);
+    }
+    return response;
+  }
+
   function createElement(tag, propsOrChildren, maybeChildren) {
     const element = document.createElement(tag);
     
@@ -0,0 +1,154 @@
+// Minimal ISO BMFF (MP4) parsing, enough to split a multitrack video
+// into single-track files in the browser without re-encoding.
+
+const CONTAINER_BOXES = new Set([
+  'moov', 'trak', 'mdia', 'minf', 'stbl', 'edts', 'dinf', 'mvex', 'moof', 'traf',
+]);
+
+export function parseBoxes(view, start = 0, end = view.byteLength) {
+  const boxes = [];
+  let offset = start;
+  while (offset + 8 <= end) {
+    let size = view.getUint32(offset);
+    let headerSize = 8;
+    if (size === 1) {
+      size = Number(view.getBigUint64(offset + 8));
+      headerSize = 16;
+    } else if (size === 0) {
+      size = end - offset;  // Box extends to the end of the file.
+    }
+    if (size < headerSize || offset + size > end) {
+      break;
+    }
+    const box = {type: fourcc(view, offset + 4), start: offset, end: offset + size, headerSize};
+    if (CONTAINER_BOXES.has(box.type)) {
+      box.children = parseBoxes(view, offset + headerSize, offset + size);
+    }
+    boxes.push(box);
+    offset += size;
+  }
+  return boxes;
+}
+
+// Splits an MP4 file into one standalone MP4 per video track, in track
+// order. Each output holds only its own track's samples, so the outputs
+// together are about as large as the input.
+export function splitTracks(buffer) {
+  const view = new DataView(buffer);
+  const boxes = parseBoxes(view);
+  const ftyp = boxes.find((box) => box.type === 'ftyp');
+  const moov = boxes.find((box) => box.type === 'moov');
+  if (!ftyp || !moov) {
+    throw new Error('Not an MP4 file');
+  }
+  if (boxes.some((box) => box.type === 'moof') ||
+      moov.children.some((box) => box.type === 'mvex')) {
+    throw new Error('Fragmented MP4 files are not supported');
+  }
+  const traks = moov.children.filter(
+    (box) => box.type === 'trak' && handlerType(view, box) === 'vide');
+  const shared = moov.children.filter((box) => box.type !== 'trak');
+  return traks.map((trak) => buildSingleTrack(buffer, view, ftyp, shared, trak));
+}
+
+function buildSingleTrack(buffer, view, ftyp, sharedBoxes, trak) {
+  const stbl = findPath(trak, ['mdia', 'minf', 'stbl']);
+  const chunks = chunkRanges(view, stbl);
+  const chunkOffsets = stbl.children.find((box) => box.type === 'stco' || box.type === 'co64');
+  const moovSize = 8 + [...sharedBoxes, trak].reduce((n, box) => n + box.end - box.start, 0);
+  const payloadSize = chunks.reduce((n, chunk) => n + chunk.size, 0);
+  const out = new Uint8Array((ftyp.end - ftyp.start) + moovSize + 8 + payloadSize);
+  const outView = new DataView(out.buffer);
+  const source = new Uint8Array(buffer);
+  let pos = 0;
+  const copyBox = (box) => {
+    out.set(source.subarray(box.start, box.end), pos);
+    pos += box.end - box.start;
+  };
+  const writeHeader = (size, type) => {
+    outView.setUint32(pos, size);
+    for (let i = 0; i < 4; i++) {
+      out[pos + 4 + i] = type.charCodeAt(i);
+    }
+    pos += 8;
+  };
+
+  copyBox(ftyp);
+  writeHeader(moovSize, 'moov');
+  sharedBoxes.forEach(copyBox);
+  // Chunk offsets are absolute, so they are patched below once the new
+  // position of each chunk is known. The table keeps its size.
+  const entries = pos + (chunkOffsets.start - trak.start) + chunkOffsets.headerSize + 8;
+  copyBox(trak);
+  writeHeader(8 + payloadSize, 'mdat');
+  const wide = chunkOffsets.type === 'co64';
+  chunks.forEach((chunk, i) => {
+    if (wide) {
+      outView.setBigUint64(entries + 8 * i, BigInt(pos));
+    } else {
+      outView.setUint32(entries + 4 * i, pos);
+    }
+    out.set(source.subarray(chunk.offset, chunk.offset + chunk.size), pos);
+    pos += chunk.size;
+  });
+  return out;
+}
+
+// Returns the byte range of every chunk of a track, from its sample
+// table: chunk offsets (stco/co64), samples per chunk (stsc) and sample
+// sizes (stsz).
+function chunkRanges(view, stbl) {
+  const find = (type) => stbl.children.find((box) => box.type === type);
+  const stsc = find('stsc');
+  const stsz = find('stsz');
+  const stco = find('stco') || find('co64');
+  if (!stsc || !stsz || !stco) {
+    throw new Error('Unsupported sample table');
+  }
+  const body = (box) => box.start + box.headerSize + 4;  // Skip version and flags.
+
+  const chunkCount = view.getUint32(body(stco));
+  const chunkOffset = stco.type === 'co64' ?
+    (i) => Number(view.getBigUint64(body(stco) + 4 + 8 * i)) :
+    (i) => view.getUint32(body(stco) + 4 + 4 * i);
+  const uniformSize = view.getUint32(body(stsz));
+  const sampleCount = view.getUint32(body(stsz) + 4);
+  const sampleSize = (i) => uniformSize || view.getUint32(body(stsz) + 8 + 4 * i);
+  const runs = Array.from({length: view.getUint32(body(stsc))}, (_, i) => ({
+    firstChunk: view.getUint32(body(stsc) + 4 + 12 * i),
+    samplesPerChunk: view.getUint32(body(stsc) + 8 + 12 * i),
+  }));
+
+  const chunks = [];
+  let sample = 0;
+  let run = 0;
+  for (let chunk = 0; chunk < chunkCount; chunk++) {
+    while (run + 1 < runs.length && runs[run + 1].firstChunk <= chunk + 1) {
+      run++;
+    }
+    let size = 0;
+    for (let k = 0; k < runs[run].samplesPerChunk && sample < sampleCount; k++) {
+      size += sampleSize(sample++);
+    }
+    chunks.push({offset: chunkOffset(chunk), size});
+  }
+  return chunks;
+}
+
+function handlerType(view, trak) {
+  const hdlr = findPath(trak, ['mdia', 'hdlr']);
+  // Version and flags, then pre_defined, then the handler type.
+  return hdlr ? fourcc(view, hdlr.start + hdlr.headerSize + 8) : null;
+}
+
+function findPath(box, types) {
+  return types.reduce(
+    (parent, type) => parent && (parent.children || []).find((child) => child.type === type),
+    box);
+}
+
+function fourcc(view, offset) {
+  return String.fromCharCode(
+    view.getUint8(offset), view.getUint8(offset + 1),
+    view.getUint8(offset + 2), view.getUint8(offset + 3));
+}
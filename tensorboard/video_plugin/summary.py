@@ -6,9 +6,11 @@ for zero or more videos in a rank-1 string array: [w, h, fps, vid0, vid1, ...].
 
 import numpy as np
 
-from tensorboard.plugins.video import metadata
-from tensorboard.plugins.video import summary_v2
-from tensorboard.util import encoder
+from tensorboard.compat.proto import summary_pb2
+from tensorboard.util import tensor_util
+from video_plugin import encoder
+from video_plugin import metadata
+from video_plugin import summary_v2
 
 # Export V2 versions.
 video = summary_v2.video
@@ -64,22 +66,7 @@ def op(
         ]
     ):
         limited_videos = videos[:max_outputs]
-        
-        def encode_video(video_tensor):
-            # Note: In practice, you'd want to use a proper video encoder here
-            # This is a placeholder for actual video encoding logic
-            return tf.py_function(
-                lambda x: encoder.encode_video(x, fps),
-                [video_tensor],
-                tf.string
-            )
-        
-        encoded_videos = tf.map_fn(
-            encode_video,
-            limited_videos,
-            dtype=tf.string,
-            name="encode_each_video",
-        )
+        encoded_videos = summary_v2.encode_mp4(limited_videos, fps)
 
         video_shape = tf.shape(input=videos)
         dimensions = tf.stack(
@@ -102,6 +89,10 @@ def op(
 def pb(name, videos, fps=30, max_outputs=3, display_name=None, description=None):
     """Create a legacy video summary protobuf.
 
+    This behaves as if you were to create an `op` with the same arguments
+    (wrapped with constant tensors where appropriate) and then execute
+    that summary op in a TensorFlow session, but needs no TensorFlow.
+
     Arguments:
       name: A unique name for the generated summary, including any desired
         name scopes.
@@ -119,56 +110,37 @@ def pb(name, videos, fps=30, max_outputs=3, display_name=None, description=None)
         constant `str`. Markdown is supported. Defaults to empty.
 
     Returns:
-      A TensorFlow summary protobuf.
+      A `summary_pb2.Summary` protobuf object.
+
+    Raises:
+      ValueError: If `videos` is not a rank-5 `uint8` RGB array, or
+        `max_outputs` is negative.
     """
-    import tensorflow.compat.v1 as tf
+    videos = np.asarray(videos)
+    if videos.ndim != 5:
+        raise ValueError("Shape %r must have rank 5" % (videos.shape,))
+    if videos.dtype != np.uint8:
+        raise ValueError("Videos must be uint8, got %s" % videos.dtype)
+    if videos.shape[-1] != 3:
+        raise ValueError("Videos must be RGB, got %d channels" % videos.shape[-1])
+    if max_outputs < 0:
+        raise ValueError("max_outputs must be non-negative, got %r" % max_outputs)
+
+    encoded_videos = encoder.encode_batch(videos[:max_outputs], fps)
+    (width, height) = (videos.shape[3], videos.shape[2])
+    content = [str(width), str(height), str(fps)] + encoded_videos
+    tensor = tensor_util.make_tensor_proto(content, dtype="string")
 
     if display_name is None:
         display_name = name
-
     summary_metadata = metadata.create_summary_metadata(
         display_name=display_name, description=description
     )
 
-    with tf.name_scope(name), tf.control_dependencies(
-        [
-            tf.assert_rank(videos, 5),  # [batch, time, height, width, channels]
-            tf.assert_type(videos, tf.uint8),
-            tf.assert_equal(tf.shape(videos)[-1], 3),  # RGB only
-            tf.assert_non_negative(max_outputs),
-        ]
-    ):
-        limited_videos = videos[:max_outputs]
-        
-        def encode_video(video_tensor):
-            # Note: In practice, you'd want to use a proper video encoder here
-            # This is a placeholder for actual video encoding logic
-            return tf.py_function(
-                lambda x: encoder.encode_video(x, fps),
-                [video_tensor],
-                tf.string
-            )
-        
-        encoded_videos = tf.map_fn(
-            encode_video,
-            limited_videos,
-            dtype=tf.string,
-            name="encode_each_video",
-        )
-
-        video_shape = tf.shape(input=videos)
-        dimensions = tf.stack(
-            [
-                tf.as_string(video_shape[3], name="width"),
-                tf.as_string(video_shape[2], name="height"),
-                tf.as_string(fps, name="fps"),
-            ],
-            name="dimensions",
-        )
-        
-        tensor = tf.concat([dimensions, encoded_videos], axis=0)
-        return tf.summary.tensor_summary(
-            name="video_summary",
-            tensor=tensor,
-            summary_metadata=summary_metadata,
-        )
+    summary = summary_pb2.Summary()
+    summary.value.add(
+        tag="%s/video_summary" % name,
+        metadata=summary_metadata,
+        tensor=tensor,
+    )
+    return summary
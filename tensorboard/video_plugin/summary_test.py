@@ -0,0 +1,124 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests that writing video summaries does not import TensorFlow.
+
+Each test runs in a fresh interpreter, so that modules imported by other
+tests cannot hide an import, with a `sys.meta_path` finder that rejects
+every attempt to import `tensorflow`. Attempts made from the plugin or
+from this repository's PyTorch writer fail the test; other libraries may
+probe for TensorFlow and fall back without it, as `tensorboard.compat`
+does.
+"""
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+
+# Installs the finder; the snippet under test runs after it, and the
+# blocked imports it is responsible for are printed as JSON on the last
+# line of output.
+_PRELUDE = textwrap.dedent(
+    """
+    import atexit
+    import json
+    import os
+    import sys
+
+    _WRITER = os.path.join("torch", "utils", "tensorboard", "summary.py")
+    _PLUGIN = os.path.join("video_plugin", "")
+    blocked = []
+
+
+    class TensorFlowBlocker:
+        def find_spec(self, name, path=None, target=None):
+            if name != "tensorflow" and not name.startswith("tensorflow."):
+                return None
+            frame = sys._getframe(1)
+            while frame is not None:
+                filename = frame.f_code.co_filename
+                if _PLUGIN in filename or filename.endswith(_WRITER):
+                    blocked.append(
+                        "%s from %s:%d" % (name, filename, frame.f_lineno)
+                    )
+                    break
+                frame = frame.f_back
+            raise ImportError("Importing %s is blocked" % name)
+
+
+    sys.meta_path.insert(0, TensorFlowBlocker())
+    atexit.register(lambda: print(json.dumps(blocked)))
+    """
+)
+
+_PLUGIN_IMPORTS = textwrap.dedent(
+    """
+    import numpy as np
+
+    from video_plugin import encoder
+    from video_plugin import summary
+    from video_plugin import videos_plugin
+
+    try:
+        encoder.get_backend()
+    except encoder.EncoderUnavailableError:
+        pass
+    else:
+        videos = np.zeros((2, 4, 16, 16, 3), dtype=np.uint8)
+        proto = summary.pb("clip", videos, fps=4)
+        assert len(proto.value) == 1, proto
+    """
+)
+
+_WRITER_IMPORTS = textwrap.dedent(
+    """
+    from torch.utils.tensorboard import summary
+    from torch.utils.tensorboard import SummaryWriter
+    """
+)
+
+
+class ImportTest(unittest.TestCase):
+    def _blocked_imports(self, code):
+        """Runs `code` with TensorFlow blocked; returns what it tried."""
+        plugin_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            path for path in (plugin_root, env.get("PYTHONPATH")) if path
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", _PRELUDE + code],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def test_plugin_modules_do_not_import_tensorflow(self):
+        self.assertEqual(self._blocked_imports(_PLUGIN_IMPORTS), [])
+
+    def test_pytorch_writer_does_not_import_tensorflow(self):
+        if importlib.util.find_spec("torch") is None:
+            self.skipTest("PyTorch is not installed")
+        self.assertEqual(self._blocked_imports(_WRITER_IMPORTS), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
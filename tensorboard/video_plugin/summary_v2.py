@@ -1,4 +1,10 @@
-import tensorflow as tf
+"""Video summaries for TensorFlow 2.
+
+TensorFlow is imported on first use, not with this module, so that
+importing the video summary helpers stays cheap for callers that never
+write a TensorFlow summary.
+"""
+
 from video_plugin import metadata
 from tensorboard.util import lazy_tensor_creator
 
@@ -16,6 +22,8 @@ def video(name, data, fps=4, step=None, max_outputs=3, description=None):
       max_outputs: Optional `int`. Max number of videos to output
       description: Optional long-form description
     """
+    import tensorflow as tf
+
     summary_metadata = metadata.create_summary_metadata(
         display_name=None, description=description
     )
@@ -53,32 +61,28 @@ def video(name, data, fps=4, step=None, max_outputs=3, description=None):
         )
 
 def encode_mp4(video_tensor, fps):
-    import tempfile
-    import os
-    from moviepy.editor import ImageSequenceClip
+    """Encodes a batch of videos into MP4 files in a single op.
 
-    def encode_video_fn(video_data):
-        video_np = video_data.numpy()
-        clip = ImageSequenceClip(list(video_np), fps=fps)
-        # Create a temporary file with .mp4 extension
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        try:
-            # Write to the temporary file
-            clip.write_videofile(temp_path, codec='libx264', audio=False, 
-                               verbose=False, logger=None)
-            # Read the file contents
-            with open(temp_path, 'rb') as f:
-                video_bytes = f.read()
-        finally:
-            # Clean up the temporary file
-            os.unlink(temp_path)
-            
-        return video_bytes
+    All videos are handed to Python together and encoded concurrently,
+    rather than crossing into Python once per video.
+
+    Args:
+      video_tensor: A `uint8` `Tensor` of shape `[k, t, h, w, c]`.
+      fps: Frames per second, as a number or scalar `Tensor`.
+
+    Returns:
+      A string `Tensor` of shape `[k]` holding the MP4 files.
+    """
+    import tensorflow as tf
+
+    from video_plugin import encoder
+
+    def encode_batch(videos, fps):
+        encoded = encoder.encode_batch(videos.numpy(), float(fps.numpy()))
+        return tf.constant(encoded, dtype=tf.string, shape=[len(encoded)])
 
-    return tf.map_fn(
-        lambda x: tf.py_function(encode_video_fn, [x], tf.string),
-        video_tensor,
-        dtype=tf.string
+    encoded_videos = tf.py_function(
+        encode_batch, [video_tensor, tf.cast(fps, tf.float64)], tf.string
     )
+    encoded_videos.set_shape(video_tensor.shape[:1])
+    return encoded_videos
@@ -0,0 +1,174 @@
+# Copyright 2024 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""On-disk cache for files derived from video blobs."""
+
+import collections
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+_DEFAULT_MAX_BYTES = 2 << 30  # 2 GiB
+
+
+class TrackCache:
+    """Bounded, least-recently-used cache of derived files on disk.
+
+    Each entry is a directory holding the files written by a `build`
+    callback, such as the demuxed tracks of one blob. Once the total size
+    of all entries exceeds `max_bytes`, the least recently used entries
+    are deleted. Entries being read can be pinned with `pin`, which keeps
+    them until their files are open; files already opened stay readable
+    after eviction on POSIX systems, so streaming responses are never cut
+    off.
+
+    Concurrent requests for a key that is being built wait for that build
+    rather than starting their own.
+    """
+
+    def __init__(self, directory=None, max_bytes=_DEFAULT_MAX_BYTES):
+        """Creates a cache.
+
+        Args:
+          directory: Directory to store entries in. Defaults to a fresh
+            temporary directory that is removed along with this object.
+          max_bytes: Soft limit on the total size of all entries.
+        """
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="tensorboard-videos-")
+            weakref.finalize(self, shutil.rmtree, directory, True)
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Key -> (paths, size, entry directory), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._total_bytes = 0
+        # Key -> `threading.Event` set when an in-progress build finishes.
+        self._pending = {}
+        # Key -> number of `pin` contexts holding the entry.
+        self._pins = collections.Counter()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries or key in self._pending
+
+    def get(self, key, build):
+        """Returns the paths of the files cached under `key`.
+
+        Args:
+          key: A string identifying the entry.
+          build: Called with the path of a fresh, empty directory when the
+            entry is missing. Must write the entry's files into that
+            directory and return a list of their paths.
+
+        Returns:
+          The list of paths returned by `build`, possibly by an earlier
+          call. The files may be evicted as soon as this returns; use
+          `pin` to open them.
+        """
+        return self._get(key, build, pin=False)
+
+    @contextlib.contextmanager
+    def pin(self, key, build):
+        """Like `get`, but keeps the entry from being evicted until exit.
+
+        Open or map the files within the `with` block; they stay readable
+        once open.
+
+        Yields:
+          The list of paths returned by `build`.
+        """
+        paths = self._get(key, build, pin=True)
+        try:
+            yield paths
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                evicted = self._evict()
+            _remove(evicted)
+
+    def _get(self, key, build, pin):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    if pin:
+                        self._pins[key] += 1
+                    return entry[0]
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+            # The other build either succeeded (hit on the next pass) or
+            # failed, in which case this caller retries it.
+        try:
+            paths = self._build(key, build, pin)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return paths
+
+    def _build(self, key, build, pin):
+        # Every build gets a fresh directory, so that deleting an evicted
+        # entry never races with rebuilding it.
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        entry_dir = tempfile.mkdtemp(prefix=name + "-", dir=self._directory)
+        try:
+            paths = list(build(entry_dir))
+            size = sum(os.path.getsize(path) for path in paths)
+        except BaseException:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            raise
+        with self._lock:
+            self._entries[key] = (paths, size, entry_dir)
+            self._total_bytes += size
+            if pin:
+                self._pins[key] += 1
+            evicted = self._evict()
+        _remove(evicted)
+        return paths
+
+    def _evict(self):
+        """Drops least recently used entries while over `max_bytes`.
+
+        Pinned entries and the most recently used one are kept. Must be
+        called with the lock held.
+
+        Returns:
+          The directories of the dropped entries, for `_remove`.
+        """
+        evicted = []
+        for key in list(self._entries)[:-1]:
+            if self._total_bytes <= self._max_bytes:
+                break
+            if key in self._pins:
+                continue
+            (_, size, entry_dir) = self._entries.pop(key)
+            self._total_bytes -= size
+            evicted.append(entry_dir)
+        return evicted
+
+
+def _remove(directories):
+    for directory in directories:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -14,8 +14,19 @@
 # ==============================================================================
 """The TensorBoard Videos plugin."""
 
+import bisect
+import collections
+import contextlib
+import functools
+import hashlib
+import json
+import math
+import struct
+import threading
 import urllib.parse
+import numpy as np
 from werkzeug import wrappers
+from werkzeug import wsgi
 import os
 
 from tensorboard import errors
@@ -23,10 +34,255 @@ from tensorboard import plugin_util
 from tensorboard.backend import http_util
 from tensorboard.data import provider
 from tensorboard.plugins import base_plugin
+from tensorboard.util import tb_logging
+from video_plugin import dedup
+from video_plugin import encoder
+from video_plugin import event_index
 from video_plugin import metadata
+from video_plugin import mp4
+from video_plugin import prefetch
+from video_plugin import raw_video
+from video_plugin import track_cache
+
+logger = tb_logging.get_logger()
 
 _VIDEO_MIMETYPE = "video/mp4"
 _DEFAULT_DOWNSAMPLING = 10  # videos per time series
+_STREAM_CHUNK_SIZE = 1 << 20  # bytes per chunk of a streamed response
+_RAW_VIDEO_CHUNK_SIZE = 16 << 20  # bytes of raw frames encoded at a time
+# Keeps the demuxed tracks of fragmented videos fragmented, so that they
+# can be played through MediaSource one fragment at a time.
+_FRAGMENTED_MOVFLAGS = "frag_keyframe+empty_moov+default_base_moof"
+# Puts the moov atom of other demuxed tracks first, so that browsers can
+# start playback and seek with Range requests without fetching the tail.
+_FAST_START_MOVFLAGS = "+faststart"
+_METADATA_MEMO_SIZE = 4096  # distinct plugin contents / descriptions
+_FRAME_INDEX_MEMO_SIZE = 256  # tracks whose frame times are kept
+_RESOLVED_KEYS_MEMO_SIZE = 4096  # blobs whose reference status is kept
+_BLOB_DIGESTS_MEMO_SIZE = 4096  # blob keys whose content digest is kept
+_NEIGHBORS_MEMO_SIZE = 4096  # blob keys whose prefetch neighbors are kept
+# Most videos per time series searched for the original of a video
+# reference. The data provider only holds its sample of each time series
+# (see `--samples_per_plugin`), so sampled-out originals are not found.
+_REFERENCE_SEARCH_LIMIT = 1000
+# Largest (width, height) of a composite of all tracks of a video.
+_COMPOSITE_MAX_SIZE = (1920, 1080)
+# Seconds by which a `/frame` time may exceed the end of the track, as
+# the browser rounds times to milliseconds.
+_FRAME_TIME_SLACK = 1e-3
+# Still-frame formats served by `/frame`: file extension and media type.
+_FRAME_FORMATS = {
+    "png": ("png", "image/png"),
+    "jpeg": ("jpg", "image/jpeg"),
+}
+# Versioned static assets never change for a given URL, so browsers may
+# keep them for as long as they like without revalidating.
+_IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Everything else may change under the same URL (a run can be rewritten
+# under the same name), so browsers revalidate it by entity tag.
+_REVALIDATE_CACHE_CONTROL = "no-cache, must-revalidate"
+
+
+@functools.lru_cache(maxsize=_METADATA_MEMO_SIZE)
+def _parse_plugin_metadata(content):
+    """Memoized `metadata.parse_plugin_metadata`, keyed by content bytes."""
+    return metadata.parse_plugin_metadata(content)
+
+
+@functools.lru_cache(maxsize=_METADATA_MEMO_SIZE)
+def _markdown_to_safe_html(markdown):
+    """Memoized `plugin_util.markdown_to_safe_html`, keyed by source text."""
+    return plugin_util.markdown_to_safe_html(markdown)
+
+
+def _content_etag(*parts):
+    """Computes a strong entity tag from strings and bytestrings."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(b"%d:" % len(part))
+        digest.update(part)
+    return digest.hexdigest()[:32]
+
+
+def _json_etag(value):
+    """Computes a strong entity tag for a JSON-serializable value."""
+    return _content_etag(
+        json.dumps(value, sort_keys=True, separators=(",", ":"))
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _static_asset(name):
+    """Reads a file under `static/` once.
+
+    Returns:
+      A `(contents, version)` pair, where `version` is a short hash of
+      the contents suitable for cache busting and as an entity tag.
+    """
+    path = os.path.join(os.path.dirname(__file__), "static", name)
+    with open(path, "rb") as infile:
+        contents = infile.read()
+    return contents, _content_etag(contents)[:16]
+
+
+def _respond_cached(
+    request, content, content_type, etag, *, immutable=False, code=200
+):
+    """Like `http_util.Respond`, but with an entity tag.
+
+    Requests whose `If-None-Match` header already names `etag` get an
+    empty `304 Not Modified` response. Otherwise the response carries
+    the entity tag and, if `immutable`, a long-lived `Cache-Control`;
+    if not, the browser must revalidate it on each use.
+
+    Args:
+      request: A werkzeug Request object.
+      content: The response payload.
+      content_type: Media type, as for `http_util.Respond`.
+      etag: A strong entity tag, without quotes.
+      immutable: Whether `content` can never change for this URL.
+      code: Numeric HTTP status code to use for a full response.
+
+    Returns:
+      A werkzeug Response object (a WSGI application).
+    """
+    if request.if_none_match.contains(etag):
+        response = wrappers.Response(status=304)
+    else:
+        response = http_util.Respond(request, content, content_type, code=code)
+    response.set_etag(etag)
+    if immutable:
+        response.headers.pop("Expires", None)
+        response.headers["Cache-Control"] = _IMMUTABLE_CACHE_CONTROL
+    else:
+        response.headers["Cache-Control"] = _REVALIDATE_CACHE_CONTROL
+    return response
+
+
+def _respond_file(request, path, content_type, etag, byte_range=None):
+    """Streams a file in bounded chunks.
+
+    As with `_respond_cached`, browsers must revalidate the response by
+    its entity tag. `Range` requests are honored, so that browsers can
+    seek without downloading the whole file.
+
+    Args:
+      request: A werkzeug Request object.
+      path: Path of the file to serve. The file is opened before this
+        function returns, so it may be deleted afterward.
+      content_type: Media type of the file.
+      etag: A strong entity tag, without quotes.
+      byte_range: Optional `(start, end)` pair to serve only part of the
+        file as the whole response body.
+
+    Returns:
+      A werkzeug Response object (a WSGI application).
+    """
+    infile = open(path, "rb")
+    if byte_range is None:
+        size = os.fstat(infile.fileno()).st_size
+        body = wsgi.wrap_file(request.environ, infile, _STREAM_CHUNK_SIZE)
+    else:
+        (start, end) = byte_range
+        size = end - start
+        infile.seek(start)
+        body = _read_chunks(infile, size)
+    return _respond_stream(request, body, size, content_type, etag)
+
+
+def _read_chunks(infile, size):
+    """Yields the next `size` bytes of a file in bounded chunks, then closes it."""
+    with infile:
+        while size > 0:
+            chunk = infile.read(min(size, _STREAM_CHUNK_SIZE))
+            if not chunk:
+                return
+            size -= len(chunk)
+            yield chunk
+
+
+def _respond_buffer(request, data, content_type, etag):
+    """Like `_respond_file`, but for a bytes-like object such as an mmap slice.
+
+    Only one chunk at a time is copied out of `data`.
+    """
+    body = (
+        bytes(data[start : start + _STREAM_CHUNK_SIZE])
+        for start in range(0, len(data), _STREAM_CHUNK_SIZE)
+    )
+    return _respond_stream(request, body, len(data), content_type, etag)
+
+
+def _respond_stream(request, body, size, content_type, etag):
+    response = wrappers.Response(
+        body,
+        content_type=content_type,
+        direct_passthrough=True,
+        headers=[
+            ("Content-Length", str(size)),
+            ("X-Content-Type-Options", "nosniff"),
+            ("Cache-Control", _REVALIDATE_CACHE_CONTROL),
+        ],
+    )
+    response.set_etag(etag)
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=size
+    )
+
+
+@functools.lru_cache(maxsize=_FRAME_INDEX_MEMO_SIZE)
+def _frame_index(track_path):
+    """Memoized `mp4.TrackInfo.frame_index` of a cached track file.
+
+    Every build of a track cache entry writes to a fresh directory, so
+    the path alone identifies the index.
+    """
+    with mp4.open_mapped(track_path) as data:
+        return mp4.TrackInfo(data).frame_index()
+
+
+def _index_arg(value):
+    """Parses a track or segment number from a query parameter.
+
+    Raises:
+      ValueError: If `value` is not a non-negative integer, so that it
+        cannot index from the end of a list.
+    """
+    index = int(value)
+    if index < 0:
+        raise ValueError("Negative index %d" % index)
+    return index
+
+
+def _even_sized(chunks):
+    """Pads chunks of frames with black to even dimensions, as 4:2:0
+    chroma needs."""
+    for chunk in chunks:
+        (_, height, width, _) = chunk.shape
+        if height % 2 or width % 2:
+            chunk = np.pad(chunk, ((0, 0), (0, height % 2), (0, width % 2), (0, 0)))
+        yield chunk
+
+
+def _index_fingerprint(mapping):
+    """Summarizes the parts of a blob sequence listing the index depends on.
+
+    Args:
+      mapping: The result of `list_blob_sequences`, a dict of dicts of
+        `BlobSequenceTimeSeries` keyed by run and tag.
+
+    Returns:
+      A hashable value that changes whenever the set of runs and tags or
+      the `max_length` of any time series changes.
+    """
+    return frozenset(
+        (run, tag, time_series.max_length)
+        for run, tag_to_time_series in mapping.items()
+        for tag, time_series in tag_to_time_series.items()
+    ) | frozenset((run, None, None) for run in mapping)
+
 
 class VideosPlugin(base_plugin.TBPlugin):
     """Videos Plugin for TensorBoard."""
@@ -47,12 +303,49 @@ class VideosPlugin(base_plugin.TBPlugin):
             data_kind="video",
             latest_known_version=metadata.PROTO_VERSION,
         )
+        # Experiment ID -> (fingerprint, index, etag) of the last `/tags`
+        # result.
+        self._index_cache = {}
+        self._index_cache_lock = threading.Lock()
+        self._track_cache = track_cache.TrackCache()
+        self._prefetcher = prefetch.Prefetcher()
+        # Blob key -> (previous, next, stream) of the same time series, as
+        # of the last `/videos` listing: the neighboring blob keys, either
+        # of which may be `None`, and whether the time series holds the
+        # segments of a `VideoStream`. Most recently listed last.
+        self._neighbors = collections.OrderedDict()
+        self._neighbors_lock = threading.Lock()
+        # Blob key -> (wall time, content digest or `None` if not yet
+        # computed), most recently used last; see `_blob_digest`.
+        self._digests = collections.OrderedDict()
+        self._digests_lock = threading.Lock()
+        # Content-addressed references; see `_resolve_blob_key`.
+        # (Experiment ID, content digest) of a blob -> key of the original
+        # it refers to, or `None` if it is not a reference, most recently
+        # used last. Then (blob key, wall time) of the candidate originals
+        # read -> their dedup digest or `None`, most recently used last;
+        # and dedup digest -> the (blob key, wall time) it was read from,
+        # evicted along with that.
+        self._resolved_keys = collections.OrderedDict()
+        self._scanned_keys = collections.OrderedDict()
+        self._digest_keys = {}
+        self._dedup_lock = threading.Lock()
+        # Fast path for reading blobs of local logdirs; see `_read_blob`.
+        self._blob_index = None
+        if context.logdir and os.path.isdir(context.logdir):
+            self._blob_index = event_index.BlobIndex(context.logdir)
 
     def get_plugin_apps(self):
         return {
             "/index.js": self._serve_js,
             "/videos": self._serve_video_metadata,
+            "/composite": self._serve_composite,
+            "/frame": self._serve_frame,
             "/individualVideo": self._serve_individual_video,
+            "/mp4.js": self._serve_js,
+            "/rawVideo": self._serve_raw_video,
+            "/segment": self._serve_segment,
+            "/segments": self._serve_segments,
             "/tags": self._serve_tags,
         }
 
@@ -60,29 +353,58 @@ class VideosPlugin(base_plugin.TBPlugin):
         return True  # `list_plugins` as called by TB core suffices
 
     def frontend_metadata(self):
-        return base_plugin.FrontendMetadata(es_module_path="/index.js")
+        # The version query parameter lets `/index.js` be cached forever:
+        # a new build of the plugin is loaded from a new URL.
+        _, version = _static_asset("index.js")
+        return base_plugin.FrontendMetadata(
+            es_module_path="/index.js?v=%s" % version
+        )
 
     def _index_impl(self, ctx, experiment):
+        return self._index_and_etag(ctx, experiment)[0]
+
+    def _index_and_etag(self, ctx, experiment):
+        """Computes the `/tags` index, reusing the last one if unchanged.
+
+        The listing itself is always fetched from the data provider, but
+        the per-tag work is only redone when the set of runs and tags or
+        some `max_length` has changed since the last call for the same
+        experiment.
+
+        Returns:
+          An `(index, etag)` pair, where `etag` is a content hash of the
+          index.
+        """
         mapping = self._data_provider.list_blob_sequences(
             ctx,
             experiment_id=experiment,
             plugin_name=metadata.PLUGIN_NAME,
         )
+        fingerprint = _index_fingerprint(mapping)
+        with self._index_cache_lock:
+            cached = self._index_cache.get(experiment)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1:]
         result = {run: {} for run in mapping}
         for run, tag_to_content in mapping.items():
             for tag, metadatum in tag_to_content.items():
-                md = metadata.parse_plugin_metadata(metadatum.plugin_content)
+                md = _parse_plugin_metadata(metadatum.plugin_content)
                 if not self._version_checker.ok(md.version, run, tag):
                     continue
-                description = plugin_util.markdown_to_safe_html(
-                    metadatum.description
-                )
+                description = _markdown_to_safe_html(metadatum.description)
                 result[run][tag] = {
                     "displayName": metadatum.display_name,
                     "description": description,
                     "samples": metadatum.max_length-2,
+                    "fragmented": md.fragmented,
+                    "keyframeInterval": md.keyframe_interval,
+                    "deferred": md.deferred,
+                    "stream": md.stream,
                 }
-        return result
+        etag = _json_etag(result)
+        with self._index_cache_lock:
+            self._index_cache[experiment] = (fingerprint, result, etag)
+        return result, etag
 
     @wrappers.Request.application
     def _serve_video_metadata(self, request):
@@ -100,7 +422,9 @@ class VideosPlugin(base_plugin.TBPlugin):
             return http_util.Respond(
                 request, "Invalid run or tag", "text/plain", code=400
             )
-        return http_util.Respond(request, response, "application/json")
+        return _respond_cached(
+            request, response, "application/json", _json_etag(response)
+        )
 
     def _video_response_for_run(self, ctx, experiment, run, tag, sample, batch_size_idx):
         all_videos = self._data_provider.read_blob_sequences(
@@ -115,98 +439,847 @@ class VideosPlugin(base_plugin.TBPlugin):
             raise errors.NotFoundError(
                 "No video data for run=%r, tag=%r" % (run, tag)
             )
+        videos = [datum for datum in videos if len(datum.values) > sample]
+        blob_keys = [datum.values[sample].blob_key for datum in videos]
+        self._record_wall_times(
+            blob_keys, [datum.wall_time for datum in videos]
+        )
+        self._record_neighbors(
+            blob_keys, stream=self._is_stream(ctx, experiment, run, tag)
+        )
         return [
             {
                 "wall_time": datum.wall_time,
                 "step": datum.step,
-                "batch_size": int(self._get_sample_at_index(ctx, datum, batch_size_idx)),
+                "batch_size": int(
+                    self._get_sample_at_index(
+                        ctx, experiment, datum, batch_size_idx
+                    )
+                ),
                 "query": self._data_provider_query(datum.values[sample]),
             }
             for datum in videos
-            if len(datum.values) > sample
         ]
 
-    def _get_sample_at_index(self, ctx, datum, index):
-        return self._data_provider.read_blob(ctx, blob_key=datum.values[index].blob_key)
+    def _is_stream(self, ctx, experiment, run, tag):
+        """Whether a time series holds the segments of a `VideoStream`."""
+        mapping = self._data_provider.list_blob_sequences(
+            ctx,
+            experiment_id=experiment,
+            plugin_name=metadata.PLUGIN_NAME,
+            run_tag_filter=provider.RunTagFilter(runs=[run], tags=[tag]),
+        )
+        time_series = mapping.get(run, {}).get(tag)
+        if time_series is None:
+            return False
+        return _parse_plugin_metadata(time_series.plugin_content).stream
+
+    def _record_neighbors(self, blob_keys, stream=False):
+        """Remembers the step order of a time series for prefetching, and
+        for joining the segments of a stream (see `_read_video`)."""
+        previous_keys = [None] + blob_keys[:-1]
+        next_keys = blob_keys[1:] + [None]
+        with self._neighbors_lock:
+            for key, previous_key, next_key in zip(
+                blob_keys, previous_keys, next_keys
+            ):
+                self._neighbors[key] = (previous_key, next_key, stream)
+                self._neighbors.move_to_end(key)
+            while len(self._neighbors) > _NEIGHBORS_MEMO_SIZE:
+                self._neighbors.popitem(last=False)
+
+    def _prefetch_neighbors(self, ctx, experiment, blob_key):
+        """Queues demuxing of the steps before and after `blob_key`.
+
+        All tracks of a blob are demuxed together, so the other tracks of
+        `blob_key` itself are already warm by the time this is called.
+        """
+        with self._neighbors_lock:
+            (previous_key, next_key, _) = self._neighbors.get(
+                blob_key, (None, None, False)
+            )
+        for key, priority in (
+            (next_key, prefetch.PRIORITY_NEXT),
+            (previous_key, prefetch.PRIORITY_PREVIOUS),
+        ):
+            if key is None:
+                continue
+            digest = self._known_digest(key)
+            if digest is not None and "tracks:%s" % digest in self._track_cache:
+                continue
+            self._prefetcher.submit(
+                key,
+                functools.partial(self._prefetch_tracks, ctx, experiment, key),
+                priority=priority,
+            )
+
+    def _prefetch_tracks(self, ctx, experiment, blob_key):
+        self._track_paths(
+            ctx, experiment, self._resolve_blob_key(ctx, experiment, blob_key)
+        )
+
+    def _get_sample_at_index(self, ctx, experiment, datum, index):
+        return bytes(
+            self._read_blob(ctx, experiment, datum.values[index].blob_key)
+        )
+
+    def _read_blob(self, ctx, experiment, blob_key):
+        """Reads a blob, from an mmap of its event file where possible.
+
+        Returns:
+          A bytes-like object: `bytes` from the data provider, or a
+          read-only `memoryview` backed by the OS page cache.
+        """
+        if self._blob_index is not None and self._is_listed_run(
+            ctx, experiment, blob_key
+        ):
+            data = self._blob_index.read_blob(blob_key)
+            if data is not None:
+                return data
+        return self._data_provider.read_blob(ctx, blob_key=blob_key)
+
+    def _record_wall_times(self, blob_keys, wall_times):
+        """Notes when blobs were written, as listed by the data provider.
+
+        A rewritten run may reuse a blob key, but not with the same wall
+        time, so a digest memoized for one wall time stays valid until a
+        listing reports another.
+        """
+        with self._digests_lock:
+            for blob_key, wall_time in zip(blob_keys, wall_times):
+                entry = self._digests.get(blob_key)
+                if entry is None or entry[0] != wall_time:
+                    self._digests[blob_key] = (wall_time, None)
+                self._digests.move_to_end(blob_key)
+            while len(self._digests) > _BLOB_DIGESTS_MEMO_SIZE:
+                self._digests.popitem(last=False)
+
+    def _known_digest(self, blob_key):
+        """Returns the memoized content digest of a blob, or `None`."""
+        with self._digests_lock:
+            entry = self._digests.get(blob_key)
+        return None if entry is None else entry[1]
+
+    def _blob_digest(self, ctx, experiment, blob_key):
+        """Returns a hash of the contents of a blob.
+
+        Blob keys need not identify contents: those of the multiplexer
+        data provider name a run, tag, step and index, which a rewritten
+        run reuses. So entity tags and cached files derived from a blob
+        are keyed by this digest instead. The blob is only hashed once
+        per wall time recorded by `_record_wall_times`, and on every call
+        for keys that no listing has reported.
+        """
+        with self._digests_lock:
+            entry = self._digests.get(blob_key)
+            if entry is not None:
+                self._digests.move_to_end(blob_key)
+        if entry is not None and entry[1] is not None:
+            return entry[1]
+        digest = _content_etag(self._read_video(ctx, experiment, blob_key))
+        if entry is not None:
+            with self._digests_lock:
+                if self._digests.get(blob_key, (None,))[0] == entry[0]:
+                    self._digests[blob_key] = (entry[0], digest)
+        return digest
+
+    def _read_video(self, ctx, experiment, blob_key):
+        """Reads a video blob, joined with the earlier steps of its stream.
+
+        The segments of a `VideoStream` are joined with those of the
+        steps before them, as of the last `/videos` listing, back to the
+        one that starts the stream, so that each step plays the stream
+        up to it. If a segment in between is missing, for instance
+        because it was sampled out, the blob is returned alone.
+        """
+        data = self._read_blob(ctx, experiment, blob_key)
+        with self._neighbors_lock:
+            (previous_key, _, stream) = self._neighbors.get(
+                blob_key, (None, None, False)
+            )
+        if not stream:
+            return data
+        try:
+            numbers = mp4.fragment_sequence_numbers(data)
+            segments = [data]
+            while numbers is not None and numbers[0] > 1:
+                if previous_key is None:
+                    return data
+                previous = self._read_blob(ctx, experiment, previous_key)
+                previous_numbers = mp4.fragment_sequence_numbers(previous)
+                if (
+                    previous_numbers is None
+                    or previous_numbers[1] != numbers[0] - 1
+                ):
+                    return data
+                segments.append(previous)
+                numbers = previous_numbers
+                with self._neighbors_lock:
+                    (previous_key, _, _) = self._neighbors.get(
+                        previous_key, (None, None, False)
+                    )
+            if len(segments) == 1:
+                return data
+            return mp4.join_fragments(segments[::-1])
+        except (mp4.Mp4Error, struct.error):
+            return data
+
+    def _is_listed_run(self, ctx, experiment, blob_key):
+        """Whether `blob_key` names a run the data provider lists for
+        `experiment`.
+
+        Blob keys come from requests, so the event file fast path only
+        reads runs the data provider would serve anyway.
+        """
+        fields = event_index.decode_blob_key(blob_key)
+        if fields is None or fields[0] != experiment:
+            return False
+        runs = self._data_provider.list_runs(ctx, experiment_id=experiment)
+        return any(run.run_name == fields[2] for run in runs)
+
+    def _resolve_blob_key(self, ctx, experiment, blob_key):
+        """Returns the key of the blob holding the video of `blob_key`.
+
+        That is `blob_key` itself, unless the blob is a reference written
+        in place of a duplicate video (see `dedup`). The original is then
+        looked up by digest among the loaded videos of the tag named in
+        the reference, in every run, reading each candidate's digest only
+        once. Unless TensorBoard keeps every video, the original may have
+        been sampled out, and the reference cannot be resolved.
+
+        Raises:
+          ValueError: If the blob is a corrupt reference.
+          errors.NotFoundError: If the original cannot be found.
+        """
+        digest = self._blob_digest(ctx, experiment, blob_key)
+        memo_key = (experiment, digest)
+        with self._dedup_lock:
+            if memo_key in self._resolved_keys:
+                self._resolved_keys.move_to_end(memo_key)
+                return self._resolved_keys[memo_key] or blob_key
+        if "tracks:%s" % digest in self._track_cache:
+            resolved_key = None  # Only videos are demuxed.
+        else:
+            data = self._read_blob(ctx, experiment, blob_key)
+            if dedup.is_reference(data):
+                (digest, tag) = dedup.decode_reference(data)
+                resolved_key = self._find_original(ctx, experiment, digest, tag)
+                if resolved_key is None:
+                    raise errors.NotFoundError(
+                        "No video with digest %s for tag %r; it may not be "
+                        "loaded unless TensorBoard runs with "
+                        "--samples_per_plugin videos=0"
+                        % (digest.hex(), tag)
+                    )
+            else:
+                resolved_key = None
+            del data
+        with self._dedup_lock:
+            self._resolved_keys[memo_key] = resolved_key
+            while len(self._resolved_keys) > _RESOLVED_KEYS_MEMO_SIZE:
+                self._resolved_keys.popitem(last=False)
+        return resolved_key or blob_key
+
+    def _find_original(self, ctx, experiment, digest, tag):
+        """Returns the key of a video of `tag` with `digest`, or `None`.
+
+        Candidates are remembered by blob key and wall time, so that the
+        originals of a rewritten run are read again.
+        """
+        with self._dedup_lock:
+            scanned_key = self._digest_keys.get(digest)
+        if scanned_key is not None:
+            (blob_key, wall_time) = scanned_key
+            with self._digests_lock:
+                entry = self._digests.get(blob_key)
+            if entry is None or entry[0] == wall_time:
+                return blob_key
+        all_videos = self._data_provider.read_blob_sequences(
+            ctx,
+            experiment_id=experiment,
+            plugin_name=metadata.PLUGIN_NAME,
+            downsample=_REFERENCE_SEARCH_LIMIT,
+            run_tag_filter=provider.RunTagFilter(tags=[tag]),
+        )
+        for tag_to_videos in all_videos.values():
+            # References point back in time, so search from the newest.
+            for datum in reversed(tag_to_videos.get(tag, [])):
+                if len(datum.values) < 3:
+                    continue
+                blob_key = datum.values[2].blob_key
+                scanned_key = (blob_key, datum.wall_time)
+                self._record_wall_times([blob_key], [datum.wall_time])
+                with self._dedup_lock:
+                    if scanned_key in self._scanned_keys:
+                        self._scanned_keys.move_to_end(scanned_key)
+                        if self._scanned_keys[scanned_key] == digest:
+                            return blob_key
+                        continue
+                found = dedup.read_digest(
+                    self._read_blob(ctx, experiment, blob_key)
+                )
+                with self._dedup_lock:
+                    self._remember_scanned(scanned_key, found)
+                if found == digest:
+                    return blob_key
+        return None
+
+    def _remember_scanned(self, scanned_key, found):
+        """Records the dedup digest read from a candidate original.
+
+        Must be called with `_dedup_lock` held.
+        """
+        self._scanned_keys[scanned_key] = found
+        if found is not None:
+            self._digest_keys[found] = scanned_key
+        while len(self._scanned_keys) > _RESOLVED_KEYS_MEMO_SIZE:
+            (old_key, old_digest) = self._scanned_keys.popitem(last=False)
+            if self._digest_keys.get(old_digest) == old_key:
+                del self._digest_keys[old_digest]
+
+    def _blob_etag(self, ctx, experiment, blob_key, *parts):
+        """Computes an entity tag for a response derived from a blob.
+
+        The tag hashes the blob's content digest (see `_blob_digest`)
+        along with `parts` naming the response.
+        """
+        return _content_etag(
+            *parts, self._blob_digest(ctx, experiment, blob_key)
+        )
 
     def _data_provider_query(self, blob_reference):
         return urllib.parse.urlencode({"blob_key": blob_reference.blob_key})
 
     @wrappers.Request.application
     def _serve_individual_video(self, request):
-        """Serves an individual video track."""
+        """Serves an individual video track.
+
+        The entity tag is a hash of the blob, so browsers can revalidate
+        their copy without downloading it again. The track is demuxed
+        into the track cache once and then streamed from there, so memory
+        use does not grow with the video size.
+        """
         try:
             ctx = plugin_util.context(request.environ)
+            experiment = plugin_util.experiment_id(request.environ)
             blob_key = request.args["blob_key"]
-            track_number = int(request.args["track_number"])
-            data = self._data_provider.read_blob(ctx, blob_key=blob_key)
-            track_data = self._split_video_data(data)[track_number]
-            return http_util.Respond(request, track_data, _VIDEO_MIMETYPE)
-        except (KeyError, IndexError):
+            track_number = _index_arg(request.args["track_number"])
+            with self._prefetcher.foreground():
+                resolved_key = self._resolve_blob_key(ctx, experiment, blob_key)
+                etag = self._blob_etag(
+                    ctx,
+                    experiment,
+                    resolved_key,
+                    "individualVideo",
+                    str(track_number),
+                )
+                if request.if_none_match.contains(etag):
+                    return _respond_cached(request, b"", _VIDEO_MIMETYPE, etag)
+                with self._pinned_track_paths(
+                    ctx, experiment, resolved_key
+                ) as track_paths:
+                    response = _respond_file(
+                        request, track_paths[track_number], _VIDEO_MIMETYPE, etag
+                    )
+        except (KeyError, IndexError, ValueError):
             return http_util.Respond(
                 request,
                 "Invalid run, tag, index, or sample",
                 "text/plain",
                 code=400,
             )
+        self._prefetch_neighbors(ctx, experiment, blob_key)
+        return response
 
-    def _split_video_data(self, mp4_data):
-        import ffmpeg
-        import tempfile
-        import os
+    @wrappers.Request.application
+    def _serve_raw_video(self, request):
+        """Serves a whole, possibly multitrack, video blob.
+
+        This lets the frontend split the tracks itself, downloading each
+        blob only once.
+        """
+        try:
+            ctx = plugin_util.context(request.environ)
+            experiment = plugin_util.experiment_id(request.environ)
+            blob_key = request.args["blob_key"]
+            resolved_key = self._resolve_blob_key(ctx, experiment, blob_key)
+            etag = self._blob_etag(ctx, experiment, resolved_key, "rawVideo")
+            if request.if_none_match.contains(etag):
+                return _respond_cached(request, b"", _VIDEO_MIMETYPE, etag)
+            data = self._read_video(ctx, experiment, resolved_key)
+        except (KeyError, ValueError):
+            return http_util.Respond(
+                request, "Invalid blob key", "text/plain", code=400
+            )
+        return _respond_buffer(request, data, _VIDEO_MIMETYPE, etag)
+
+    @wrappers.Request.application
+    def _serve_segments(self, request):
+        """Lists the fragments of a fragmented video track.
+
+        The frontend uses this to play long videos through MediaSource,
+        fetching only the fragments near the playhead from `/segment`.
+        """
+        try:
+            ctx = plugin_util.context(request.environ)
+            experiment = plugin_util.experiment_id(request.environ)
+            blob_key = request.args["blob_key"]
+            track_number = _index_arg(request.args["track_number"])
+            with self._prefetcher.foreground():
+                resolved_key = self._resolve_blob_key(ctx, experiment, blob_key)
+                etag = self._blob_etag(
+                    ctx, experiment, resolved_key, "segments", str(track_number)
+                )
+                if request.if_none_match.contains(etag):
+                    return _respond_cached(request, b"", "application/json", etag)
+                with self._pinned_track_paths(
+                    ctx, experiment, resolved_key
+                ) as track_paths:
+                    with mp4.open_mapped(track_paths[track_number]) as data:
+                        info = mp4.TrackInfo(data)
+                        (_, fragments) = info.fragments()
+        except (KeyError, IndexError):
+            return http_util.Respond(
+                request, "Invalid blob key or track", "text/plain", code=400
+            )
+        except (ValueError, struct.error) as e:
+            return http_util.Respond(request, str(e), "text/plain", code=400)
+        listing = {
+            "mimeType": info.mime_type,
+            "duration": fragments[-1]["end"] if fragments else info.duration,
+            "segments": [
+                {"start": fragment["start"], "end": fragment["end"]}
+                for fragment in fragments
+            ],
+        }
+        return _respond_cached(request, listing, "application/json", etag)
+
+    @wrappers.Request.application
+    def _serve_segment(self, request):
+        """Serves one fragment, or with `segment=init` the initialization
+        segment, of a fragmented video track listed by `/segments`."""
+        try:
+            ctx = plugin_util.context(request.environ)
+            experiment = plugin_util.experiment_id(request.environ)
+            blob_key = request.args["blob_key"]
+            track_number = _index_arg(request.args["track_number"])
+            segment = request.args["segment"]
+            with self._prefetcher.foreground():
+                resolved_key = self._resolve_blob_key(ctx, experiment, blob_key)
+                etag = self._blob_etag(
+                    ctx,
+                    experiment,
+                    resolved_key,
+                    "segment",
+                    str(track_number),
+                    segment,
+                )
+                if request.if_none_match.contains(etag):
+                    return _respond_cached(request, b"", _VIDEO_MIMETYPE, etag)
+                with self._pinned_track_paths(
+                    ctx, experiment, resolved_key
+                ) as track_paths:
+                    track_path = track_paths[track_number]
+                    with mp4.open_mapped(track_path) as data:
+                        (init, fragments) = mp4.TrackInfo(data).fragments()
+                    if segment == "init":
+                        byte_range = init
+                    else:
+                        byte_range = fragments[_index_arg(segment)]["range"]
+                    return _respond_file(
+                        request,
+                        track_path,
+                        _VIDEO_MIMETYPE,
+                        etag,
+                        byte_range=byte_range,
+                    )
+        except (KeyError, IndexError, ValueError, struct.error):
+            return http_util.Respond(
+                request,
+                "Invalid blob key, track, or segment",
+                "text/plain",
+                code=400,
+            )
 
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            temp_file.write(mp4_data)
-            temp_path = temp_file.name
+    @wrappers.Request.application
+    def _serve_composite(self, request):
+        """Serves all tracks of a video tiled into a single video.
 
+        Browsers then run one decoder per datum rather than one per track,
+        and the tracks cannot drift apart. The composite is transcoded on
+        first request and served from the track cache afterward.
+        """
         try:
-            probe = ffmpeg.probe(temp_path)
+            ctx = plugin_util.context(request.environ)
+            experiment = plugin_util.experiment_id(request.environ)
+            blob_key = request.args["blob_key"]
+            with self._prefetcher.foreground():
+                resolved_key = self._resolve_blob_key(ctx, experiment, blob_key)
+                etag = self._blob_etag(ctx, experiment, resolved_key, "composite")
+                if request.if_none_match.contains(etag):
+                    return _respond_cached(request, b"", _VIDEO_MIMETYPE, etag)
+                with self._pinned_composite(ctx, experiment, resolved_key) as paths:
+                    return _respond_file(request, paths[0], _VIDEO_MIMETYPE, etag)
+        except (KeyError, ValueError, struct.error):
+            return http_util.Respond(
+                request, "Invalid blob key", "text/plain", code=400
+            )
+
+    def _pinned_composite(self, ctx, experiment, blob_key):
+        """Pins the cached video tiling every track of a blob.
+
+        Returns:
+          A `TrackCache.pin` context, yielding a one-element list of paths.
+
+        Tracks are laid out in a near-square grid, in track order, each
+        scaled to fit a cell the size of the first track. The whole grid
+        is scaled down to fit within `_COMPOSITE_MAX_SIZE`.
+
+        Raises:
+          ValueError: If the blob is not a video ffmpeg can transcode.
+        """
+
+        def build(entry_dir):
+            with contextlib.ExitStack() as stack:
+                return build_composite(entry_dir, stack)
+
+        def build_composite(entry_dir, stack):
+            import ffmpeg
+
+            source_path = os.path.join(entry_dir, "blob.mp4")
+            data = self._read_video(ctx, experiment, blob_key)
+            if raw_video.is_raw(data):
+                # Tile the tracks encoded from the raw frames instead.
+                del data
+                track_paths = stack.enter_context(
+                    self._pinned_track_paths(ctx, experiment, blob_key)
+                )
+                with mp4.open_mapped(track_paths[0]) as data:
+                    info = mp4.TrackInfo(data)
+                count = len(track_paths)
+                streams = [ffmpeg.input(path)["v:0"] for path in track_paths]
+            else:
+                with open(source_path, "wb") as outfile:
+                    outfile.write(data)
+                del data
+                with mp4.open_mapped(source_path) as data:
+                    info = mp4.TrackInfo(data)
+                    count = len(mp4.video_traks(data, mp4.parse(data)))
+                source = ffmpeg.input(source_path)
+                streams = [source["v:%d" % i] for i in range(count)]
+            columns = math.ceil(math.sqrt(count))
+            rows = math.ceil(count / columns)
+            (max_width, max_height) = _COMPOSITE_MAX_SIZE
+            scale = min(
+                1.0,
+                max_width / (columns * info.width),
+                max_height / (rows * info.height),
+            )
+            # H.264 with 4:2:0 chroma needs even dimensions.
+            width = max(2, int(info.width * scale) // 2 * 2)
+            height = max(2, int(info.height * scale) // 2 * 2)
+            cells = [
+                stream.filter(
+                    "scale", width, height, force_original_aspect_ratio="decrease"
+                )
+                .filter("pad", width, height, "(ow-iw)/2", "(oh-ih)/2")
+                for stream in streams
+            ]
+            if count == 1:
+                tiled = cells[0]
+            else:
+                layout = "|".join(
+                    "%d_%d" % (i % columns * width, i // columns * height)
+                    for i in range(count)
+                )
+                tiled = ffmpeg.filter(
+                    cells, "xstack", inputs=count, layout=layout, fill="black"
+                )
+            out_path = os.path.join(entry_dir, "composite.mp4")
+            try:
+                (
+                    tiled.output(
+                        out_path,
+                        vcodec="libx264",
+                        pix_fmt="yuv420p",
+                        movflags=_FAST_START_MOVFLAGS,
+                        an=None,
+                    )
+                    .overwrite_output()
+                    .run(capture_stdout=True, capture_stderr=True)
+                )
+            except ffmpeg.Error as e:
+                logger.warning(
+                    "ffmpeg failed to composite the tracks of %s:\n%s",
+                    blob_key,
+                    e.stderr.decode(errors="replace"),
+                )
+                raise ValueError("Cannot composite video")
+            if os.path.exists(source_path):
+                os.unlink(source_path)
+            return [out_path]
+
+        digest = self._blob_digest(ctx, experiment, blob_key)
+        return self._track_cache.pin("composite:%s" % digest, build)
+
+    @wrappers.Request.application
+    def _serve_frame(self, request):
+        """Serves a single frame of a video track as a still image.
+
+        The frame shown at time `t` (in seconds) is decoded starting from
+        the keyframe before it, found in the track's frame index, rather
+        than from the start of the track. Frames are cached by their
+        position in the track, so nearby values of `t` share an image.
+        An optional `format` of `png` (the default) or `jpeg` selects the
+        image type.
+        """
+        try:
+            ctx = plugin_util.context(request.environ)
+            experiment = plugin_util.experiment_id(request.environ)
+            blob_key = request.args["blob_key"]
+            track_number = _index_arg(request.args["track_number"])
+            time = float(request.args["t"])
+            if not math.isfinite(time) or time < 0:
+                raise ValueError("Invalid time %r" % time)
+            (extension, content_type) = _FRAME_FORMATS[
+                request.args.get("format", "png")
+            ]
+            with self._prefetcher.foreground():
+                blob_key = self._resolve_blob_key(ctx, experiment, blob_key)
+                etag = self._blob_etag(
+                    ctx,
+                    experiment,
+                    blob_key,
+                    "frame",
+                    str(track_number),
+                    repr(time),
+                    extension,
+                )
+                if request.if_none_match.contains(etag):
+                    return _respond_cached(request, b"", content_type, etag)
+                with self._pinned_track_paths(
+                    ctx, experiment, blob_key
+                ) as track_paths:
+                    with self._pinned_frame(
+                        self._blob_digest(ctx, experiment, blob_key),
+                        track_number,
+                        track_paths[track_number],
+                        time,
+                        extension,
+                    ) as paths:
+                        return _respond_file(request, paths[0], content_type, etag)
+        except (KeyError, IndexError, ValueError, struct.error):
+            return http_util.Respond(
+                request,
+                "Invalid blob key, track, time, or format",
+                "text/plain",
+                code=400,
+            )
+
+    def _pinned_frame(self, digest, track_number, track_path, time, extension):
+        """Pins a cached image of the frame shown at `time`.
+
+        `digest` is the content digest of the blob `track_path` was
+        demuxed from, which must stay pinned until the context is entered.
+
+        Returns:
+          A `TrackCache.pin` context, yielding a one-element list of paths.
+
+        Raises:
+          ValueError: If the track has no frames, `time` is past its end,
+            or the frame cannot be decoded.
+        """
+        (frames, keyframes) = _frame_index(track_path)
+        if not frames:
+            raise mp4.Mp4Error("No frames")
+        # The last frame is shown for as long as the one before it.
+        end = 2 * frames[-1] - frames[-2] if len(frames) > 1 else frames[-1]
+        if time > end + _FRAME_TIME_SLACK:
+            raise ValueError("Time %r is past the end of the track" % time)
+        # Times come back from the browser rounded, so allow some slack.
+        frame_number = max(bisect.bisect_right(frames, time + 1e-6) - 1, 0)
+        frame_time = frames[frame_number]
+        keyframe_time = keyframes[
+            max(bisect.bisect_right(keyframes, frame_time) - 1, 0)
+        ]
+        # Output timestamps are relative to the keyframe seeked to. Frames
+        # stamped before the output seek point are dropped, so aim halfway
+        # between the wanted frame and the one before it.
+        lead = (frame_time - frames[frame_number - 1]) / 2 if frame_number else 0
+        key = "frame:%s:%d:%d:%s" % (
+            digest,
+            track_number,
+            frame_number,
+            extension,
+        )
+
+        def build(entry_dir):
+            import ffmpeg
+
+            out_path = os.path.join(entry_dir, "frame.%s" % extension)
+            try:
+                (
+                    ffmpeg.input(track_path, ss=keyframe_time - frames[0])
+                    .output(
+                        out_path,
+                        ss=max(frame_time - keyframe_time - lead, 0),
+                        map="0:v:0",
+                        vframes=1,
+                    )
+                    .overwrite_output()
+                    .run(capture_stdout=True, capture_stderr=True)
+                )
+            except ffmpeg.Error as e:
+                logger.warning(
+                    "ffmpeg failed to decode frame %d of %s:\n%s",
+                    frame_number,
+                    track_path,
+                    e.stderr.decode(errors="replace"),
+                )
+                raise ValueError("Cannot decode frame %d" % frame_number)
+            return [out_path]
+
+        return self._track_cache.pin(key, build)
+
+    def _track_paths(self, ctx, experiment, blob_key):
+        """Returns the paths of the demuxed tracks of a blob.
+
+        The blob is read and demuxed only on the first call for a given
+        key; later calls are served from the track cache. The files may be
+        evicted at any time, so to read them use `_pinned_track_paths`.
+        """
+        digest = self._blob_digest(ctx, experiment, blob_key)
+        return self._track_cache.get(
+            "tracks:%s" % digest, self._track_builder(ctx, experiment, blob_key)
+        )
+
+    def _pinned_track_paths(self, ctx, experiment, blob_key):
+        """Pins the demuxed tracks of a blob in the track cache.
+
+        Returns:
+          A `TrackCache.pin` context, yielding the paths of the tracks.
+        """
+        digest = self._blob_digest(ctx, experiment, blob_key)
+        return self._track_cache.pin(
+            "tracks:%s" % digest, self._track_builder(ctx, experiment, blob_key)
+        )
+
+    def _track_builder(self, ctx, experiment, blob_key):
+        def build(entry_dir):
+            source_path = os.path.join(entry_dir, "blob.mp4")
+            data = self._read_video(ctx, experiment, blob_key)
+            if raw_video.is_raw(data):
+                return self._encode_raw_video(data, entry_dir)
+            with open(source_path, "wb") as outfile:
+                outfile.write(data)
+            del data
+            return self._split_video_file(source_path, entry_dir)
+
+        return build
+
+    def _encode_raw_video(self, data, out_dir):
+        """Encodes each track of a raw frame blob into its own MP4 file.
+
+        Frames are decompressed a chunk at a time and fed straight to the
+        encoder, so the uncompressed video is never held in memory.
+
+        Args:
+          data: A blob in the `raw_video` format.
+          out_dir: Directory to write the single-track files to.
+
+        Returns:
+          A list of paths, one per track.
+
+        Raises:
+          ValueError: If the blob is corrupt or cannot be encoded.
+        """
+        reader = raw_video.Reader(data)
+        frame_size = reader.height * reader.width * reader.channels
+        chunk_frames = max(1, _RAW_VIDEO_CHUNK_SIZE // max(1, frame_size))
+        paths = []
+        for track in reader.tracks(chunk_frames):
+            out_path = os.path.join(out_dir, "track_%d.mp4" % len(paths))
+            try:
+                video = encoder.encode([_even_sized(track)], reader.fps)
+            except ValueError:
+                raise
+            except Exception as e:
+                logger.warning("Failed to encode raw frames: %s", e)
+                raise ValueError("Cannot encode raw video")
+            with open(out_path, "wb") as outfile:
+                outfile.write(video)
+            paths.append(out_path)
+        return paths
+
+    def _split_video_file(self, source_path, out_dir):
+        """Demuxes each video stream of an MP4 file into its own file.
+
+        Args:
+          source_path: Path to a (possibly multitrack) MP4 file.
+          out_dir: Directory to write the single-track files to.
+
+        Returns:
+          A list of paths, one per video track. If the file cannot be
+          demuxed, this is `[source_path]`; otherwise `source_path` is
+          deleted.
+        """
+        import ffmpeg
+
+        output_args = {"movflags": _FAST_START_MOVFLAGS}
+        try:
+            with mp4.open_mapped(source_path) as data:
+                if mp4.TrackInfo(data).fragmented:
+                    output_args["movflags"] = _FRAGMENTED_MOVFLAGS
+        except (mp4.Mp4Error, struct.error):
+            pass  # Leave it to ffmpeg to make sense of the file.
+        try:
+            probe = ffmpeg.probe(source_path)
             video_streams = [stream for stream in probe['streams'] if stream['codec_type'] == 'video']
             separate_videos = []
             for stream in video_streams:
-                with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as out_file:
-                    out_path = out_file.name
+                out_path = os.path.join(
+                    out_dir, "track_%d.mp4" % len(separate_videos)
+                )
+                separate_videos.append(out_path)
                 try:
                     stream = (
                         ffmpeg
-                        .input(temp_path)
-                        .output(out_path, map=f"0:{stream['index']}", codec='copy')
+                        .input(source_path)
+                        .output(out_path, map=f"0:{stream['index']}", codec='copy', **output_args)
                         .overwrite_output()
                     )
                     stream.run(capture_stdout=True, capture_stderr=True)
-                    with open(out_path, 'rb') as f:
-                        separate_videos.append(f.read())
                 except ffmpeg.Error as e:
                     print(f"FFmpeg stderr:\n{e.stderr.decode()}")
                     raise
-                finally:
-                    try:
-                        os.unlink(out_path)
-                    except:
-                        pass
-            return separate_videos if separate_videos else [mp4_data]  # Fallback
-
         except Exception as e:
             print(f"Error processing video: {str(e)}")
-            return [mp4_data]
+            separate_videos = []
 
-        finally:
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+        if not separate_videos:
+            for name in os.listdir(out_dir):
+                path = os.path.join(out_dir, name)
+                if path != source_path:
+                    os.unlink(path)
+            return [source_path]  # Fallback
+        os.unlink(source_path)
+        return separate_videos
 
     @wrappers.Request.application
     def _serve_tags(self, request):
         ctx = plugin_util.context(request.environ)
         experiment = plugin_util.experiment_id(request.environ)
-        index = self._index_impl(ctx, experiment)
-        return http_util.Respond(request, index, "application/json")
+        index, etag = self._index_and_etag(ctx, experiment)
+        return _respond_cached(request, index, "application/json", etag)
 
     @wrappers.Request.application
     def _serve_js(self, request):
-        del request  # unused
-        filepath = os.path.join(os.path.dirname(__file__), "static", "index.js")
-        with open(filepath) as infile:
-            contents = infile.read()
-        return wrappers.Response(contents, content_type="text/javascript")
+        # Only routed for the ES modules under `static/`.
+        contents, version = _static_asset(os.path.basename(request.path))
+        return _respond_cached(
+            request,
+            contents,
+            "text/javascript",
+            version,
+            immutable=request.args.get("v") == version,
+        )